@@ -0,0 +1,130 @@
+"""Offline stand-ins for the OpenAI chat models and the LangChain Hub prompts"""
+import json
+import random
+import re
+import time
+import uuid
+from datetime import date, timedelta
+from typing import Any, Optional
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.utils.function_calling import convert_to_openai_function, convert_to_openai_tool
+from src.prompts import PromptRegistry
+
+SCHEDULING = re.compile(r"\b(book|schedul\w*|appointment|availab\w*|tomorrow|slot|morning|afternoon)\b", re.I)
+EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+")
+
+
+def _last_user_text(messages: list[BaseMessage]) -> str:
+    for m in reversed(messages):
+        if isinstance(m, HumanMessage) and not m.name:
+            return m.content if isinstance(m.content, str) else str(m.content)
+    return ""
+
+
+def _tool_call(name: str, args: dict) -> AIMessage:
+    return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:12]}"}])
+
+
+def scripted_reply(messages: list[BaseMessage], tools: list[str], functions: list[str]) -> AIMessage:
+    """
+    Deterministic stand-in for what the real prompts make the models do:
+    the supervisor picks a worker, the Scheduler checks the calendar and books
+    when it has an email, everything else gets a canned answer.
+    """
+    text = _last_user_text(messages)
+    if "route" in functions:
+        worker = "Scheduler" if SCHEDULING.search(text) else "NewJob"
+        return AIMessage(content="", additional_kwargs={"function_call": {"name": "route", "arguments": json.dumps({"next": worker})}})
+    if isinstance(messages[-1], ToolMessage):
+        result = messages[-1].content
+        if "successfully booked" in result:
+            return AIMessage(content="Your appointment is successfully booked. See you then!")
+        if "available_times" in result:
+            return AIMessage(content="We have openings tomorrow at 10:00 and 14:00. Which time works for you?")
+        return AIMessage(content="Sorry, I could not check the calendar right now. Could you try again later?")
+    tomorrow = date.today() + timedelta(days=1)
+    email = EMAIL.search(text)
+    if "book_appointment" in tools and email:
+        return _tool_call("book_appointment", {
+            "name": "Bench Customer",
+            "email": email.group(0),
+            "date": f"{tomorrow.isoformat()}T10:00:00.000Z",
+            "address": "1 Main St, Springfield",
+        })
+    if "check_calendar" in tools and SCHEDULING.search(text):
+        return _tool_call("check_calendar", {"start_date": tomorrow.isoformat(), "end_date": (tomorrow + timedelta(days=2)).isoformat()})
+    if tools:
+        return AIMessage(content="A standard deep cleaning starts at $120 for up to 3 rooms. Let me know when you would like us to come by.")
+    return AIMessage(content="The customer asked about pricing and availability for a home cleaning.")
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that sleeps for a configurable latency and answers from `scripted_reply`."""
+
+    model: str = "fake"
+    latency: float = 0.5
+    jitter: float = 0.1
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools: list, **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def bind_functions(self, functions: list, function_call: Optional[str] = None, **kwargs: Any):
+        functions = [convert_to_openai_function(f) for f in functions]
+        if function_call is not None:
+            kwargs["function_call"] = {"name": function_call}
+        return self.bind(functions=functions, **kwargs)
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+        tools = [t["function"]["name"] for t in kwargs.get("tools", [])]
+        functions = [f["name"] for f in kwargs.get("functions", [])]
+        message = scripted_reply(messages, tools, functions)
+        # rough token counts so the usage metrics have something to show
+        prompt_tokens = sum(len(str(m.content)) for m in messages) // 4
+        completion_tokens = max(1, len(str(message.content)) // 4)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output={"token_usage": usage, "model_name": self.model})
+
+
+def fake_chat_model_factory(latency: float, jitter: float):
+    def factory(model: str, **kwargs) -> FakeChatModel:
+        return FakeChatModel(model=model, latency=latency, jitter=jitter)
+
+    return factory
+
+
+BENCH_PROMPTS = {
+    "customer_support_chatbot": ChatPromptTemplate.from_messages([
+        ("system", "You are Sweep customer support. Today is {time}. The customer is {user_id}."),
+        MessagesPlaceholder("messages"),
+    ]),
+    "sweep_agent_routing": ChatPromptTemplate.from_messages([
+        ("system", "Route the conversation to one of {options}."),
+        MessagesPlaceholder("messages"),
+    ]),
+    "sweep_scheduling": ChatPromptTemplate.from_messages([
+        ("system", "You book Sweep appointments. Today is {time}."),
+        MessagesPlaceholder("messages"),
+        MessagesPlaceholder("agent_scratchpad"),
+    ]),
+    "sweep_briefing": ChatPromptTemplate.from_messages([
+        ("system", "You answer questions about Sweep services and prepare job briefs."),
+        MessagesPlaceholder("messages"),
+        MessagesPlaceholder("agent_scratchpad"),
+    ]),
+    "book_appointment_tool": ChatPromptTemplate.from_messages([
+        ("system", "Books an appointment for the customer at one of the available timestamps."),
+    ]),
+}
+
+
+def seed_prompts(registry: PromptRegistry) -> None:
+    for name, prompt in BENCH_PROMPTS.items():
+        registry.seed(name, prompt)
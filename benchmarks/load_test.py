@@ -0,0 +1,213 @@
+"""
+Offline load test of the /message pipeline.
+
+Boots the app with fake chat models, stub Twilio and webhook servers and a
+SQLite database, drives /message with concurrent simulated senders and reports
+end-to-end reply latency (inbound POST to the reply reaching the Twilio stub),
+throughput and a per-stage breakdown from the app's own metrics.
+
+    python -m benchmarks.load_test --senders 50 --messages 3 --llm-latency 0.4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+CONVERSATION = [
+    "Hi! How much does a deep cleaning cost?",
+    "Do you have availability tomorrow morning?",
+    "Please book 10am, my email is bench@example.com and the address is 1 Main St",
+]
+
+
+def configure_env(args: argparse.Namespace, workdir: Path) -> None:
+    """Everything is read by decouple at import time, so this runs before the app is imported."""
+    stub = f"http://127.0.0.1:{args.stub_port}"
+    env = {
+        "TWILIO_ACCOUNT_SID": "ACbench",
+        "TWILIO_AUTH_TOKEN": "bench",
+        "TWILIO_NUMBER": "+15550000000",
+        "TWILIO_API_BASE": stub,
+        "CC_WEBHOOK_URL": f"{stub}/calendar",
+        "PCP_WEBHOOK_URL": f"{stub}/booking",
+        "OPENAI_API_KEY": "sk-bench",
+        "DATABASE_URL": args.database or f"sqlite:///{workdir / 'bench.db'}",
+        "CHECKPOINTER": args.checkpointer,
+        "CHECKPOINT_SPILL_PATH": str(workdir / "spill.sqlite"),
+        "PROMPT_CACHE_DIR": str(workdir / "prompts"),
+        "PROMPT_REFRESH_SECONDS": "0",
+    }
+    if args.debounce is not None:
+        env["MAILBOX_DEBOUNCE_SECONDS"] = str(args.debounce)
+    if args.workers is not None:
+        env["AGENT_WORKERS"] = str(args.workers)
+    for key, value in env.items():
+        os.environ.setdefault(key, value)
+
+
+def percentile(samples: list[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def bucket_quantile(buckets: tuple, counts: list[int], total: int, q: float) -> float:
+    for bound, count in zip(buckets, counts):
+        if count >= q * total:
+            return bound
+    return float("inf")
+
+
+async def run_sender(client, stubs, index: int, args, latencies: list, failures: list, duplicates: list, shed: list) -> None:
+    phone = f"+1555{index:07d}"
+    for i in range(args.messages):
+        form = {"From": f"whatsapp:{phone}", "Body": CONVERSATION[i % len(CONVERSATION)], "MessageSid": f"SM{uuid.uuid4().hex}"}
+        inbox = stubs.inbox(phone)
+        start = time.perf_counter()
+        response = await client.post("/message", data=form)
+        if response.status_code != 200:
+            failures.append(f"{phone}: HTTP {response.status_code}")
+            continue
+        status = response.json().get("status")
+        if status != "queued":
+            # shed or rate limited: at most a busy notice comes back, never an agent reply
+            shed.append(status)
+            try:
+                await asyncio.wait_for(inbox.get(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        if random.random() < args.redelivery_rate:
+            # what Twilio does when it thinks the first delivery failed
+            redelivery = await client.post("/message", data=form)
+            duplicates.append(redelivery.json().get("status") == "duplicate")
+        try:
+            arrived, _ = await asyncio.wait_for(inbox.get(), timeout=args.timeout)
+        except asyncio.TimeoutError:
+            failures.append(f"{phone}: no reply within {args.timeout}s")
+            continue
+        latencies.append(arrived - start)
+        if args.think_time:
+            await asyncio.sleep(args.think_time)
+
+
+async def serve(app, port: int):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def main(args: argparse.Namespace) -> dict:
+    import httpx
+    from benchmarks.fakes import fake_chat_model_factory, seed_prompts
+    from benchmarks.stubs import StubServices
+    from src import main as app_module
+    from src.llm import set_chat_model_factory
+    from src.prompts import prompt_registry
+    from src.telemetry import stage_latency
+
+    set_chat_model_factory(fake_chat_model_factory(args.llm_latency, args.llm_jitter))
+    seed_prompts(prompt_registry)
+    stubs = StubServices(twilio_latency=args.twilio_latency, webhook_latency=args.webhook_latency)
+
+    stub_server, stub_task = await serve(stubs.app, args.stub_port)
+    app_server, app_task = await serve(app_module.app, args.port)
+    latencies, failures, duplicates, shed = [], [], [], []
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=30.0) as client:
+            start = time.perf_counter()
+            await asyncio.gather(*(run_sender(client, stubs, i, args, latencies, failures, duplicates, shed) for i in range(args.senders)))
+            elapsed = time.perf_counter() - start
+    finally:
+        app_server.should_exit = True
+        await app_task
+        stub_server.should_exit = True
+        await stub_task
+
+    stages = {}
+    for (stage, name), (count, total, counts) in sorted(stage_latency.snapshot().items()):
+        stages[f"{stage}:{name}"] = {
+            "count": count,
+            "mean": round(total / count, 4) if count else 0.0,
+            "p95_bucket": bucket_quantile(stage_latency.buckets, counts, count, 0.95),
+        }
+    return {
+        "config": {k: v for k, v in vars(args).items() if k != "json"},
+        "messages": len(latencies),
+        "failures": failures,
+        "shed": {status: shed.count(status) for status in set(shed)},
+        "redeliveries": {"sent": len(duplicates), "deduplicated": sum(duplicates)},
+        "elapsed": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency": {
+            "p50": round(percentile(latencies, 0.5), 4),
+            "p95": round(percentile(latencies, 0.95), 4),
+            "p99": round(percentile(latencies, 0.99), 4),
+            "mean": round(statistics.fmean(latencies), 4) if latencies else 0.0,
+        },
+        "stages": stages,
+        "router": app_module.router.stats(),
+        "response_cache": app_module.response_cache.stats(),
+        "admission": app_module.admission.stats(),
+        "stub_calls": stubs.calls,
+    }
+
+
+def print_report(report: dict) -> None:
+    latency = report["latency"]
+    print(f"messages: {report['messages']}  failures: {len(report['failures'])}  elapsed: {report['elapsed']}s  throughput: {report['throughput']} msg/s")
+    print(f"reply latency  p50 {latency['p50']}s  p95 {latency['p95']}s  p99 {latency['p99']}s  mean {latency['mean']}s")
+    print(f"{'stage':<40}{'count':>8}{'mean s':>10}{'p95 <= s':>10}")
+    for name, stage in report["stages"].items():
+        print(f"{name:<40}{stage['count']:>8}{stage['mean']:>10}{stage['p95_bucket']:>10}")
+    print(f"router: {report['router']}")
+    print(f"response cache: {report['response_cache']}")
+    print(f"shed: {report['shed']}  admission: {report['admission']}")
+    print(f"redeliveries: {report['redeliveries']}")
+    print(f"stub calls: {report['stub_calls']}")
+    for failure in report["failures"][:10]:
+        print(f"failed: {failure}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--senders", type=int, default=20, help="concurrent simulated senders")
+    parser.add_argument("--messages", type=int, default=3, help="messages per sender, each waits for the previous reply")
+    parser.add_argument("--redelivery-rate", type=float, default=0.0, help="fraction of messages Twilio delivers twice")
+    parser.add_argument("--think-time", type=float, default=0.0, help="pause between a reply and the next message")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="mean fake chat model latency in seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.1)
+    parser.add_argument("--webhook-latency", type=float, default=0.1)
+    parser.add_argument("--twilio-latency", type=float, default=0.02)
+    parser.add_argument("--debounce", type=float, default=None, help="override MAILBOX_DEBOUNCE_SECONDS")
+    parser.add_argument("--workers", type=int, default=None, help="override AGENT_WORKERS")
+    parser.add_argument("--checkpointer", default="memory", choices=["memory", "bounded", "postgres"])
+    parser.add_argument("--database", default=None, help="SQLAlchemy URL, defaults to a temporary SQLite file")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for each reply")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--stub-port", type=int, default=8766)
+    parser.add_argument("--json", default=None, help="also write the report to this file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="sweep-bench-") as workdir:
+        configure_env(args, Path(workdir))
+        report = asyncio.run(main(args))
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
@@ -0,0 +1,169 @@
+"""
+Replay recorded conversations offline and diff them against their recording.
+
+Cassettes are written by the app with CASSETTE_MODE=record (see
+src/cassette.py). Each cassette is replayed turn by turn through the same
+pipeline as /message, on a fresh SQLite database and in-memory checkpointer,
+with chat model calls and scheduling webhooks answered from the recording.
+The report shows, per turn, whether the reply changed, which LLM requests and
+webhook payloads differ from the recording, and how the time spent in local
+code (turn time minus LLM and webhook time) compares.
+
+    python -m benchmarks.replay cassettes/ --realtime
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+
+def configure_env(args: argparse.Namespace, workdir: Path) -> None:
+    """Everything is read by decouple at import time, so this runs before the app is imported."""
+    defaults = {
+        "TWILIO_ACCOUNT_SID": "ACreplay",
+        "TWILIO_AUTH_TOKEN": "replay",
+        "TWILIO_NUMBER": "+15550000000",
+        "OPENAI_API_KEY": "sk-replay",
+        "CC_WEBHOOK_URL": "http://cassette.invalid/calendar",
+        "PCP_WEBHOOK_URL": "http://cassette.invalid/booking",
+        "PROMPT_CACHE_DIR": args.prompt_cache,
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+    # these make the replay deterministic, they always win over the environment
+    os.environ.update({
+        "CASSETTE_MODE": "replay",
+        "CASSETTE_REALTIME": str(args.realtime).lower(),
+        "DATABASE_URL": f"sqlite:///{workdir / 'replay.db'}",
+        "CHECKPOINTER": "memory",
+        "PROMPT_REFRESH_SECONDS": "0",
+        "LLM_HEDGE": "false",
+        "LLM_RETRIES": "0",
+        "RESPONSE_CACHE_ENABLED": "false",
+        "AVAILABILITY_TTL_SECONDS": "0",
+        "USAGE_DOWNGRADE_TOKENS": "0",
+        "USAGE_HANDOFF_TOKENS": "0",
+    })
+
+
+def cassette_files(paths: list[str]) -> list[Path]:
+    files = []
+    for path in map(Path, paths):
+        files += sorted(path.glob("*.jsonl.gz")) if path.is_dir() else [path]
+    return files
+
+
+def external_seconds(turn: dict) -> float:
+    """Time spent waiting on the LLM and the webhooks, what remains of a turn is local code."""
+    return sum(e.get("latency", 0.0) for e in turn["llm"]) + sum(e.get("latency", 0.0) for e in turn["webhooks"])
+
+
+def diff_turn(recorded: dict, replayed: dict, realtime: bool) -> dict:
+    recorded_local = max(0.0, recorded["elapsed"] - external_seconds(recorded))
+    # without --realtime the stand-ins answer instantly, the whole replay is local time
+    replayed_local = max(0.0, replayed["elapsed"] - (external_seconds(replayed) if realtime else 0.0))
+    return {
+        "text": recorded["text"],
+        "reply_changed": replayed["outbound"] != recorded["outbound"],
+        "recorded_reply": " ".join(recorded["outbound"]),
+        "replayed_reply": " ".join(replayed["outbound"]),
+        "llm_calls": [len(recorded["llm"]), len(replayed["llm"])],
+        "llm_requests_changed": sum(1 for e in replayed["llm"] if e["request"] != e["recorded_request"]),
+        "webhooks": [len(recorded["webhooks"]), len(replayed["webhooks"])],
+        "webhook_payloads_changed": sum(1 for e in replayed["webhooks"] if not e["matched"]),
+        "elapsed": [round(recorded["elapsed"], 4), round(replayed["elapsed"], 4)],
+        "local": [round(recorded_local, 4), round(replayed_local, 4)],
+        "error": replayed.get("error"),
+    }
+
+
+def replay_cassette(path: Path, realtime: bool) -> dict:
+    from src import main as app_module
+    from src.cassette import SUMMARY_CHANNEL, load_state, read_cassette, replaying
+    from src.db.session import SessionLocal
+    from src.outbound import split_message
+
+    turns = read_cassette(path)
+    sender = turns[0]["sender"]
+    results = []
+    with SessionLocal() as db:
+        thread_id = app_module.get_or_create_thread_id(db, sender)
+        initial_state = turns[0].get("initial_state")
+        if initial_state:
+            # the recording started mid-conversation, pick it up from the same state
+            app_module.get_multi_agent_graph().update_state(
+                app_module.build_config(sender, thread_id), load_state(initial_state), as_node="NewJob",
+            )
+        for recorded in turns:
+            with replaying(recorded) as turn:
+                try:
+                    if recorded["channel"] == SUMMARY_CHANNEL:
+                        # the background history summary that ran after the previous reply
+                        app_module.summarize_after_reply(db, sender)
+                    else:
+                        reply = app_module.get_response(db, recorded["text"], sender, recorded["channel"])
+                        turn.outbound = split_message(reply)
+                except Exception as e:
+                    turn.outbound, error = [], repr(e)
+                else:
+                    error = None
+            results.append(diff_turn(recorded, {**turn.to_dict(), "error": error}, realtime))
+    return {"cassette": str(path), "sender": sender, "turns": results}
+
+
+def main(args: argparse.Namespace) -> dict:
+    from src import main as app_module
+
+    app_module.init_db()
+    start = time.perf_counter()
+    cassettes = [replay_cassette(path, args.realtime) for path in cassette_files(args.cassettes)]
+    turns = [t for c in cassettes for t in c["turns"]]
+    return {
+        "elapsed": round(time.perf_counter() - start, 3),
+        "turns": len(turns),
+        "replies_changed": sum(1 for t in turns if t["reply_changed"]),
+        "errors": sum(1 for t in turns if t["error"]),
+        "local_seconds": [round(sum(t["local"][0] for t in turns), 4), round(sum(t["local"][1] for t in turns), 4)],
+        "cassettes": cassettes,
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"turns: {report['turns']}  replies changed: {report['replies_changed']}  errors: {report['errors']}  elapsed: {report['elapsed']}s")
+    recorded, replayed = report["local_seconds"]
+    print(f"local code time  recorded {recorded}s  replayed {replayed}s  diff {round(replayed - recorded, 4)}s")
+    print(f"{'turn':<40}{'reply':>9}{'llm':>8}{'req diff':>10}{'hooks':>8}{'hook diff':>11}{'local rec':>11}{'local rep':>11}")
+    for cassette in report["cassettes"]:
+        print(f"{cassette['cassette']} ({cassette['sender']})")
+        for t in cassette["turns"]:
+            status = "error" if t["error"] else "changed" if t["reply_changed"] else "same"
+            print(
+                f"  {t['text'][:38]:<38}{status:>9}{'/'.join(map(str, t['llm_calls'])):>8}{t['llm_requests_changed']:>10}"
+                f"{'/'.join(map(str, t['webhooks'])):>8}{t['webhook_payloads_changed']:>11}{t['local'][0]:>11}{t['local'][1]:>11}"
+            )
+            if t["error"]:
+                print(f"    error: {t['error']}")
+            elif t["reply_changed"]:
+                print(f"    recorded: {t['recorded_reply'][:200]}")
+                print(f"    replayed: {t['replayed_reply'][:200]}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("cassettes", nargs="+", help="cassette files or directories of them")
+    parser.add_argument("--realtime", action="store_true", help="replayed calls take as long as the recorded ones")
+    parser.add_argument("--prompt-cache", default=".prompt_cache", help="warm prompt cache, the replay never pulls from the hub")
+    parser.add_argument("--json", default=None, help="also write the report to this file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="sweep-replay-") as workdir:
+        configure_env(args, Path(workdir))
+        report = main(args)
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
@@ -0,0 +1,51 @@
+"""Local stand-ins for the Twilio Messages API and the scheduling webhooks"""
+import asyncio
+import time
+import uuid
+from datetime import date, timedelta
+from fastapi import FastAPI, Form, Request
+
+
+class StubServices:
+    """
+    One FastAPI app serving the Twilio Messages endpoint and the calendar and
+    booking webhooks with configurable latency. Every reply the app sends is
+    queued per recipient so the load driver can wait for it.
+    """
+
+    def __init__(self, twilio_latency: float = 0.02, webhook_latency: float = 0.1):
+        self.twilio_latency = twilio_latency
+        self.webhook_latency = webhook_latency
+        self.replies: dict[str, asyncio.Queue] = {}
+        self.calls = {"twilio": 0, "calendar": 0, "booking": 0}
+        self.app = FastAPI()
+        self.app.post("/2010-04-01/Accounts/{account_sid}/Messages.json", status_code=201)(self.twilio_message)
+        self.app.post("/calendar")(self.calendar)
+        self.app.post("/booking")(self.booking)
+
+    def inbox(self, to: str) -> asyncio.Queue:
+        return self.replies.setdefault(to.removeprefix("whatsapp:"), asyncio.Queue())
+
+    async def twilio_message(self, account_sid: str, To: str = Form(), From: str = Form(), Body: str = Form()):
+        self.calls["twilio"] += 1
+        await asyncio.sleep(self.twilio_latency)
+        self.inbox(To).put_nowait((time.perf_counter(), Body))
+        return {"sid": f"SM{uuid.uuid4().hex}", "status": "queued", "to": To, "from": From}
+
+    async def calendar(self, request: Request):
+        self.calls["calendar"] += 1
+        payload = await request.json()
+        await asyncio.sleep(self.webhook_latency)
+        start, end = date.fromisoformat(payload["start_date"]), date.fromisoformat(payload["end_date"])
+        slots = {}
+        day = start
+        while day <= end:
+            slots[day.isoformat()] = [{"time": f"{day.isoformat()}T{hour:02d}:00:00.000Z"} for hour in (10, 14)]
+            day += timedelta(days=1)
+        return {"description": "Times are in UTC", "data": {"slots": slots}}
+
+    async def booking(self, request: Request):
+        self.calls["booking"] += 1
+        await request.json()
+        await asyncio.sleep(self.webhook_latency)
+        return {"status": "booked"}
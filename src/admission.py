@@ -0,0 +1,100 @@
+"""Admission control for inbound messages: per-sender rate limits, load shedding and booking priority"""
+from typing import Callable
+from decouple import config
+from src.routing import BOOKED
+from utils.cache import TTLCache
+from utils.ratelimit import TokenBucket
+
+# per sender: sustained messages per second and burst size
+ADMISSION_SENDER_RATE = config("ADMISSION_SENDER_RATE", default=0.2, cast=float)
+ADMISSION_SENDER_BURST = config("ADMISSION_SENDER_BURST", default=6.0, cast=float)
+# jobs running or queued on the agent pool: new conversations are shed from SHED_AT,
+# threads in the middle of a booking are still let through up to MAX_IN_FLIGHT
+ADMISSION_SHED_AT = config("ADMISSION_SHED_AT", default=96, cast=int)
+ADMISSION_MAX_IN_FLIGHT = config("ADMISSION_MAX_IN_FLIGHT", default=160, cast=int)
+ADMISSION_BOOKING_TTL = config("ADMISSION_BOOKING_TTL", default=1800.0, cast=float)
+# a shed sender gets the busy reply at most once per window
+ADMISSION_NOTICE_WINDOW = config("ADMISSION_NOTICE_WINDOW", default=600.0, cast=float)
+ADMISSION_BUSY_MESSAGE = config(
+    "ADMISSION_BUSY_MESSAGE",
+    default="Thanks for your message! We're handling a lot of requests right now and will get back to you shortly.",
+)
+
+ADMITTED = "admitted"
+RATE_LIMITED = "rate_limited"
+SHED = "shed"
+
+PRIORITY_BOOKING = 0
+PRIORITY_DEFAULT = 1
+# housekeeping jobs such as history summaries, behind every reply
+PRIORITY_BACKGROUND = 2
+
+
+class AdmissionController:
+    """
+    Decides, before any agent work is queued, whether a message runs now.
+
+    `load` returns the number of jobs running or queued on the agent pool.
+    A message from a sender who already has messages waiting just joins them
+    and adds no load, even over the sender's rate. Otherwise it is shed once
+    the load reaches `shed_at`, or `max_in_flight` for senders in the middle
+    of a booking, which also jump the agent queue.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[], int],
+        rate: float = ADMISSION_SENDER_RATE,
+        burst: float = ADMISSION_SENDER_BURST,
+        shed_at: int = ADMISSION_SHED_AT,
+        max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+    ):
+        self.load = load
+        self.rate = rate
+        self.burst = burst
+        self.shed_at = shed_at
+        self.max_in_flight = max_in_flight
+        # idle buckets are full again after burst / rate seconds, forgetting them then is lossless
+        self._buckets = TTLCache(maxsize=100000, ttl=max(60.0, burst / rate))
+        self._booking = TTLCache(maxsize=100000, ttl=ADMISSION_BOOKING_TTL)
+        self._notified = TTLCache(maxsize=100000, ttl=ADMISSION_NOTICE_WINDOW)
+        self.counts = {ADMITTED: 0, RATE_LIMITED: 0, SHED: 0}
+        self.merged = 0
+
+    def priority(self, sender: str) -> int:
+        return PRIORITY_BOOKING if self._booking.get(sender) else PRIORITY_DEFAULT
+
+    def admit(self, sender: str, joining: bool = False) -> str:
+        bucket = self._buckets.get(sender)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+            self._buckets.set(sender, bucket)
+        if not bucket.try_acquire():
+            if joining:
+                # the sender already has messages waiting: this one is merged into that job,
+                # which adds no load, dropping it would lose the customer's follow-up
+                self.merged += 1
+                decision = ADMITTED
+            else:
+                decision = RATE_LIMITED
+        elif joining:
+            decision = ADMITTED
+        else:
+            limit = self.max_in_flight if self.priority(sender) == PRIORITY_BOOKING else self.shed_at
+            decision = SHED if self.load() >= limit else ADMITTED
+        self.counts[decision] += 1
+        return decision
+
+    def should_notify(self, sender: str) -> bool:
+        """True the first time in the notice window, so a shed sender is not spammed with busy replies."""
+        return self._notified.add(sender, True) is None
+
+    def record_turn(self, sender: str, worker: str, reply: str) -> None:
+        """Remember senders whose last reply came from the Scheduler mid-booking."""
+        if worker == "Scheduler" and not BOOKED.search(reply):
+            self._booking.set(sender, True)
+        else:
+            self._booking.delete(sender)
+
+    def stats(self) -> dict:
+        return {**self.counts, "merged_over_rate": self.merged, "load": self.load(), "shed_at": self.shed_at, "max_in_flight": self.max_in_flight, "booking_threads": len(self._booking)}
@@ -1,15 +1,26 @@
+import threading
 from datetime import datetime
-from langchain import hub
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import ToolMessage 
+from decouple import config
+from langchain_core.messages import AIMessage, ToolMessage
 from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
-from langgraph.checkpoint.sqlite import SqliteSaver
 from langgraph.prebuilt import ToolNode, tools_condition
 from langgraph.graph import StateGraph
 from langgraph.graph.message import AnyMessage, add_messages
 from typing_extensions import TypedDict
 from typing import Annotated
-from src.tools.scheduling import check_calendar, book_appointment
+from src.checkpoint import get_checkpointer
+from src.history import trim_state
+from src.llm import get_chat_model
+from src.prompts import prompt_registry
+from src.tools.scheduling import check_calendar, get_book_appointment_tool
+from utils.utils import logger
+
+# the model is re-prompted this many times on an empty answer before a canned reply is sent
+AGENT_EMPTY_REPROMPTS = config("AGENT_EMPTY_REPROMPTS", default=2, cast=int)
+AGENT_EMPTY_REPLY = config(
+    "AGENT_EMPTY_REPLY",
+    default="Sorry, I could not come up with an answer just now. Could you rephrase your question?",
+)
 
 
 # tool error handling
@@ -33,12 +44,11 @@ def create_tool_node_with_fallback(tools:list) -> dict:
     )                                           
 
 
-tools = [check_calendar, book_appointment]
-
-
 # define state
 class State(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
+    summary: str
+    summarized: int
     
 
 # assistant node
@@ -47,10 +57,12 @@ class Assistant:
         self.runnable = runnable
 
     def __call__(self, state: State, config: RunnableConfig):
-        while True:
+        state = trim_state(state, config)
+        for _ in range(AGENT_EMPTY_REPROMPTS + 1):
             configuration = config.get("configurable", {})
             user_id = configuration.get("user_id", None)
-            state = {**state, "user_id": user_id}
+            # the date is injected per request instead of being frozen into the prompt
+            state = {**state, "user_id": user_id, "time": datetime.now().strftime("%m/%d/%Y")}
             result = self.runnable.invoke(state)
             # If the LLM happens to return an empty response, we will re-prompt it
             # for an actual response.
@@ -63,33 +75,58 @@ class Assistant:
                 state = {**state, "messages": messages}
             else:
                 break
+        else:
+            logger.warning(f"Assistant gave no output after {AGENT_EMPTY_REPROMPTS} re-prompts")
+            result = AIMessage(content=AGENT_EMPTY_REPLY)
         return {"messages": result}
             
     
     
-llm = ChatOpenAI(model="gpt-4o", temperature=0.5)
+def build_agent_graph():
+    tools = [check_calendar, get_book_appointment_tool()]
+    llm = get_chat_model("gpt-4o", temperature=0.5)
 
+    # bind tools node to llm
+    agent_prompt = prompt_registry.get("customer_support_chatbot")
+    agent_runnable = agent_prompt | llm.bind_tools(tools)
 
-# bind tools node to llm
-agent_prompt = hub.pull("customer_support_chatbot").partial(time=datetime.now().strftime("%m/%d/%Y"))
-agent_runnable = agent_prompt | llm.bind_tools(tools)
+    # define graph workflow
+    builder = StateGraph(State)
 
-# define graph workflow
-builder = StateGraph(State)
+    # define nodes: these do the work
+    builder.add_node("assistant", Assistant(agent_runnable))
+    builder.add_node("tools", create_tool_node_with_fallback(tools))
 
-# define nodes: these do the work
-builder.add_node("assistant", Assistant(agent_runnable))
-builder.add_node("tools", create_tool_node_with_fallback(tools))
 
+    # define edges: these determine how the control flow moves
+    builder.set_entry_point("assistant")
+    builder.add_conditional_edges(
+        "assistant",
+        tools_condition,
+    )
+    builder.add_edge("tools", "assistant")
 
-# define edges: these determine how the control flow moves
-builder.set_entry_point("assistant")
-builder.add_conditional_edges(
-    "assistant",
-    tools_condition,
-)
-builder.add_edge("tools", "assistant")
+    memory = get_checkpointer("agent")
+    return builder.compile(checkpointer=memory)
+
+
+_agent_graph = None
+_lock = threading.Lock()
+
+
+def get_agent_graph():
+    """Build the legacy graph on first use, prompts come from the local prompt cache"""
+    global _agent_graph
+    with _lock:
+        if _agent_graph is None:
+            _agent_graph = build_agent_graph()
+        return _agent_graph
+
+
+def reset_agent_graph(prompt_name: str = None) -> None:
+    global _agent_graph
+    with _lock:
+        _agent_graph = None
 
-memory = SqliteSaver.from_conn_string(":memory:")
-agent_graph = builder.compile(checkpointer=memory)
 
+prompt_registry.on_change(reset_agent_graph)
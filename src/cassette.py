@@ -0,0 +1,314 @@
+"""
+Record/replay cassettes of conversations.
+
+In record mode every turn of a recorded sender is appended to that sender's
+cassette: the inbound message, every chat model request and response, every
+scheduling webhook exchange and the chunks sent back through Twilio, with
+their latencies. In replay mode (see benchmarks/replay.py) the graphs run
+against the cassette instead of the network, so a slow or broken conversation
+can be reproduced, timed and diffed locally.
+"""
+import asyncio
+import contextvars
+import gzip
+import hashlib
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Optional
+from decouple import config
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict, messages_to_dict
+from langchain_core.outputs import ChatGeneration, ChatResult
+from utils.utils import logger
+
+# off, record or replay
+CASSETTE_MODE = config("CASSETTE_MODE", default="off")
+CASSETTE_DIR = config("CASSETTE_DIR", default="cassettes")
+# comma separated senders to record, * records everyone
+CASSETTE_SENDERS = config("CASSETTE_SENDERS", default="*")
+# replayed calls wait as long as the recorded ones took, so end-to-end timings are comparable
+CASSETTE_REALTIME = config("CASSETTE_REALTIME", default=False, cast=bool)
+
+RECORD = "record"
+REPLAY = "replay"
+# channel of the turns recorded for the background history summary of a thread
+SUMMARY_CHANNEL = "summary"
+
+# dates in prompts change from day to day, they are masked before hashing a request
+DATES = re.compile(r"\d{4}-\d{2}-\d{2}|\d{2}/\d{2}/\d{4}")
+
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode for a call the cassette has no recording for."""
+
+
+def request_hash(model: str, messages: list[BaseMessage], kwargs: dict) -> str:
+    payload = json.dumps([model, messages_to_dict(messages), kwargs], sort_keys=True, default=str)
+    return hashlib.sha256(DATES.sub("<date>", payload).encode()).hexdigest()[:16]
+
+
+def cassette_path(directory: str, sender: str) -> Path:
+    return Path(directory) / f"{re.sub(r'[^0-9A-Za-z]', '', sender)}.jsonl.gz"
+
+
+def read_cassette(path: Path) -> list[dict]:
+    with gzip.open(path, "rt") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class CassetteTurn:
+    """
+    The exchanges of one turn. When replaying, `recorded` is the turn from the
+    cassette that answers the calls, and the new exchanges are collected next
+    to it for the diff.
+    """
+
+    def __init__(self, sender: str, channel: str, text: str, recorded: Optional[dict] = None):
+        self.sender, self.channel, self.text = sender, channel, text
+        self.recorded = recorded
+        self.llm: list[dict] = []
+        self.webhooks: list[dict] = []
+        self.outbound: list[str] = []
+        self.initial_state: Optional[dict] = None
+        self.elapsed = 0.0
+        self._used_llm: set[int] = set()
+        self._used_webhooks: set[int] = set()
+        self._lock = threading.Lock()
+
+    def add_llm(self, entry: dict) -> None:
+        with self._lock:
+            self.llm.append(entry)
+
+    def add_webhook(self, entry: dict) -> None:
+        with self._lock:
+            self.webhooks.append(entry)
+
+    def replay_llm(self, request: str) -> dict:
+        # matched on the request first, so an extra or changed call does not shift every
+        # later answer, a request that changed gets the first recording not used yet
+        with self._lock:
+            recorded = self.recorded["llm"]
+            unused = [i for i in range(len(recorded)) if i not in self._used_llm]
+            index = next((i for i in unused if recorded[i]["request"] == request), None)
+            if index is None and unused:
+                index = unused[0]
+            if index is None:
+                raise CassetteMiss(f"LLM call {len(self.llm) + 1} of turn {self.text!r} was not recorded")
+            self._used_llm.add(index)
+            entry = recorded[index]
+            self.llm.append({**entry, "request": request, "recorded_request": entry["request"]})
+            return entry
+
+    def replay_webhook(self, endpoint: str, payload: dict) -> dict:
+        # tool calls can run in parallel, so webhooks are matched on their payload first
+        with self._lock:
+            candidates = [(i, e) for i, e in enumerate(self.recorded["webhooks"]) if i not in self._used_webhooks and e["endpoint"] == endpoint]
+            match = next(((i, e) for i, e in candidates if e["payload"] == payload), None) or next(iter(candidates), None)
+            if match is None:
+                raise CassetteMiss(f"{endpoint} webhook {payload} of turn {self.text!r} was not recorded")
+            i, entry = match
+            self._used_webhooks.add(i)
+            self.webhooks.append({**entry, "payload": payload, "matched": entry["payload"] == payload})
+            return entry
+
+    def to_dict(self) -> dict:
+        record = {
+            "sender": self.sender,
+            "channel": self.channel,
+            "text": self.text,
+            "elapsed": self.elapsed,
+            "llm": self.llm,
+            "webhooks": self.webhooks,
+            "outbound": self.outbound,
+        }
+        if self.initial_state is not None:
+            record["initial_state"] = self.initial_state
+        return record
+
+
+turn_var: contextvars.ContextVar[Optional[CassetteTurn]] = contextvars.ContextVar("cassette_turn", default=None)
+# recordings of one hedged attempt, held back until it is known to have won
+attempt_var: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("cassette_attempt", default=None)
+
+
+def current_turn() -> Optional[CassetteTurn]:
+    return turn_var.get()
+
+
+@contextmanager
+def cassette_attempt():
+    """Collect the recordings of one attempt of a hedged call instead of adding them to the turn."""
+    entries: list[dict] = []
+    token = attempt_var.set(entries)
+    try:
+        yield entries
+    finally:
+        attempt_var.reset(token)
+
+
+def keep_attempt(entries: list[dict]) -> None:
+    """Add the recordings of the attempt that answered to the turn, losing hedges are never recorded."""
+    turn = current_turn()
+    if turn is not None:
+        for entry in entries:
+            turn.add_llm(entry)
+
+
+def dump_state(values: dict) -> dict:
+    """Graph state as JSON, message lists included."""
+    return {
+        key: messages_to_dict(value) if isinstance(value, list) and value and isinstance(value[0], BaseMessage) else value
+        for key, value in values.items()
+    }
+
+
+def load_state(values: dict) -> dict:
+    return {
+        key: messages_from_dict(value) if isinstance(value, list) and value and isinstance(value[0], dict) and "type" in value[0] else value
+        for key, value in values.items()
+    }
+
+
+@contextmanager
+def replaying(recorded: dict):
+    """Run the block as the replay of a recorded turn, its calls are answered from the recording."""
+    turn = CassetteTurn(recorded["sender"], recorded["channel"], recorded["text"], recorded=recorded)
+    token = turn_var.set(turn)
+    start = time.perf_counter()
+    try:
+        yield turn
+    finally:
+        turn.elapsed = time.perf_counter() - start
+        turn_var.reset(token)
+
+
+class CassetteRecorder:
+    """Appends one gzip member per turn to the sender's cassette, so a cassette grows without being rewritten."""
+
+    def __init__(self, mode: str = CASSETTE_MODE, directory: str = CASSETTE_DIR, senders: str = CASSETTE_SENDERS):
+        self.mode = mode
+        self.directory = directory
+        self.senders = None if senders.strip() == "*" else {s.strip() for s in senders.split(",") if s.strip()}
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.failed = 0
+
+    def recording(self, sender: str) -> bool:
+        return self.mode == RECORD and (self.senders is None or sender in self.senders)
+
+    @contextmanager
+    def turn(self, sender: str, channel: str, text: str, snapshot: Callable[[], dict], keep_empty: bool = True):
+        """
+        Record the turn run inside the block. `snapshot` returns the graph state,
+        kept for a cassette's first turn. With `keep_empty` off a turn that made
+        no LLM or webhook calls is not written.
+        """
+        if not self.recording(sender):
+            yield None
+            return
+        turn = CassetteTurn(sender, channel, text)
+        path = cassette_path(self.directory, sender)
+        if not path.exists():
+            try:
+                turn.initial_state = dump_state(snapshot())
+            except Exception as e:
+                logger.error(f"Could not snapshot the graph state of {sender} for its cassette: {e}")
+        token = turn_var.set(turn)
+        start = time.perf_counter()
+        try:
+            yield turn
+        finally:
+            turn.elapsed = time.perf_counter() - start
+            turn_var.reset(token)
+            if keep_empty or turn.llm or turn.webhooks:
+                self._append(path, turn)
+
+    def _append(self, path: Path, turn: CassetteTurn) -> None:
+        try:
+            with self._lock:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with gzip.open(path, "at") as f:
+                    f.write(json.dumps(turn.to_dict(), default=str) + "\n")
+            self.turns += 1
+        except OSError as e:
+            self.failed += 1
+            logger.error(f"Could not write cassette {path}: {e}")
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "turns": self.turns, "failed": self.failed}
+
+
+class CassetteChatModel(BaseChatModel):
+    """Wraps a chat model to record its calls inside a recorded turn, or to answer them from the cassette when replaying."""
+
+    inner: BaseChatModel
+    mode: str = CASSETTE_MODE
+    realtime: bool = CASSETTE_REALTIME
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette-chat"
+
+    @property
+    def model_name(self) -> str:
+        return getattr(self.inner, "model_name", None) or getattr(self.inner, "model", "-")
+
+    def _replayed(self, turn: CassetteTurn, request: str) -> tuple[ChatResult, float]:
+        entry = turn.replay_llm(request)
+        message = messages_from_dict([entry["response"]])[0]
+        result = ChatResult(generations=[ChatGeneration(message=message)], llm_output=entry.get("llm_output"))
+        return result, entry["latency"] if self.realtime else 0.0
+
+    def _recorded(self, turn: CassetteTurn, request: str, start: float, result: ChatResult) -> ChatResult:
+        entry = {
+            "model": self.model_name,
+            "request": request,
+            "response": message_to_dict(result.generations[0].message),
+            "llm_output": result.llm_output,
+            "latency": time.perf_counter() - start,
+        }
+        attempt = attempt_var.get()
+        if attempt is not None:
+            attempt.append(entry)
+        else:
+            turn.add_llm(entry)
+        return result
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        turn = current_turn()
+        if turn is None:
+            if self.mode == REPLAY:
+                raise CassetteMiss("LLM call outside of a replayed turn")
+            return self.inner._generate(messages, stop=stop, **kwargs)
+        request = request_hash(self.model_name, messages, kwargs)
+        if self.mode == REPLAY:
+            result, delay = self._replayed(turn, request)
+            time.sleep(delay)
+            return result
+        start = time.perf_counter()
+        return self._recorded(turn, request, start, self.inner._generate(messages, stop=stop, **kwargs))
+
+    async def _agenerate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        turn = current_turn()
+        if turn is None:
+            if self.mode == REPLAY:
+                raise CassetteMiss("LLM call outside of a replayed turn")
+            return await self.inner._agenerate(messages, stop=stop, **kwargs)
+        request = request_hash(self.model_name, messages, kwargs)
+        if self.mode == REPLAY:
+            result, delay = self._replayed(turn, request)
+            await asyncio.sleep(delay)
+            return result
+        start = time.perf_counter()
+        return self._recorded(turn, request, start, await self.inner._agenerate(messages, stop=stop, **kwargs))
+
+
+def wrap_chat_model(model: BaseChatModel) -> BaseChatModel:
+    return CassetteChatModel(inner=model) if CASSETTE_MODE in (RECORD, REPLAY) else model
+
+
+cassettes = CassetteRecorder()
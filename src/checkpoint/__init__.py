@@ -0,0 +1,70 @@
+from decouple import config
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+# "postgres" shares conversation state across workers and restarts,
+# "bounded" keeps it in process under a memory budget and spills idle threads to disk,
+# "memory" keeps everything inside the process (local development only)
+CHECKPOINTER = config("CHECKPOINTER", default="postgres")
+CHECKPOINT_POOL_MIN = config("CHECKPOINT_POOL_MIN", default=1, cast=int)
+CHECKPOINT_POOL_MAX = config("CHECKPOINT_POOL_MAX", default=20, cast=int)
+CHECKPOINT_MEMORY_BUDGET = config("CHECKPOINT_MEMORY_BUDGET", default=256 * 1024 * 1024, cast=int)
+CHECKPOINT_MIN_IDLE_SECONDS = config("CHECKPOINT_MIN_IDLE_SECONDS", default=60.0, cast=float)
+CHECKPOINT_SPILL_PATH = config("CHECKPOINT_SPILL_PATH", default="checkpoints_spill.sqlite")
+
+_pool = None
+_savers: dict[str, BaseCheckpointSaver] = {}
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        from psycopg2.pool import ThreadedConnectionPool
+        from src.db.session import url
+
+        _pool = ThreadedConnectionPool(
+            CHECKPOINT_POOL_MIN,
+            CHECKPOINT_POOL_MAX,
+            dsn=url.render_as_string(hide_password=False),
+        )
+    return _pool
+
+
+def get_checkpointer(namespace: str) -> BaseCheckpointSaver:
+    """
+    Get the checkpointer for a graph. Graphs sharing a backend get
+    their own namespace so thread ids never collide between them, and a
+    rebuilt graph gets the same saver back so no conversation state is lost.
+    """
+    if namespace in _savers:
+        return _savers[namespace]
+    if CHECKPOINTER == "postgres":
+        from src.checkpoint.postgres import PostgresSaver
+
+        saver = PostgresSaver(_get_pool(), namespace=namespace)
+    elif CHECKPOINTER == "bounded":
+        from src.checkpoint.bounded import BoundedMemorySaver
+
+        saver = BoundedMemorySaver(
+            CHECKPOINT_SPILL_PATH,
+            namespace=namespace,
+            max_bytes=CHECKPOINT_MEMORY_BUDGET,
+            min_idle=CHECKPOINT_MIN_IDLE_SECONDS,
+        )
+    elif CHECKPOINTER == "memory":
+        saver = SqliteSaver.from_conn_string(":memory:")
+    else:
+        raise ValueError(f"Unknown CHECKPOINTER: {CHECKPOINTER}")
+    _savers[namespace] = saver
+    return saver
+
+
+def checkpointer_stats() -> list[dict]:
+    return [saver.stats() for saver in _savers.values() if hasattr(saver, "stats")]
+
+
+def close_checkpointers() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
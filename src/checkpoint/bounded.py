@@ -0,0 +1,334 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence, Tuple
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    SerializerProtocol,
+)
+from src.checkpoint.serde import CompressedSerializer
+from utils.utils import logger
+
+SETUP_SQL = """
+PRAGMA journal_mode=WAL;
+CREATE TABLE IF NOT EXISTS spilled_checkpoints (
+    namespace TEXT NOT NULL,
+    thread_id TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    parent_id TEXT,
+    checkpoint BLOB NOT NULL,
+    metadata BLOB,
+    PRIMARY KEY (namespace, thread_id, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS spilled_writes (
+    namespace TEXT NOT NULL,
+    thread_id TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    value BLOB,
+    PRIMARY KEY (namespace, thread_id, checkpoint_id, task_id, idx)
+);
+"""
+
+
+@dataclass
+class _Thread:
+    # checkpoint_id -> (parent_id, checkpoint, metadata), all payloads serialized
+    checkpoints: Dict[str, Tuple[Optional[str], bytes, bytes]] = field(default_factory=dict)
+    # checkpoint_id -> {(task_id, idx): (channel, value)}
+    writes: Dict[str, Dict[Tuple[str, int], Tuple[str, bytes]]] = field(default_factory=dict)
+    nbytes: int = 0
+    last_used: float = 0.0
+
+
+class BoundedMemorySaver(BaseCheckpointSaver):
+    """
+    In-memory checkpointer with a memory budget.
+
+    Threads are kept in LRU order. When the serialized size of all resident
+    threads exceeds `max_bytes`, the least recently used threads that have been
+    idle for at least `min_idle` seconds are spilled to a SQLite file and
+    rehydrated transparently on their next access.
+    """
+
+    serde = CompressedSerializer()
+
+    def __init__(
+        self,
+        spill_path: str,
+        namespace: str = "default",
+        max_bytes: int = 256 * 1024 * 1024,
+        min_idle: float = 60.0,
+        *,
+        serde: Optional[SerializerProtocol] = None,
+    ) -> None:
+        super().__init__(serde=serde)
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.min_idle = min_idle
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(spill_path, check_same_thread=False)
+        self.conn.executescript(SETUP_SQL)
+        self._threads: "OrderedDict[str, _Thread]" = OrderedDict()
+        self.resident_bytes = 0
+        self.evictions = 0
+        self.rehydrations = 0
+
+    # -- residency -------------------------------------------------------
+
+    def _touch(self, thread_id: str, create: bool = False) -> Optional[_Thread]:
+        data = self._threads.get(thread_id)
+        if data is None:
+            data = self._rehydrate(thread_id)
+            if data is None and create:
+                data = _Thread()
+            if data is None:
+                return None
+            self._threads[thread_id] = data
+            self.resident_bytes += data.nbytes
+        self._threads.move_to_end(thread_id)
+        data.last_used = time.monotonic()
+        return data
+
+    def _rehydrate(self, thread_id: str) -> Optional[_Thread]:
+        rows = self.conn.execute(
+            "SELECT checkpoint_id, parent_id, checkpoint, metadata FROM spilled_checkpoints WHERE namespace = ? AND thread_id = ?",
+            (self.namespace, thread_id),
+        ).fetchall()
+        if not rows:
+            return None
+        data = _Thread()
+        for checkpoint_id, parent_id, checkpoint, metadata in rows:
+            data.checkpoints[checkpoint_id] = (parent_id, checkpoint, metadata)
+            data.nbytes += len(checkpoint) + len(metadata or b"")
+        for checkpoint_id, task_id, idx, channel, value in self.conn.execute(
+            "SELECT checkpoint_id, task_id, idx, channel, value FROM spilled_writes WHERE namespace = ? AND thread_id = ?",
+            (self.namespace, thread_id),
+        ):
+            data.writes.setdefault(checkpoint_id, {})[(task_id, idx)] = (channel, value)
+            data.nbytes += len(value)
+        with self.conn:
+            self.conn.execute("DELETE FROM spilled_checkpoints WHERE namespace = ? AND thread_id = ?", (self.namespace, thread_id))
+            self.conn.execute("DELETE FROM spilled_writes WHERE namespace = ? AND thread_id = ?", (self.namespace, thread_id))
+        self.rehydrations += 1
+        return data
+
+    def _spill(self, thread_id: str, data: _Thread) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO spilled_checkpoints (namespace, thread_id, checkpoint_id, parent_id, checkpoint, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (self.namespace, thread_id, checkpoint_id, parent_id, checkpoint, metadata)
+                    for checkpoint_id, (parent_id, checkpoint, metadata) in data.checkpoints.items()
+                ],
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO spilled_writes (namespace, thread_id, checkpoint_id, task_id, idx, channel, value) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (self.namespace, thread_id, checkpoint_id, task_id, idx, channel, value)
+                    for checkpoint_id, writes in data.writes.items()
+                    for (task_id, idx), (channel, value) in writes.items()
+                ],
+            )
+
+    def _enforce_budget(self) -> None:
+        if self.resident_bytes <= self.max_bytes:
+            return
+        now = time.monotonic()
+        for thread_id in list(self._threads):
+            if self.resident_bytes <= self.max_bytes:
+                break
+            data = self._threads[thread_id]
+            if now - data.last_used < self.min_idle:
+                # LRU order: every remaining thread is more recent than this one
+                break
+            self._spill(thread_id, data)
+            del self._threads[thread_id]
+            self.resident_bytes -= data.nbytes
+            self.evictions += 1
+        if self.resident_bytes > self.max_bytes:
+            logger.info(f"Checkpoint memory over budget ({self.resident_bytes} bytes) with no idle threads to evict")
+
+    def _add_bytes(self, data: _Thread, nbytes: int) -> None:
+        data.nbytes += nbytes
+        self.resident_bytes += nbytes
+
+    # -- saver interface -------------------------------------------------
+
+    def _tuple(
+        self,
+        thread_id: str,
+        checkpoint_id: str,
+        parent_id: Optional[str],
+        checkpoint: bytes,
+        metadata: Optional[bytes],
+        writes: Optional[Dict[Tuple[str, int], Tuple[str, bytes]]] = None,
+    ) -> CheckpointTuple:
+        return CheckpointTuple(
+            {"configurable": {"thread_id": thread_id, "thread_ts": checkpoint_id}},
+            self.serde.loads(checkpoint),
+            self.serde.loads(metadata) if metadata else {},
+            {"configurable": {"thread_id": thread_id, "thread_ts": parent_id}} if parent_id else None,
+            None if writes is None else [
+                (task_id, channel, self.serde.loads(value))
+                for (task_id, _), (channel, value) in sorted(writes.items())
+            ],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_id = config["configurable"].get("thread_ts")
+        with self.lock:
+            data = self._touch(thread_id)
+            if data is None or not data.checkpoints:
+                return None
+            if checkpoint_id is None:
+                checkpoint_id = max(data.checkpoints)
+            elif checkpoint_id not in data.checkpoints:
+                return None
+            entry = data.checkpoints[checkpoint_id]
+            writes = dict(data.writes.get(checkpoint_id, {}))
+            # the access may have rehydrated the thread
+            self._enforce_budget()
+        return self._tuple(thread_id, checkpoint_id, *entry, writes)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        before_id = before["configurable"]["thread_ts"] if before is not None else None
+        # (thread_id, checkpoint_id, parent_id, checkpoint, metadata), deserialized only when yielded
+        entries = []
+        with self.lock:
+            if config is not None:
+                thread_id = str(config["configurable"]["thread_id"])
+                data = self._touch(thread_id)
+                if data is not None:
+                    entries = [(thread_id, checkpoint_id, *entry) for checkpoint_id, entry in data.checkpoints.items()]
+                self._enforce_budget()
+            else:
+                # an unscoped scan reads spilled threads where they are, promoting every one
+                # of them into memory would defeat the budget
+                for thread_id, data in self._threads.items():
+                    entries += [(thread_id, checkpoint_id, *entry) for checkpoint_id, entry in data.checkpoints.items()]
+                query = "SELECT thread_id, checkpoint_id, parent_id, checkpoint, metadata FROM spilled_checkpoints WHERE namespace = ?"
+                params: list = [self.namespace]
+                if before_id is not None:
+                    query += " AND checkpoint_id < ?"
+                    params.append(before_id)
+                if limit and not filter:
+                    query += " ORDER BY checkpoint_id DESC LIMIT ?"
+                    params.append(limit)
+                entries += self.conn.execute(query, params).fetchall()
+        if before_id is not None:
+            entries = [e for e in entries if e[1] < before_id]
+        entries.sort(key=lambda e: e[1], reverse=True)
+        count = 0
+        for entry in entries:
+            item = self._tuple(*entry)
+            if filter and not all(item.metadata.get(k) == v for k, v in filter.items()):
+                continue
+            yield item
+            count += 1
+            if limit and count >= limit:
+                return
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+    ) -> RunnableConfig:
+        thread_id = str(config["configurable"]["thread_id"])
+        serialized = self.serde.dumps(checkpoint)
+        serialized_metadata = self.serde.dumps(metadata)
+        with self.lock:
+            data = self._touch(thread_id, create=True)
+            previous = data.checkpoints.get(checkpoint["id"])
+            if previous is not None:
+                self._add_bytes(data, -(len(previous[1]) + len(previous[2])))
+            data.checkpoints[checkpoint["id"]] = (config["configurable"].get("thread_ts"), serialized, serialized_metadata)
+            self._add_bytes(data, len(serialized) + len(serialized_metadata))
+            self._enforce_budget()
+        return {"configurable": {"thread_id": thread_id, "thread_ts": checkpoint["id"]}}
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+    ) -> None:
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_id = str(config["configurable"]["thread_ts"])
+        serialized = [(channel, self.serde.dumps(value)) for channel, value in writes]
+        with self.lock:
+            data = self._touch(thread_id, create=True)
+            bucket = data.writes.setdefault(checkpoint_id, {})
+            for idx, (channel, value) in enumerate(serialized):
+                previous = bucket.get((task_id, idx))
+                if previous is not None:
+                    self._add_bytes(data, -len(previous[1]))
+                bucket[(task_id, idx)] = (channel, value)
+                self._add_bytes(data, len(value))
+            self._enforce_budget()
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+    ) -> RunnableConfig:
+        return await asyncio.get_running_loop().run_in_executor(None, self.put, config, checkpoint, metadata)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+    ) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self.put_writes, config, writes, task_id)
+
+    def stats(self) -> dict:
+        with self.lock:
+            spilled = self.conn.execute(
+                "SELECT COUNT(DISTINCT thread_id) FROM spilled_checkpoints WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+            return {
+                "namespace": self.namespace,
+                "resident_threads": len(self._threads),
+                "resident_bytes": self.resident_bytes,
+                "max_bytes": self.max_bytes,
+                "spilled_threads": spilled,
+                "evictions": self.evictions,
+                "rehydrations": self.rehydrations,
+            }
@@ -0,0 +1,241 @@
+import asyncio
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence, Tuple
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    SerializerProtocol,
+)
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from src.checkpoint.serde import CompressedSerializer
+
+SETUP_SQL = """
+CREATE TABLE IF NOT EXISTS graph_checkpoints (
+    namespace TEXT NOT NULL,
+    thread_id TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    parent_id TEXT,
+    checkpoint BYTEA NOT NULL,
+    metadata BYTEA,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (namespace, thread_id, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS graph_writes (
+    namespace TEXT NOT NULL,
+    thread_id TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    value BYTEA,
+    PRIMARY KEY (namespace, thread_id, checkpoint_id, task_id, idx)
+);
+"""
+
+
+class PostgresSaver(BaseCheckpointSaver):
+    """
+    LangGraph checkpointer stored in the application Postgres database.
+
+    Connections come from a thread-safe pool shared by every graph in the
+    process, checkpoints are stored as compressed JSON and the writes of a
+    graph step are inserted in a single statement. The `namespace` keeps the
+    legacy agent and the multi agent graph apart when they share thread ids.
+    """
+
+    serde = CompressedSerializer()
+
+    def __init__(
+        self,
+        pool: ThreadedConnectionPool,
+        namespace: str = "default",
+        *,
+        serde: Optional[SerializerProtocol] = None,
+    ) -> None:
+        super().__init__(serde=serde)
+        self.pool = pool
+        self.namespace = namespace
+        self.is_setup = False
+
+    @classmethod
+    def from_conn_string(cls, conn_string: str, namespace: str = "default", min_size: int = 1, max_size: int = 20) -> "PostgresSaver":
+        return cls(ThreadedConnectionPool(min_size, max_size, dsn=conn_string), namespace)
+
+    @contextmanager
+    def _cursor(self):
+        conn = self.pool.getconn()
+        try:
+            if not self.is_setup:
+                with conn.cursor() as cur:
+                    cur.execute(SETUP_SQL)
+                conn.commit()
+                self.is_setup = True
+            with conn.cursor() as cur:
+                yield cur
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    def _config(self, thread_id: str, checkpoint_id: Optional[str]) -> Optional[RunnableConfig]:
+        if not checkpoint_id:
+            return None
+        return {"configurable": {"thread_id": thread_id, "thread_ts": checkpoint_id}}
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_id = config["configurable"].get("thread_ts")
+        with self._cursor() as cur:
+            if checkpoint_id:
+                cur.execute(
+                    "SELECT checkpoint_id, parent_id, checkpoint, metadata FROM graph_checkpoints "
+                    "WHERE namespace = %s AND thread_id = %s AND checkpoint_id = %s",
+                    (self.namespace, thread_id, checkpoint_id),
+                )
+            else:
+                cur.execute(
+                    "SELECT checkpoint_id, parent_id, checkpoint, metadata FROM graph_checkpoints "
+                    "WHERE namespace = %s AND thread_id = %s ORDER BY checkpoint_id DESC LIMIT 1",
+                    (self.namespace, thread_id),
+                )
+            row = cur.fetchone()
+            if row is None:
+                return None
+            checkpoint_id, parent_id, checkpoint, metadata = row
+            cur.execute(
+                "SELECT task_id, channel, value FROM graph_writes "
+                "WHERE namespace = %s AND thread_id = %s AND checkpoint_id = %s ORDER BY task_id, idx",
+                (self.namespace, thread_id, checkpoint_id),
+            )
+            writes = cur.fetchall()
+        return CheckpointTuple(
+            self._config(thread_id, checkpoint_id),
+            self.serde.loads(checkpoint),
+            self.serde.loads(metadata) if metadata is not None else {},
+            self._config(thread_id, parent_id),
+            [(task_id, channel, self.serde.loads(value)) for task_id, channel, value in writes],
+        )
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        query = "SELECT thread_id, checkpoint_id, parent_id, checkpoint, metadata FROM graph_checkpoints WHERE namespace = %s"
+        params: list = [self.namespace]
+        if config is not None:
+            query += " AND thread_id = %s"
+            params.append(str(config["configurable"]["thread_id"]))
+        if before is not None:
+            query += " AND checkpoint_id < %s"
+            params.append(before["configurable"]["thread_ts"])
+        query += " ORDER BY checkpoint_id DESC"
+        # metadata is stored compressed, so filters are applied after decoding
+        if limit and not filter:
+            query += f" LIMIT {int(limit)}"
+        with self._cursor() as cur:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+        count = 0
+        for thread_id, checkpoint_id, parent_id, checkpoint, metadata in rows:
+            metadata = self.serde.loads(metadata) if metadata is not None else {}
+            if filter and not all(metadata.get(k) == v for k, v in filter.items()):
+                continue
+            yield CheckpointTuple(
+                self._config(thread_id, checkpoint_id),
+                self.serde.loads(checkpoint),
+                metadata,
+                self._config(thread_id, parent_id),
+            )
+            count += 1
+            if limit and count >= limit:
+                return
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+    ) -> RunnableConfig:
+        thread_id = str(config["configurable"]["thread_id"])
+        with self._cursor() as cur:
+            cur.execute(
+                "INSERT INTO graph_checkpoints (namespace, thread_id, checkpoint_id, parent_id, checkpoint, metadata) "
+                "VALUES (%s, %s, %s, %s, %s, %s) "
+                "ON CONFLICT (namespace, thread_id, checkpoint_id) "
+                "DO UPDATE SET checkpoint = EXCLUDED.checkpoint, metadata = EXCLUDED.metadata",
+                (
+                    self.namespace,
+                    thread_id,
+                    checkpoint["id"],
+                    config["configurable"].get("thread_ts"),
+                    self.serde.dumps(checkpoint),
+                    self.serde.dumps(metadata),
+                ),
+            )
+        return {"configurable": {"thread_id": thread_id, "thread_ts": checkpoint["id"]}}
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+    ) -> None:
+        if not writes:
+            return
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_id = str(config["configurable"]["thread_ts"])
+        rows = [
+            (self.namespace, thread_id, checkpoint_id, task_id, idx, channel, self.serde.dumps(value))
+            for idx, (channel, value) in enumerate(writes)
+        ]
+        with self._cursor() as cur:
+            execute_values(
+                cur,
+                "INSERT INTO graph_writes (namespace, thread_id, checkpoint_id, task_id, idx, channel, value) VALUES %s "
+                "ON CONFLICT (namespace, thread_id, checkpoint_id, task_id, idx) "
+                "DO UPDATE SET channel = EXCLUDED.channel, value = EXCLUDED.value",
+                rows,
+            )
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+    ) -> RunnableConfig:
+        return await asyncio.get_running_loop().run_in_executor(None, self.put, config, checkpoint, metadata)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+    ) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self.put_writes, config, writes, task_id)
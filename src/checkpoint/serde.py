@@ -0,0 +1,34 @@
+import zlib
+from typing import Any
+from langgraph.checkpoint.sqlite import JsonPlusSerializerCompat
+
+# one byte header so plain and compressed payloads can live side by side
+_RAW = b"\x00"
+_ZLIB = b"\x01"
+
+
+class CompressedSerializer(JsonPlusSerializerCompat):
+    """
+    JsonPlus serializer that zlib-compresses payloads above a size threshold.
+    Message lists are highly repetitive JSON, so they typically shrink 4-6x.
+    """
+
+    def __init__(self, threshold: int = 512, level: int = 6):
+        self.threshold = threshold
+        self.level = level
+
+    def dumps(self, obj: Any) -> bytes:
+        data = super().dumps(obj)
+        if len(data) < self.threshold:
+            return _RAW + data
+        return _ZLIB + zlib.compress(data, self.level)
+
+    def loads(self, data: bytes) -> Any:
+        data = bytes(data)
+        header, payload = data[:1], data[1:]
+        if header == _ZLIB:
+            return super().loads(zlib.decompress(payload))
+        if header == _RAW:
+            return super().loads(payload)
+        # rows written before compression was introduced
+        return super().loads(data)
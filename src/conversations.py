@@ -0,0 +1,123 @@
+"""Keyset-paginated reads and streaming exports of the conversations table"""
+import base64
+import csv
+import io
+import json
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator, Optional
+from decouple import config
+from sqlalchemy import select, tuple_
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from src.db.models.conversations import Conversation
+
+EXPORT_PAGE_MAX = config("EXPORT_PAGE_MAX", default=500, cast=int)
+EXPORT_FETCH_SIZE = config("EXPORT_FETCH_SIZE", default=1000, cast=int)
+
+COLUMNS = [
+    "id", "created_at", "sender", "channel", "thread_id", "message", "response",
+    "prompt_tokens", "completion_tokens", "cost_usd",
+]
+
+
+class InvalidCursor(ValueError):
+    """Raised for a pagination cursor that was not issued by this API."""
+
+
+@dataclass
+class ConversationFilter:
+    sender: Optional[str] = None
+    channel: Optional[str] = None
+    thread_id: Optional[uuid.UUID] = None
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+
+    def apply(self, query):
+        if self.sender:
+            query = query.where(Conversation.sender == self.sender)
+        if self.channel:
+            query = query.where(Conversation.channel == self.channel)
+        if self.thread_id:
+            query = query.where(Conversation.thread_id == self.thread_id)
+        if self.since:
+            query = query.where(Conversation.created_at >= self.since)
+        if self.until:
+            query = query.where(Conversation.created_at < self.until)
+        return query
+
+
+def encode_cursor(created_at: datetime, id: uuid.UUID) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    try:
+        created_at, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), uuid.UUID(id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+def to_dict(row) -> dict:
+    return {
+        "id": str(row.id),
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+        "sender": row.sender,
+        "channel": row.channel,
+        "thread_id": str(row.thread_id) if row.thread_id else None,
+        "message": row.message,
+        "response": row.response,
+        "prompt_tokens": row.prompt_tokens,
+        "completion_tokens": row.completion_tokens,
+        "cost_usd": row.cost_usd,
+    }
+
+
+def _base_query(filters: ConversationFilter):
+    columns = [getattr(Conversation, name) for name in COLUMNS]
+    return filters.apply(select(*columns)).order_by(Conversation.created_at, Conversation.id)
+
+
+def list_conversations(db: Session, filters: ConversationFilter, limit: int = 100, cursor: Optional[str] = None) -> dict:
+    """
+    One page in (created_at, id) order. The cursor is the last row of the
+    previous page, so every page is an index range scan, however deep.
+    """
+    limit = max(1, min(limit, EXPORT_PAGE_MAX))
+    query = _base_query(filters)
+    if cursor:
+        created_at, id = decode_cursor(cursor)
+        # a row comparison is a single range on ix_conversations_created_at_id
+        query = query.where(tuple_(Conversation.created_at, Conversation.id) > (created_at, id))
+    rows = db.execute(query.limit(limit + 1)).all()
+    page = rows[:limit]
+    next_cursor = encode_cursor(page[-1].created_at, page[-1].id) if len(rows) > limit else None
+    return {"items": [to_dict(row) for row in page], "next_cursor": next_cursor}
+
+
+def _stream_rows(engine: Engine, filters: ConversationFilter) -> Iterator:
+    # stream_results gives a server-side cursor on Postgres, rows arrive EXPORT_FETCH_SIZE at a time
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=EXPORT_FETCH_SIZE).execute(_base_query(filters))
+        for partition in result.partitions():
+            yield from partition
+
+
+def export_ndjson(engine: Engine, filters: ConversationFilter) -> Iterator[str]:
+    for row in _stream_rows(engine, filters):
+        yield json.dumps(to_dict(row)) + "\n"
+
+
+def export_csv(engine: Engine, filters: ConversationFilter) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=COLUMNS)
+    writer.writeheader()
+    for i, row in enumerate(_stream_rows(engine, filters), start=1):
+        writer.writerow(to_dict(row))
+        if i % 500 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
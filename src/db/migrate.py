@@ -0,0 +1,44 @@
+"""Applies the SQL files in src/db/migrations in order, once each"""
+from pathlib import Path
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from utils.utils import logger
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+# any constant works, it only has to be the same for every app instance
+MIGRATION_LOCK_ID = 7238104
+
+
+def pending_migrations(applied: set[str]) -> list[Path]:
+    return [path for path in sorted(MIGRATIONS_DIR.glob("*.sql")) if path.stem not in applied]
+
+
+def run_migrations(engine: Engine) -> list[str]:
+    """
+    Postgres only: the migrations use partitioning and plpgsql. Other
+    databases (local SQLite) get their schema from create_all instead.
+    """
+    if engine.dialect.name != "postgresql":
+        return []
+    applied_now = []
+    with engine.begin() as conn:
+        # app instances starting together apply the migrations one at a time
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version VARCHAR PRIMARY KEY, applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now())"
+        ))
+        applied = set(conn.execute(text("SELECT version FROM schema_migrations")).scalars())
+        for path in pending_migrations(applied):
+            logger.info(f"Applying migration {path.stem}")
+            conn.exec_driver_sql(path.read_text())
+            conn.execute(text("INSERT INTO schema_migrations (version) VALUES (:version)"), {"version": path.stem})
+            applied_now.append(path.stem)
+    return applied_now
+
+
+if __name__ == "__main__":
+    from src.db.session import engine
+
+    applied = run_migrations(engine)
+    print(f"Applied {len(applied)} migrations: {', '.join(applied) or 'none'}")
@@ -0,0 +1,62 @@
+-- Conversations get a timestamp and a channel, lose the redundant index on the
+-- primary key, gain (sender, created_at) and (thread_id, created_at) indexes,
+-- and become a table partitioned by month on created_at so that old months
+-- can be detached and archived by src/db/retention.py.
+
+-- creates the partition holding the month that contains `day`, if it is missing
+CREATE OR REPLACE FUNCTION conversations_ensure_partition(day date) RETURNS text AS $$
+DECLARE
+    month_start date := date_trunc('month', day)::date;
+    partition_name text := format('conversations_y%sm%s', to_char(month_start, 'YYYY'), to_char(month_start, 'MM'));
+BEGIN
+    IF to_regclass(partition_name) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF conversations FOR VALUES FROM (%L) TO (%L)',
+            partition_name, month_start, (month_start + interval '1 month')::date
+        );
+    END IF;
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relname = 'conversations' AND n.nspname = current_schema() AND c.relkind = 'r'
+    ) THEN
+        ALTER TABLE conversations RENAME TO conversations_legacy;
+        ALTER TABLE conversations_legacy RENAME CONSTRAINT conversations_pkey TO conversations_legacy_pkey;
+        DROP INDEX IF EXISTS ix_conversations_id;
+        DROP INDEX IF EXISTS ix_conversations_thread_id;
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS conversations (
+    id UUID NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    sender VARCHAR,
+    channel VARCHAR(16),
+    message VARCHAR,
+    response VARCHAR,
+    thread_id UUID,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE INDEX IF NOT EXISTS ix_conversations_sender_created_at ON conversations (sender, created_at);
+CREATE INDEX IF NOT EXISTS ix_conversations_thread_id_created_at ON conversations (thread_id, created_at);
+
+-- catches rows outside every monthly partition instead of failing the insert
+CREATE TABLE IF NOT EXISTS conversations_default PARTITION OF conversations DEFAULT;
+
+SELECT conversations_ensure_partition(current_date);
+
+-- rows stored before this migration carry no timestamp, they are dated to the migration
+DO $$
+BEGIN
+    IF to_regclass('conversations_legacy') IS NOT NULL THEN
+        INSERT INTO conversations (id, created_at, sender, message, response, thread_id)
+        SELECT id, now(), sender, message, response, thread_id FROM conversations_legacy;
+        DROP TABLE conversations_legacy;
+    END IF;
+END $$;
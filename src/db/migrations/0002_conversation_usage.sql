@@ -0,0 +1,5 @@
+-- Per-turn LLM usage stored on each conversation row, the per-node breakdown
+-- lives in llm_usage (created by create_all). Existing rows keep NULLs.
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS prompt_tokens INTEGER;
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS completion_tokens INTEGER;
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS cost_usd DOUBLE PRECISION;
@@ -0,0 +1,28 @@
+-- A month's partition cannot be created while the default partition holds rows
+-- for that month ("updated partition constraint for default partition would be
+-- violated"). conversations_ensure_partition now moves those rows out of the
+-- default partition, creates the partition and inserts them back into it.
+CREATE OR REPLACE FUNCTION conversations_ensure_partition(day date) RETURNS text AS $$
+DECLARE
+    month_start date := date_trunc('month', day)::date;
+    month_end date := (date_trunc('month', day) + interval '1 month')::date;
+    partition_name text := format('conversations_y%sm%s', to_char(month_start, 'YYYY'), to_char(month_start, 'MM'));
+BEGIN
+    IF to_regclass(partition_name) IS NULL THEN
+        CREATE TEMP TABLE IF NOT EXISTS conversations_moving (LIKE conversations) ON COMMIT DROP;
+        WITH moved AS (
+            DELETE FROM conversations_default
+            WHERE created_at >= month_start AND created_at < month_end
+            RETURNING *
+        )
+        INSERT INTO conversations_moving SELECT * FROM moved;
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF conversations FOR VALUES FROM (%L) TO (%L)',
+            partition_name, month_start, month_end
+        );
+        INSERT INTO conversations SELECT * FROM conversations_moving;
+        DELETE FROM conversations_moving;
+    END IF;
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,4 @@
+-- The conversation listing and exports page in (created_at, id) order. Without
+-- an index in that order, unfiltered and channel-only pages sorted every
+-- partition on each request.
+CREATE INDEX IF NOT EXISTS ix_conversations_created_at_id ON conversations (created_at, id);
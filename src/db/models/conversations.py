@@ -1,15 +1,33 @@
-from sqlalchemy import Column, String
+from datetime import datetime, timezone
+from sqlalchemy import Column, DateTime, Float, Index, Integer, String, func
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 from src.db.base import Base
 
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
 class Conversation(Base):
+    """
+    One row per inbound message and its reply. On Postgres the table is
+    partitioned by month on created_at (see src/db/migrations), so created_at
+    is part of the primary key.
+    """
     __tablename__ = "conversations"
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
+    __table_args__ = (
+        Index("ix_conversations_sender_created_at", "sender", "created_at"),
+        Index("ix_conversations_thread_id_created_at", "thread_id", "created_at"),
+        Index("ix_conversations_created_at_id", "created_at", "id"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    created_at = Column(DateTime(timezone=True), primary_key=True, default=_utcnow, server_default=func.now())
     sender = Column(String)
+    channel = Column(String(16))
     message = Column(String)
     response = Column(String)
-    thread_id = Column(UUID(as_uuid=True), index=True)
-    
-
-
+    thread_id = Column(UUID(as_uuid=True))
+    # LLM usage of the turn that produced the response, summed over nodes and models
+    prompt_tokens = Column(Integer)
+    completion_tokens = Column(Integer)
+    cost_usd = Column(Float)
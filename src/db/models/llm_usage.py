@@ -0,0 +1,22 @@
+from sqlalchemy import Column, DateTime, Float, Index, Integer, String, func
+from sqlalchemy.dialects.postgresql import UUID
+import uuid
+from src.db.base import Base
+
+class LLMUsage(Base):
+    """Tokens and cost of one conversation turn per graph node and model, see src/usage.py"""
+    __tablename__ = "llm_usage"
+    __table_args__ = (
+        Index("ix_llm_usage_thread_id_created_at", "thread_id", "created_at"),
+        Index("ix_llm_usage_sender_created_at", "sender", "created_at"),
+    )
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    thread_id = Column(UUID(as_uuid=True), nullable=False)
+    sender = Column(String)
+    node = Column(String(64), nullable=False)
+    model = Column(String(64), nullable=False)
+    calls = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    cost_usd = Column(Float, nullable=False, default=0.0)
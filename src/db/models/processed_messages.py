@@ -0,0 +1,9 @@
+from sqlalchemy import Column, DateTime, String, func
+from src.db.base import Base
+
+class ProcessedMessage(Base):
+    """Twilio MessageSids already accepted by /message, see src/idempotency.py"""
+    __tablename__ = "processed_messages"
+    message_sid = Column(String(64), primary_key=True)
+    state = Column(String(16), nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), index=True)
@@ -0,0 +1,9 @@
+from sqlalchemy import Column, String
+from sqlalchemy.dialects.postgresql import UUID
+from src.db.base import Base
+
+class SenderThread(Base):
+    """One conversation thread per sender, the primary key doubles as the unique lookup index"""
+    __tablename__ = "sender_threads"
+    sender = Column(String, primary_key=True)
+    thread_id = Column(UUID(as_uuid=True), nullable=False)
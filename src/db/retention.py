@@ -0,0 +1,173 @@
+"""
+Monthly conversation partitions: create the upcoming ones and move expired
+ones to compressed cold storage.
+
+Run from cron, e.g. daily:  python -m src.db.retention
+"""
+import argparse
+import csv
+import gzip
+import os
+import re
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
+from decouple import config
+from sqlalchemy import delete, select, text
+from sqlalchemy.engine import Engine
+from src.db.models.conversations import Conversation
+from utils.utils import logger
+
+CONVERSATION_RETENTION_DAYS = config("CONVERSATION_RETENTION_DAYS", default=365, cast=int)
+CONVERSATION_PARTITIONS_AHEAD = config("CONVERSATION_PARTITIONS_AHEAD", default=2, cast=int)
+# a local directory, or a mounted bucket
+CONVERSATION_ARCHIVE_DIR = config("CONVERSATION_ARCHIVE_DIR", default="archive/conversations")
+
+PARTITION_NAME = re.compile(r"^conversations_y(\d{4})m(\d{2})$")
+
+
+def _add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def ensure_partitions(engine: Engine, months_ahead: int = CONVERSATION_PARTITIONS_AHEAD) -> None:
+    """Create this month's partition and the next `months_ahead`, before any row needs them."""
+    if engine.dialect.name != "postgresql":
+        return
+    today = date.today()
+    with engine.begin() as conn:
+        for months in range(months_ahead + 1):
+            conn.execute(text("SELECT conversations_ensure_partition(:day)"), {"day": _add_months(today, months)})
+
+
+def expired_partitions(engine: Engine, cutoff: date) -> list[str]:
+    """
+    Monthly partitions whose whole month is older than `cutoff`, including
+    ones an interrupted run already detached but did not archive.
+    """
+    with engine.connect() as conn:
+        names = conn.execute(text(
+            "SELECT relname FROM pg_class WHERE relkind = 'r' AND relname LIKE 'conversations\\_y%'"
+        )).scalars()
+        expired = []
+        for name in names:
+            match = PARTITION_NAME.match(name)
+            if match and _add_months(date(int(match[1]), int(match[2]), 1), 1) <= cutoff:
+                expired.append(name)
+        return sorted(expired)
+
+
+def archive_partition(engine: Engine, name: str, archive_dir: Path) -> Path:
+    """Detach a partition, COPY it to a gzipped CSV and drop it once the file is complete."""
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    path = archive_dir / f"{name}.csv.gz"
+    tmp = path.with_suffix(".tmp")
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute(
+            "SELECT 1 FROM pg_inherits WHERE inhrelid = %s::regclass AND inhparent = 'conversations'::regclass",
+            (name,),
+        )
+        if cursor.fetchone():
+            # detached first, so the app never writes into a partition being archived
+            cursor.execute(f'ALTER TABLE conversations DETACH PARTITION "{name}"')
+            raw.commit()
+        with gzip.open(tmp, "wb") as f:
+            cursor.copy_expert(f'COPY "{name}" TO STDOUT WITH (FORMAT csv, HEADER)', f)
+        os.replace(tmp, path)
+        cursor.execute(f'DROP TABLE "{name}"')
+        raw.commit()
+    finally:
+        raw.close()
+    return path
+
+
+def archive_default_rows(engine: Engine, cutoff: date, archive_dir: Path) -> Optional[Path]:
+    """
+    Rows that fell outside every monthly partition sit in conversations_default.
+    Expired ones are deleted and copied out by one statement, committed only
+    once the file is complete.
+    """
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    path = archive_dir / f"conversations_default_{datetime.now(timezone.utc):%Y%m%dT%H%M%S}.csv.gz"
+    tmp = path.with_suffix(".tmp")
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        query = cursor.mogrify(
+            "COPY (DELETE FROM conversations_default WHERE created_at < %s RETURNING *) TO STDOUT WITH (FORMAT csv, HEADER)",
+            (cutoff,),
+        ).decode()
+        with gzip.open(tmp, "wb") as f:
+            cursor.copy_expert(query, f)
+        if cursor.rowcount <= 0:
+            raw.rollback()
+            tmp.unlink()
+            return None
+        os.replace(tmp, path)
+        raw.commit()
+        logger.info(f"Archived {cursor.rowcount} conversations from conversations_default to {path}")
+    finally:
+        raw.close()
+    return path
+
+
+def archive_rows(engine: Engine, cutoff: date, archive_dir: Path) -> Optional[Path]:
+    """Same retention for databases without partitions (local SQLite): export, then delete."""
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    cutoff_at = datetime.combine(cutoff, datetime.min.time(), tzinfo=timezone.utc)
+    path = archive_dir / f"conversations_before_{cutoff.isoformat()}.csv.gz"
+    columns = [c.name for c in Conversation.__table__.columns]
+    with engine.begin() as conn:
+        rows = conn.execute(select(Conversation.__table__).where(Conversation.created_at < cutoff_at)).all()
+        if not rows:
+            return None
+        with gzip.open(path, "wt", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(rows)
+        conn.execute(delete(Conversation).where(Conversation.created_at < cutoff_at))
+    logger.info(f"Archived {len(rows)} conversations to {path}")
+    return path
+
+
+def run_retention(
+    engine: Engine,
+    retention_days: int = CONVERSATION_RETENTION_DAYS,
+    archive_dir: str = CONVERSATION_ARCHIVE_DIR,
+    dry_run: bool = False,
+) -> list[str]:
+    """Archive everything older than `retention_days`, returns the archived partitions (or files)."""
+    cutoff = date.today() - timedelta(days=retention_days)
+    if engine.dialect.name != "postgresql":
+        if dry_run:
+            return []
+        path = archive_rows(engine, cutoff, Path(archive_dir))
+        return [str(path)] if path else []
+    ensure_partitions(engine)
+    expired = expired_partitions(engine, cutoff)
+    for name in expired:
+        if dry_run:
+            logger.info(f"Would archive {name}")
+            continue
+        path = archive_partition(engine, name, Path(archive_dir))
+        logger.info(f"Archived {name} to {path}")
+    if dry_run:
+        logger.info(f"Would archive rows of conversations_default older than {cutoff}")
+    elif archive_default_rows(engine, cutoff, Path(archive_dir)):
+        expired.append("conversations_default")
+    return expired
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--retention-days", type=int, default=CONVERSATION_RETENTION_DAYS)
+    parser.add_argument("--archive-dir", default=CONVERSATION_ARCHIVE_DIR)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    from src.db.session import engine
+
+    run_retention(engine, args.retention_days, args.archive_dir, args.dry_run)
@@ -1,39 +1,50 @@
-import logging
-from sqlalchemy import create_engine, event
-from sqlalchemy.engine import Engine
+from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.engine import URL
+from sqlalchemy.engine import URL, make_url
 from decouple import config
 
-# Load environment variables
-DB_USER = config("DB_USER")
-DB_PASSWORD = config("DB_PASSWORD")
-DB_HOST = config("DB_HOST")
-DB_PORT = config("DB_PORT")
-DB_NAME = config("DB_NAME")
-
-# Setup the connection URL
-url = URL.create(
-    drivername="postgresql",
-    username=DB_USER,
-    password=DB_PASSWORD,
-    host=DB_HOST,
-    port=DB_PORT,
-    database=DB_NAME,
-)
+# a full URL (e.g. sqlite:///bench.db) takes precedence over the DB_* settings
+DATABASE_URL = config("DATABASE_URL", default=None)
+
+if DATABASE_URL:
+    url = make_url(DATABASE_URL)
+else:
+    # Load environment variables
+    DB_USER = config("DB_USER")
+    DB_PASSWORD = config("DB_PASSWORD")
+    DB_HOST = config("DB_HOST")
+    DB_PORT = config("DB_PORT")
+    DB_NAME = config("DB_NAME")
+
+    # Setup the connection URL
+    url = URL.create(
+        drivername="postgresql",
+        username=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT,
+        database=DB_NAME,
+    )
+
+# Pool tuning, SQL echo stays off unless asked for
+DB_POOL_SIZE = config("DB_POOL_SIZE", default=10, cast=int)
+DB_MAX_OVERFLOW = config("DB_MAX_OVERFLOW", default=20, cast=int)
+DB_POOL_TIMEOUT = config("DB_POOL_TIMEOUT", default=10.0, cast=float)
+DB_POOL_RECYCLE = config("DB_POOL_RECYCLE", default=1800, cast=int)
+DB_POOL_PRE_PING = config("DB_POOL_PRE_PING", default=True, cast=bool)
+DB_ECHO = config("DB_ECHO", default=False, cast=bool)
+
+engine_options = {"echo": DB_ECHO, "pool_pre_ping": DB_POOL_PRE_PING}
+if url.get_backend_name() != "sqlite":
+    engine_options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
 
 # Create the engine
-engine = create_engine(url, echo=True)
+engine = create_engine(url, **engine_options)
 
 # Create session local
 SessionLocal = sessionmaker(bind=engine)
-
-# Enable logging for SQLAlchemy
-logging.basicConfig()
-logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
-
-# Log raw SQL statements
-logging.getLogger('sqlalchemy.dialects').setLevel(logging.DEBUG)
-
-
-    
\ No newline at end of file
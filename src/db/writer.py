@@ -0,0 +1,135 @@
+"""Write-behind buffers for conversation and LLM usage rows"""
+import queue
+import threading
+import time
+from typing import Optional
+from decouple import config
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+from src.db.base import Base
+from src.db.models.conversations import Conversation
+from src.db.models.llm_usage import LLMUsage
+from src.db.session import SessionLocal
+from src.telemetry import timed
+from utils.utils import logger
+
+CONVERSATION_BATCH_SIZE = config("CONVERSATION_BATCH_SIZE", default=200, cast=int)
+CONVERSATION_FLUSH_SECONDS = config("CONVERSATION_FLUSH_SECONDS", default=0.5, cast=float)
+CONVERSATION_BUFFER_SIZE = config("CONVERSATION_BUFFER_SIZE", default=20000, cast=int)
+CONVERSATION_WRITE_RETRIES = config("CONVERSATION_WRITE_RETRIES", default=3, cast=int)
+
+
+class ConversationWriter:
+    """
+    Takes rows of `table` (conversations by default) off the reply path.
+    Rows are buffered in memory and a background thread writes them as one
+    multi-row INSERT whenever `batch_size` rows are waiting or
+    `flush_interval` has passed. `stop`
+    writes whatever is left, so a clean shutdown loses nothing.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = CONVERSATION_BATCH_SIZE,
+        flush_interval: float = CONVERSATION_FLUSH_SECONDS,
+        buffer_size: int = CONVERSATION_BUFFER_SIZE,
+        session_factory=SessionLocal,
+        table: type[Base] = Conversation,
+    ):
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.session_factory = session_factory
+        self._queue: "queue.Queue[dict]" = queue.Queue(maxsize=buffer_size)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.overflowed = 0
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"{self.table.__tablename__}-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, row: dict) -> None:
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            # the database is falling behind, write this one inline rather than drop it
+            self.overflowed += 1
+            self._write([row])
+
+    def _take_batch(self) -> list[dict]:
+        rows = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(rows) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                rows.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return rows
+
+    def _drain_batch(self) -> list[dict]:
+        rows = []
+        while len(rows) < self.batch_size:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _write(self, rows: list[dict]) -> None:
+        for attempt in range(CONVERSATION_WRITE_RETRIES + 1):
+            try:
+                with timed("db", f"{self.table.__tablename__}_batch"), self.session_factory() as db:
+                    db.execute(insert(self.table), rows)
+                    db.commit()
+                self.written += len(rows)
+                self.batches += 1
+                logger.info(f"Stored {len(rows)} {self.table.__tablename__} rows")
+                return
+            except SQLAlchemyError as e:
+                if attempt == CONVERSATION_WRITE_RETRIES:
+                    self.failed += len(rows)
+                    logger.error(f"Dropped {len(rows)} {self.table.__tablename__} rows after {attempt + 1} attempts: {e}")
+                    return
+                logger.error(f"Error storing {len(rows)} {self.table.__tablename__} rows, retrying: {e}")
+                time.sleep(min(5.0, 0.5 * 2 ** attempt))
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            rows = self._take_batch()
+            if rows:
+                self._write(rows)
+        while rows := self._drain_batch():
+            self._write(rows)
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Flush everything still buffered and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error(f"{self.table.__tablename__} writer did not finish, {self._queue.qsize()} rows not stored")
+        self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "buffered": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "failed": self.failed,
+            "overflowed": self.overflowed,
+        }
+
+
+conversation_writer = ConversationWriter()
+usage_writer = ConversationWriter(table=LLMUsage)
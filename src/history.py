@@ -0,0 +1,188 @@
+"""Sliding-window history with a rolling summary of older turns"""
+import threading
+import tiktoken
+from decouple import config
+from langchain_core.messages import AnyMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage, convert_to_messages
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableConfig
+from src.llm import get_chat_model
+from src.telemetry import tool_result_tokens
+from utils.agent_helpers import _thread_id_from_config
+from utils.cache import TTLCache
+from utils.utils import logger
+
+HISTORY_MAX_TURNS = config("HISTORY_MAX_TURNS", default=8, cast=int)
+# fold older turns only once this many have piled up, so summaries are not rebuilt every turn
+HISTORY_SUMMARY_BATCH = config("HISTORY_SUMMARY_BATCH", default=4, cast=int)
+HISTORY_SUMMARY_MODEL = config("HISTORY_SUMMARY_MODEL", default="gpt-4o-mini")
+# what book_appointment answers when the booking went through
+BOOKED_RESULT = "successfully booked"
+
+# thread_id -> token counts of the last prompt built for that thread
+history_stats = TTLCache(maxsize=10000, ttl=24 * 3600)
+# thread_id -> token count of every message counted so far, the history only grows
+message_tokens = TTLCache(maxsize=10000, ttl=24 * 3600)
+
+summary_prompt = ChatPromptTemplate.from_messages([
+    ("system",
+     "You maintain a running summary of a customer support conversation for a home services company. "
+     "Merge the new messages into the existing summary. Keep names, emails, addresses, requested services, "
+     "dates, quoted prices and booking status. Be concise, at most 150 words."),
+    ("human", "Existing summary:\n{summary}\n\nNew messages:\n{messages}"),
+])
+
+
+def _is_user_turn(message: BaseMessage) -> bool:
+    # workers in the multi agent graph report back as named HumanMessages
+    return isinstance(message, HumanMessage) and not message.name
+
+
+def turn_starts(messages: list[BaseMessage]) -> list[int]:
+    """Indexes where a user turn starts. Tool calls and their results always stay inside one turn."""
+    starts = [i for i, m in enumerate(messages) if _is_user_turn(m)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    return starts
+
+
+def window_start(messages: list[BaseMessage], max_turns: int = HISTORY_MAX_TURNS) -> int:
+    starts = turn_starts(messages)
+    if len(starts) <= max_turns:
+        return 0
+    return starts[-max_turns]
+
+
+_encoding_lock = threading.Lock()
+_encoding_loaded = False
+_encoding = None
+
+
+def load_encoding():
+    """
+    Load the tokenizer once, at startup. The BPE file is downloaded on first
+    use, without it token counts are estimated and the failure is logged once.
+    """
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            try:
+                _encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                logger.warning(f"tiktoken encoding unavailable, estimating token counts: {e}")
+            _encoding_loaded = True
+        return _encoding
+
+
+def _text_tokens(text: str) -> int:
+    encoding = _encoding if _encoding_loaded else load_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+def count_tokens(messages: list[BaseMessage]) -> int:
+    total = 0
+    for m in messages:
+        content = m.content if isinstance(m.content, str) else str(m.content)
+        total += 4 + _text_tokens(content)
+        for tc in getattr(m, "tool_calls", None) or []:
+            total += _text_tokens(str(tc.get("args", "")))
+    return total
+
+
+def _message_tokens(thread_id: str, messages: list[BaseMessage]) -> list[int]:
+    """Token count of each message, only the messages added since the last call are counted."""
+    counts = message_tokens.get(thread_id)
+    if counts is None or len(counts) > len(messages):
+        counts = []
+    counts = counts + [count_tokens([m]) for m in messages[len(counts):]]
+    message_tokens.set(thread_id, counts)
+    return counts
+
+
+def compact_tool_results(messages: list[BaseMessage]) -> list[BaseMessage]:
+    """
+    Once a booking went through, the tool results before it in a worker's
+    scratchpad only cost tokens: they are replaced by a short reference to the
+    call that produced them. Tool results never reach the conversation
+    messages, the scratchpad is cleared at the end of every turn.
+    """
+    booked = max(
+        (i for i, m in enumerate(messages) if isinstance(m, ToolMessage) and BOOKED_RESULT in str(m.content)),
+        default=-1,
+    )
+    if booked < 0:
+        return messages
+    return [
+        ToolMessage(content=f"[{m.name or 'tool'} result omitted, superseded by the booking]", name=m.name, tool_call_id=m.tool_call_id)
+        if i < booked and isinstance(m, ToolMessage) else m
+        for i, m in enumerate(messages)
+    ]
+
+
+def report_tool_tokens(messages: list[BaseMessage]) -> None:
+    """Record how many prompt tokens each tool result adds."""
+    for m in messages:
+        if isinstance(m, ToolMessage):
+            tokens = _text_tokens(m.content if isinstance(m.content, str) else str(m.content))
+            tool_result_tokens.observe(tokens, m.name or "tool")
+            logger.info(f"Tool {m.name} returned {tokens} tokens")
+
+
+def trim_state(state: dict, config: RunnableConfig = None) -> dict:
+    """
+    Return a copy of the graph state whose messages are the last turns plus
+    the running summary. The checkpointed state itself is never modified.
+    """
+    messages = convert_to_messages(state["messages"])
+    # turns that are out of the window but not yet folded into the summary stay verbatim
+    start = min(window_start(messages), state.get("summarized") or 0)
+    window = messages[start:]
+    summary = [SystemMessage(content=f"Summary of the earlier conversation: {state['summary']}")] if state.get("summary") else []
+    thread_id = _thread_id_from_config(config)
+    if thread_id:
+        counts = _message_tokens(thread_id, messages)
+        before = sum(counts)
+        after = count_tokens(summary) + sum(counts[start:])
+        history_stats.set(thread_id, {"messages": len(messages), "tokens_before": before, "tokens_after": after})
+        if start > 0:
+            logger.info(f"Trimmed history for thread {thread_id}: {before} -> {after} tokens")
+    return {**state, "messages": summary + window}
+
+
+def _render(messages: list[AnyMessage]) -> str:
+    lines = []
+    for m in messages:
+        if isinstance(m, ToolMessage):
+            lines.append(f"tool result: {str(m.content)[:300]}")
+        elif m.content:
+            lines.append(f"{m.name or m.type}: {m.content}")
+    return "\n".join(lines)
+
+
+def summarize_thread(graph, config: RunnableConfig) -> None:
+    """
+    Fold turns that fell out of the window into the thread's running summary.
+    Runs as a low priority job of its own once the reply has been sent, see
+    SenderMailbox.
+    """
+    snapshot = graph.get_state(config)
+    values = snapshot.values or {}
+    if not values.get("messages"):
+        return
+    messages = convert_to_messages(values["messages"])
+    summarized = values.get("summarized") or 0
+    cutoff = window_start(messages)
+    if cutoff - summarized <= 0:
+        return
+    if len([i for i in turn_starts(messages) if summarized <= i < cutoff]) < HISTORY_SUMMARY_BATCH:
+        return
+    llm = get_chat_model(HISTORY_SUMMARY_MODEL, temperature=0)
+    summary = (summary_prompt | llm).invoke({
+        "summary": values.get("summary") or "(none)",
+        "messages": _render(messages[summarized:cutoff]),
+    }, {**config, "metadata": {"usage_node": "summary"}}).content
+    # attribute the update to the node that finished the turn, so nothing is scheduled next
+    as_node = next(iter((snapshot.metadata or {}).get("writes") or {}), None)
+    graph.update_state(config, {"summary": summary, "summarized": cutoff}, as_node=as_node)
+    logger.info(f"Summarized {cutoff - summarized} messages for thread {config['configurable']['thread_id']}")
@@ -0,0 +1,159 @@
+"""Deduplication of Twilio webhook deliveries on MessageSid"""
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from decouple import config
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import SQLAlchemyError
+from src.db.models.processed_messages import ProcessedMessage
+from src.db.session import SessionLocal
+from utils.cache import TTLCache
+from utils.utils import logger
+
+# "memory" dedups within one process, "postgres" across every app instance
+IDEMPOTENCY_BACKEND = config("IDEMPOTENCY_BACKEND", default="memory")
+IDEMPOTENCY_TTL_SECONDS = config("IDEMPOTENCY_TTL_SECONDS", default=24 * 3600.0, cast=float)
+IDEMPOTENCY_CACHE_SIZE = config("IDEMPOTENCY_CACHE_SIZE", default=100000, cast=int)
+# an in-flight claim older than this belongs to a crashed worker and can be taken over
+IDEMPOTENCY_IN_FLIGHT_SECONDS = config("IDEMPOTENCY_IN_FLIGHT_SECONDS", default=600.0, cast=float)
+
+IN_FLIGHT = "in_flight"
+COMPLETED = "completed"
+
+
+class MemoryIdempotencyStore:
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL_SECONDS, maxsize: int = IDEMPOTENCY_CACHE_SIZE):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def claim(self, key: str) -> Optional[str]:
+        """Mark `key` in flight. Returns None if it is new, or the state it is already in."""
+        return self.cache.add(key, IN_FLIGHT, ttl=IDEMPOTENCY_IN_FLIGHT_SECONDS)
+
+    def complete(self, key: str) -> None:
+        self.cache.set(key, COMPLETED)
+
+    def release(self, key: str) -> None:
+        self.cache.delete(key)
+
+
+class PostgresIdempotencyStore:
+    """Same contract, backed by the processed_messages table so every instance sees it."""
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL_SECONDS, session_factory=SessionLocal):
+        self.ttl = ttl
+        self.session_factory = session_factory
+        self._last_purge = 0.0
+
+    def claim(self, key: str) -> Optional[str]:
+        now = datetime.now(timezone.utc)
+        with self.session_factory() as db:
+            claimed = db.execute(
+                postgresql.insert(ProcessedMessage)
+                .values(message_sid=key, state=IN_FLIGHT, updated_at=now)
+                .on_conflict_do_nothing(index_elements=["message_sid"])
+                .returning(ProcessedMessage.message_sid)
+            ).first()
+            if claimed is None:
+                # take over claims left behind by a crashed worker or an expired entry
+                claimed = db.execute(
+                    update(ProcessedMessage)
+                    .where(ProcessedMessage.message_sid == key)
+                    .where(
+                        ((ProcessedMessage.state == IN_FLIGHT) & (ProcessedMessage.updated_at < now - timedelta(seconds=IDEMPOTENCY_IN_FLIGHT_SECONDS)))
+                        | (ProcessedMessage.updated_at < now - timedelta(seconds=self.ttl))
+                    )
+                    .values(state=IN_FLIGHT, updated_at=now)
+                    .returning(ProcessedMessage.message_sid)
+                ).first()
+            state = None if claimed is not None else db.execute(
+                select(ProcessedMessage.state).where(ProcessedMessage.message_sid == key)
+            ).scalar()
+            db.commit()
+        self._purge()
+        return state
+
+    def _set(self, key: str, state: str) -> None:
+        with self.session_factory() as db:
+            db.execute(
+                update(ProcessedMessage)
+                .where(ProcessedMessage.message_sid == key)
+                .values(state=state, updated_at=datetime.now(timezone.utc))
+            )
+            db.commit()
+
+    def complete(self, key: str) -> None:
+        self._set(key, COMPLETED)
+
+    def release(self, key: str) -> None:
+        with self.session_factory() as db:
+            db.execute(delete(ProcessedMessage).where(ProcessedMessage.message_sid == key))
+            db.commit()
+
+    def _purge(self) -> None:
+        # at most once an hour per instance, expired rows are otherwise only ignored
+        if time.monotonic() - self._last_purge < 3600:
+            return
+        self._last_purge = time.monotonic()
+        with self.session_factory() as db:
+            db.execute(delete(ProcessedMessage).where(
+                ProcessedMessage.updated_at < datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+            ))
+            db.commit()
+
+
+class Idempotency:
+    """
+    Twilio retries a webhook delivery when our answer is slow or fails. Each
+    MessageSid is claimed before the message is queued; a repeat delivery
+    finds the claim (in flight or completed) and is acknowledged without
+    running the agents again. Failed jobs release their claim, so the message
+    can still be processed when it is delivered again.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.accepted = 0
+        self.duplicates = 0
+        self.errors = 0
+
+    def claim(self, message_sid: Optional[str]) -> Optional[str]:
+        if not message_sid:
+            return None
+        try:
+            state = self.store.claim(message_sid)
+        except SQLAlchemyError as e:
+            # better a rare duplicate reply than dropping the message
+            self.errors += 1
+            logger.error(f"Idempotency store unavailable, processing {message_sid} anyway: {e}")
+            return None
+        if state is None:
+            self.accepted += 1
+        else:
+            self.duplicates += 1
+        return state
+
+    def finish(self, message_sids: list[str], ok: bool) -> None:
+        for message_sid in message_sids:
+            try:
+                if ok:
+                    self.store.complete(message_sid)
+                else:
+                    self.store.release(message_sid)
+            except SQLAlchemyError as e:
+                self.errors += 1
+                logger.error(f"Could not record the state of {message_sid}: {e}")
+
+    def stats(self) -> dict:
+        return {"backend": IDEMPOTENCY_BACKEND, "accepted": self.accepted, "duplicates": self.duplicates, "errors": self.errors}
+
+
+def _store():
+    if IDEMPOTENCY_BACKEND == "postgres":
+        return PostgresIdempotencyStore()
+    if IDEMPOTENCY_BACKEND == "memory":
+        return MemoryIdempotencyStore()
+    raise ValueError(f"Unknown IDEMPOTENCY_BACKEND: {IDEMPOTENCY_BACKEND}")
+
+
+idempotency = Idempotency(_store())
@@ -0,0 +1,385 @@
+"""Chat model construction in one place, so the models can be swapped without touching the graphs"""
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+import httpx
+from decouple import config
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_function, convert_to_openai_tool
+from langchain_openai import ChatOpenAI
+from src.cassette import cassette_attempt, keep_attempt, wrap_chat_model
+from src.telemetry import Counter, register_metric
+from utils.utils import logger
+
+LLM_RESILIENCE = config("LLM_RESILIENCE", default=True, cast=bool)
+LLM_MAX_CONNECTIONS = config("LLM_MAX_CONNECTIONS", default=100, cast=int)
+# deadline of a single request, and of the whole call across retries and fallbacks
+LLM_TIMEOUT = config("LLM_TIMEOUT", default=30.0, cast=float)
+LLM_DEADLINE = config("LLM_DEADLINE", default=60.0, cast=float)
+LLM_RETRIES = config("LLM_RETRIES", default=1, cast=int)
+# a duplicate request is sent once the first one is slower than this percentile of recent calls
+LLM_HEDGE = config("LLM_HEDGE", default=True, cast=bool)
+LLM_HEDGE_PERCENTILE = config("LLM_HEDGE_PERCENTILE", default=0.95, cast=float)
+LLM_HEDGE_MIN_SAMPLES = config("LLM_HEDGE_MIN_SAMPLES", default=20, cast=int)
+LLM_HEDGE_MIN_DELAY = config("LLM_HEDGE_MIN_DELAY", default=1.0, cast=float)
+LLM_HEDGE_DEFAULT_DELAY = config("LLM_HEDGE_DEFAULT_DELAY", default=8.0, cast=float)
+# primary:fallback pairs, tried in order once the primary is slow or failing
+LLM_FALLBACKS = config("LLM_FALLBACKS", default="gpt-4o:gpt-4o-mini")
+
+# client errors a retry or another model will not fix
+NON_RETRYABLE_STATUSES = {400, 401, 403, 404, 422}
+
+ChatModelFactory = Callable[..., BaseChatModel]
+
+_factory: Optional[ChatModelFactory] = None
+
+# set for turns of threads over their token budget, they skip straight to the fallback models
+downgrade_var: contextvars.ContextVar[bool] = contextvars.ContextVar("llm_downgrade", default=False)
+
+llm_events = Counter("sweep_llm_events_total", "LLM hedges, retries, timeouts, fallbacks and budget downgrades", ("model", "event"))
+register_metric(llm_events)
+
+
+@contextmanager
+def downgraded(active: bool = True):
+    """Run the calls inside the block on the cheaper fallback models, where a model has one."""
+    token = downgrade_var.set(active)
+    try:
+        yield
+    finally:
+        downgrade_var.reset(token)
+
+
+class LLMTimeoutError(TimeoutError):
+    """Raised when a model does not answer before its deadline."""
+
+
+class LLMUnavailableError(Exception):
+    """Raised when the primary model and every fallback failed."""
+
+
+def _parse_fallbacks(value: str) -> dict[str, list[str]]:
+    fallbacks: dict[str, list[str]] = {}
+    for pair in filter(None, (p.strip() for p in value.split(","))):
+        primary, _, fallback = pair.partition(":")
+        if fallback:
+            fallbacks.setdefault(primary.strip(), []).append(fallback.strip())
+    return fallbacks
+
+
+FALLBACKS = _parse_fallbacks(LLM_FALLBACKS)
+
+
+class LatencyTracker:
+    """Recent request latencies of one model, the hedge delay is a high percentile of them."""
+
+    def __init__(self, size: int = 500):
+        self.samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self.samples) < LLM_HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def hedge_delay(self) -> float:
+        p = self.percentile(LLM_HEDGE_PERCENTILE)
+        return LLM_HEDGE_DEFAULT_DELAY if p is None else max(LLM_HEDGE_MIN_DELAY, p)
+
+
+_latencies: dict[str, LatencyTracker] = {}
+_latencies_lock = threading.Lock()
+
+
+def _tracker(model: str) -> LatencyTracker:
+    with _latencies_lock:
+        return _latencies.setdefault(model, LatencyTracker())
+
+
+def _model_name(model: BaseChatModel) -> str:
+    return getattr(model, "model_name", None) or getattr(model, "model", None) or type(model).__name__
+
+
+def _backoff(attempt: int, base: float = 0.5, cap: float = 4.0) -> float:
+    # exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _retryable(error: Exception) -> bool:
+    return getattr(error, "status_code", None) not in NON_RETRYABLE_STATUSES
+
+
+class _Transport:
+    """One keep-alive pooled HTTP client per flavour, shared by every OpenAI chat model."""
+
+    def __init__(self, max_connections: int = LLM_MAX_CONNECTIONS):
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> httpx.Client:
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(limits=self._limits, timeout=LLM_TIMEOUT)
+            return self._client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        with self._lock:
+            if self._async_client is None:
+                self._async_client = httpx.AsyncClient(limits=self._limits, timeout=LLM_TIMEOUT)
+            return self._async_client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            self._client.close()
+        if self._async_client is not None:
+            await self._async_client.aclose()
+
+
+transport = _Transport()
+# sync hedges need a thread each, the caller's thread only waits for the first answer
+_executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONNECTIONS, thread_name_prefix="llm")
+
+
+class ResilientChatModel(BaseChatModel):
+    """
+    Chat model that calls `candidates` in order: the primary model, then its fallbacks.
+
+    Every request has a deadline. Once a request is slower than the recent p95
+    of its model a duplicate is sent and the first answer wins. Failures are
+    retried with backoff, a timeout moves straight on to the next model, and
+    the whole call is bounded by `deadline`. Sync hedges that lose keep running
+    to completion in the background, async ones are cancelled.
+    """
+
+    model: str
+    candidates: list[BaseChatModel]
+    timeout: float = LLM_TIMEOUT
+    deadline: float = LLM_DEADLINE
+    retries: int = LLM_RETRIES
+    hedge: bool = LLM_HEDGE
+
+    @property
+    def _llm_type(self) -> str:
+        return "resilient-chat"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model": self.model, "fallbacks": [_model_name(m) for m in self.candidates[1:]]}
+
+    def bind_tools(self, tools: list, tool_choice: Optional[str] = None, **kwargs: Any):
+        if tool_choice is not None and tool_choice not in ("auto", "none", "required"):
+            tool_choice = {"type": "function", "function": {"name": tool_choice}}
+        if tool_choice is not None:
+            kwargs["tool_choice"] = tool_choice
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def bind_functions(self, functions: list, function_call: Optional[str] = None, **kwargs: Any):
+        functions = [convert_to_openai_function(f) for f in functions]
+        if function_call is not None:
+            kwargs["function_call"] = {"name": function_call}
+        return self.bind(functions=functions, **kwargs)
+
+    def _attempts(self):
+        """Yield (model, name, attempt) in call order, with the events between them counted."""
+        candidates = self.candidates
+        if downgrade_var.get() and len(candidates) > 1:
+            llm_events.inc(self.model, "downgrade")
+            candidates = candidates[1:]
+        for i, model in enumerate(candidates):
+            name = _model_name(model)
+            if i:
+                llm_events.inc(name, "fallback")
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    llm_events.inc(name, "retry")
+                yield model, name, attempt
+
+    def _failed(self, name: str, attempt: int, error: Exception) -> Optional[float]:
+        """Count and log a failed request. Returns the backoff before a retry, None to move to the next model."""
+        timed_out = isinstance(error, LLMTimeoutError)
+        llm_events.inc(name, "timeout" if timed_out else "error")
+        logger.warning(f"LLM request to {name} failed (attempt {attempt + 1}): {error!r}")
+        if not _retryable(error):
+            raise error
+        if timed_out or attempt >= self.retries:
+            return None
+        return _backoff(attempt)
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        deadline = time.monotonic() + self.deadline
+        error: Optional[Exception] = None
+        skip = None
+        for model, name, attempt in self._attempts():
+            if model is skip:
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                return self._hedged(model, name, messages, stop, kwargs, min(self.timeout, remaining))
+            except Exception as e:
+                error = e
+                delay = self._failed(name, attempt, e)
+                if delay is None:
+                    skip = model
+                else:
+                    time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+        raise LLMUnavailableError(f"No model answered for {self.model}: {error!r}") from error
+
+    def _hedged(self, model: BaseChatModel, name: str, messages, stop, kwargs: dict, timeout: float) -> ChatResult:
+        tracker = _tracker(name)
+
+        def call() -> tuple[ChatResult, list[dict]]:
+            start = time.perf_counter()
+            with cassette_attempt() as recorded:
+                result = model._generate(messages, stop=stop, **kwargs)
+            tracker.observe(time.perf_counter() - start)
+            return result, recorded
+
+        # copy the caller's context so the trace ID follows the request into the pool
+        started = time.monotonic()
+        pending = {_executor.submit(contextvars.copy_context().run, call)}
+        delay = tracker.hedge_delay()
+        if self.hedge and delay < timeout:
+            done, _ = wait(pending, timeout=delay)
+            if not done:
+                llm_events.inc(name, "hedge")
+                pending.add(_executor.submit(contextvars.copy_context().run, call))
+        error: Optional[Exception] = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, timeout - (time.monotonic() - started)), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    result, recorded = future.result()
+                    keep_attempt(recorded)
+                    return result
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        raise LLMTimeoutError(f"{name} did not answer within {timeout:.1f}s")
+
+    async def _agenerate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        deadline = time.monotonic() + self.deadline
+        error: Optional[Exception] = None
+        skip = None
+        for model, name, attempt in self._attempts():
+            if model is skip:
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                return await self._ahedged(model, name, messages, stop, kwargs, min(self.timeout, remaining))
+            except Exception as e:
+                error = e
+                delay = self._failed(name, attempt, e)
+                if delay is None:
+                    skip = model
+                else:
+                    await asyncio.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+        raise LLMUnavailableError(f"No model answered for {self.model}: {error!r}") from error
+
+    async def _ahedged(self, model: BaseChatModel, name: str, messages, stop, kwargs: dict, timeout: float) -> ChatResult:
+        tracker = _tracker(name)
+
+        async def call() -> tuple[ChatResult, list[dict]]:
+            start = time.perf_counter()
+            with cassette_attempt() as recorded:
+                result = await model._agenerate(messages, stop=stop, **kwargs)
+            tracker.observe(time.perf_counter() - start)
+            return result, recorded
+
+        started = time.monotonic()
+        pending = {asyncio.ensure_future(call())}
+        try:
+            delay = tracker.hedge_delay()
+            if self.hedge and delay < timeout:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done:
+                    llm_events.inc(name, "hedge")
+                    pending.add(asyncio.ensure_future(call()))
+            error: Optional[Exception] = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, timeout - (time.monotonic() - started)), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        result, recorded = task.result()
+                        keep_attempt(recorded)
+                        return result
+                    error = task.exception()
+            if error is not None and not pending:
+                raise error
+            raise LLMTimeoutError(f"{name} did not answer within {timeout:.1f}s")
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def _build_chat_model(model: str, **kwargs) -> BaseChatModel:
+    # every model a graph calls is wrapped, so cassettes see the model that actually answered
+    return wrap_chat_model(_new_chat_model(model, **kwargs))
+
+
+def _new_chat_model(model: str, **kwargs) -> BaseChatModel:
+    if _factory is not None:
+        return _factory(model, **kwargs)
+    # retries and deadlines are handled by ResilientChatModel, not by the OpenAI client
+    return ChatOpenAI(
+        model=model,
+        timeout=LLM_TIMEOUT,
+        max_retries=0 if LLM_RESILIENCE else 2,
+        http_client=transport.client,
+        http_async_client=transport.async_client,
+        **kwargs,
+    )
+
+
+def get_chat_model(model: str, **kwargs) -> BaseChatModel:
+    primary = _build_chat_model(model, **kwargs)
+    if not LLM_RESILIENCE:
+        return primary
+    candidates = [primary] + [_build_chat_model(name, **kwargs) for name in FALLBACKS.get(model, [])]
+    return ResilientChatModel(model=model, candidates=candidates)
+
+
+def set_chat_model_factory(factory: Optional[ChatModelFactory]) -> None:
+    """Override how chat models are built (benchmarks, offline runs). Pass None to restore OpenAI."""
+    global _factory
+    _factory = factory
+
+
+def llm_stats() -> dict:
+    with _latencies_lock:
+        trackers = dict(_latencies)
+    return {
+        name: {"samples": len(t.samples), "hedge_delay_seconds": t.hedge_delay()}
+        for name, t in trackers.items()
+    }
+
+
+async def close_llm_clients() -> None:
+    await transport.aclose()
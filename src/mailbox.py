@@ -0,0 +1,213 @@
+import asyncio
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+from decouple import config
+from src.workers import AgentWorkerPool
+from utils.utils import logger
+
+MAILBOX_DEBOUNCE_SECONDS = config("MAILBOX_DEBOUNCE_SECONDS", default=2.0, cast=float)
+MAILBOX_MAX_WAIT_SECONDS = config("MAILBOX_MAX_WAIT_SECONDS", default=6.0, cast=float)
+
+
+@dataclass
+class _Slot:
+    message_type: str
+    pending: list[str] = field(default_factory=list)
+    pending_ids: list[str] = field(default_factory=list)
+    running_ids: list[str] = field(default_factory=list)
+    first_at: float = 0.0
+    timer: Optional[asyncio.TimerHandle] = None
+    active: bool = False
+    priority: int = 0
+
+
+class _Background:
+    """A low priority job for an idle sender, skipped when their next message gets there first."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = "queued"
+
+    def start(self) -> bool:
+        with self._lock:
+            if self.state == "skipped":
+                return False
+            self.state = "running"
+            return True
+
+    def skip(self) -> bool:
+        with self._lock:
+            if self.state == "queued":
+                self.state = "skipped"
+            return self.state == "skipped"
+
+
+class SenderMailbox:
+    """
+    Per-sender mailbox in front of the agent pool.
+
+    Messages from the same sender that arrive within the debounce window are
+    merged into a single job, and at most one job per sender runs at a time so
+    graph invocations never race on the same thread checkpoint. Messages that
+    arrive while a job is running are held and flushed once it finishes.
+    `on_complete` is told which message ids a job covered and whether it succeeded.
+
+    After a successful job `background(sender)` is queued at `background_priority`
+    (thread housekeeping such as the history summary). It never delays a reply:
+    a new message skips it while it is still queued, and only waits for it
+    when it is already running, so both never touch the thread at once.
+    """
+
+    def __init__(
+        self,
+        pool: AgentWorkerPool,
+        handler: Callable[[str, str, str], object],
+        debounce: float = MAILBOX_DEBOUNCE_SECONDS,
+        max_wait: float = MAILBOX_MAX_WAIT_SECONDS,
+        on_complete: Optional[Callable[[list[str], bool], None]] = None,
+        background: Optional[Callable[[str], object]] = None,
+        background_priority: int = 0,
+    ):
+        self.pool = pool
+        self.handler = handler
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self.on_complete = on_complete
+        self.background = background
+        self.background_priority = background_priority
+        self._slots: dict[str, _Slot] = {}
+        self._background: dict[str, _Background] = {}
+        self.received = 0
+        self.dispatched = 0
+        self.background_run = 0
+        self.background_skipped = 0
+
+    def put(self, sender: str, message_type: str, body: str, message_id: Optional[str] = None, priority: int = 0) -> None:
+        slot = self._slots.get(sender)
+        if slot is None:
+            slot = self._slots[sender] = _Slot(message_type=message_type)
+        if not slot.pending:
+            slot.first_at = time.monotonic()
+            slot.priority = priority
+        slot.priority = min(slot.priority, priority)
+        slot.pending.append(body)
+        if message_id:
+            slot.pending_ids.append(message_id)
+        self.received += 1
+        if not slot.active:
+            self._schedule(sender, slot)
+
+    def _schedule(self, sender: str, slot: _Slot) -> None:
+        if slot.timer is not None:
+            slot.timer.cancel()
+        # debounce, but never hold the first message longer than max_wait
+        waited = time.monotonic() - slot.first_at
+        delay = max(0.0, min(self.debounce, self.max_wait - waited))
+        slot.timer = asyncio.get_running_loop().call_later(delay, self._flush, sender)
+
+    def _flush(self, sender: str) -> None:
+        slot = self._slots.get(sender)
+        if slot is None or slot.active or not slot.pending:
+            return
+        slot.timer = None
+        job = self._background.get(sender)
+        if job is not None:
+            if not job.skip():
+                # already running, the burst is flushed when it finishes
+                return
+            self._background.pop(sender, None)
+            self.background_skipped += 1
+        query = "\n".join(slot.pending)
+        if len(slot.pending) > 1:
+            logger.info(f"Coalesced {len(slot.pending)} messages from {sender}")
+        slot.pending = []
+        slot.running_ids, slot.pending_ids = slot.pending_ids, []
+        slot.active = True
+        try:
+            future = self.pool.submit(self.handler, query, sender, slot.message_type, priority=slot.priority)
+        except Exception as e:
+            logger.error(f"Could not dispatch messages from {sender}: {e}")
+            self._complete(slot, False)
+            self._release(sender, slot, ok=False)
+            return
+        self.dispatched += 1
+        future.add_done_callback(lambda f: self._done(sender, f))
+
+    def _done(self, sender: str, future: asyncio.Future) -> None:
+        ok = not future.cancelled() and future.exception() is None
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Job for {sender} failed: {future.exception()}")
+        slot = self._slots.get(sender)
+        if slot is not None:
+            self._complete(slot, ok)
+            self._release(sender, slot, ok=ok)
+
+    def _complete(self, slot: _Slot, ok: bool) -> None:
+        ids, slot.running_ids = slot.running_ids, []
+        if ids and self.on_complete is not None:
+            try:
+                self.on_complete(ids, ok)
+            except Exception as e:
+                logger.error(f"Completion callback failed for {ids}: {e}")
+
+    def _release(self, sender: str, slot: _Slot, ok: bool) -> None:
+        slot.active = False
+        if slot.pending:
+            self._schedule(sender, slot)
+            return
+        del self._slots[sender]
+        if ok and self.background is not None:
+            self._queue_background(sender)
+
+    def _queue_background(self, sender: str) -> None:
+        job = _Background()
+
+        def run() -> None:
+            if job.start():
+                self.background_run += 1
+                self.background(sender)
+
+        try:
+            future = self.pool.submit(run, priority=self.background_priority)
+        except Exception as e:
+            logger.info(f"Skipped background job for {sender}: {e}")
+            return
+        self._background[sender] = job
+        future.add_done_callback(lambda f: self._background_done(sender, job, f))
+
+    def _background_done(self, sender: str, job: _Background, future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Background job for {sender} failed: {future.exception()}")
+        if self._background.get(sender) is job:
+            del self._background[sender]
+        slot = self._slots.get(sender)
+        if slot is not None and slot.timer is None:
+            # a burst that arrived while the job was running
+            self._flush(sender)
+
+    def __contains__(self, sender: str) -> bool:
+        return sender in self._slots
+
+    def __len__(self) -> int:
+        # senders with a job queued, running or about to be dispatched
+        return len(self._slots)
+
+    def flush_all(self) -> None:
+        """Dispatch every pending burst immediately, used on shutdown."""
+        for sender, slot in list(self._slots.items()):
+            if slot.timer is not None:
+                slot.timer.cancel()
+            self._flush(sender)
+
+    def stats(self) -> dict:
+        return {
+            "senders": len(self._slots),
+            "pending_messages": sum(len(s.pending) for s in self._slots.values()),
+            "received": self.received,
+            "dispatched": self.dispatched,
+            "background_queued": len(self._background),
+            "background_run": self.background_run,
+            "background_skipped": self.background_skipped,
+        }
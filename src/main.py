@@ -1,16 +1,56 @@
+import asyncio
+import time
 import uuid
+from datetime import datetime, timezone
 import re
-from fastapi import FastAPI, Form, Depends, Request, HTTPException
+from contextlib import asynccontextmanager
+from typing import Literal, Optional
+from fastapi import FastAPI, Form, Depends, Request, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field, field_validator
+from decouple import config
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 from src.db.session import engine, SessionLocal
 from src.db.base import Base
-from src.db.models.conversations import Conversation
-from utils.utils import send_whatsapp, send_sms, logger
-from src.agent import agent_graph
-from src.multi_agent import multi_agent_graph 
+from src.db.models.sender_threads import SenderThread
+from src.db.writer import conversation_writer, usage_writer
+from src.db.migrate import run_migrations
+from src.db.retention import ensure_partitions
+from src.conversations import ConversationFilter, InvalidCursor, list_conversations, export_csv, export_ndjson
+from utils.utils import logger
+from src.agent import get_agent_graph
+from src.multi_agent import get_multi_agent_graph
+from src.prompts import prompt_registry
+from src.routing import router
+from src.response_cache import response_cache, record_cached_turn, RESPONSE_CACHE_ENABLED
+from src.workers import agent_pool
+from src.outbound import outbound
+from src.checkpoint import close_checkpointers, checkpointer_stats
+from src.mailbox import SenderMailbox
+from src.idempotency import idempotency
+from src.admission import AdmissionController, ADMITTED, ADMISSION_BUSY_MESSAGE, PRIORITY_BACKGROUND
+from src.history import summarize_thread, history_stats, load_encoding
+from src.tools.availability import availability_cache
+from src.tools.http import webhooks
+from src.llm import close_llm_clients, downgraded, llm_stats
+from src.cassette import cassettes, current_turn, SUMMARY_CHANNEL
+from src.usage import usage_callback, usage_tracker, DOWNGRADE, HANDOFF, USAGE_HANDOFF_MESSAGE
+from src.telemetry import (
+    install_log_trace_ids, metrics_callback, message_latency, new_trace_id, register_stats, render_metrics, timed,
+)
+from utils.cache import TTLCache
+
+THREAD_CACHE_SIZE = config("THREAD_CACHE_SIZE", default=10000, cast=int)
+THREAD_CACHE_TTL = config("THREAD_CACHE_TTL", default=3600.0, cast=float)
+# the conversation endpoints expose customer data, they stay off until a token is set
+EXPORT_API_TOKEN = config("EXPORT_API_TOKEN", default=None)
+
+install_log_trace_ids()
 
 class Configurable(BaseModel):
     phone_number: str = Field(...)
@@ -40,7 +80,28 @@ class Configurable(BaseModel):
 class Query(BaseModel):
     message: str
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    # the tokenizer may have to be downloaded, never on a request
+    await run_in_threadpool(load_encoding)
+    conversation_writer.start()
+    usage_writer.start()
+    await outbound.start()
+    await agent_pool.start()
+    prompt_registry.start_refresh()
+    yield
+    prompt_registry.stop_refresh()
+    mailbox.flush_all()
+    await agent_pool.drain()
+    conversation_writer.stop()
+    usage_writer.stop()
+    await outbound.drain()
+    close_checkpointers()
+    await webhooks.aclose()
+    await close_llm_clients()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:3000",
@@ -55,6 +116,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # every log line of a request, and of the agent job it queues, carries this ID
+    trace_id = new_trace_id(request.headers.get("X-Request-ID"))
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = trace_id
+    return response
+
 def get_db():
     db = SessionLocal()
     try:
@@ -62,18 +131,54 @@ def get_db():
     finally:
         db.close()
 
+def init_db() -> None:
+    # Postgres schema changes live in src/db/migrations, create_all fills in the rest
+    run_migrations(engine)
+    Base.metadata.create_all(bind=engine)
+    ensure_partitions(engine)
+    if engine.dialect.name != "postgresql":
+        return
+    with SessionLocal() as db:
+        if db.execute(select(SenderThread.sender).limit(1)).first() is None:
+            # one-off backfill from conversations stored before sender_threads existed
+            db.execute(text(
+                "INSERT INTO sender_threads (sender, thread_id) "
+                "SELECT DISTINCT ON (sender) sender, thread_id FROM conversations "
+                "WHERE sender IS NOT NULL AND thread_id IS NOT NULL "
+                "ON CONFLICT DO NOTHING"
+            ))
+            db.commit()
+
+thread_cache = TTLCache(maxsize=THREAD_CACHE_SIZE, ttl=THREAD_CACHE_TTL)
+
 def get_or_create_thread_id(db:Session, phone_number: str) -> uuid.UUID:
+    thread_id = thread_cache.get(phone_number)
+    if thread_id is not None:
+        return thread_id
     try:
-        conversation = db.query(Conversation).filter(Conversation.sender == phone_number).first()
-        if conversation:
-            return conversation.thread_id
-        else:
-            # Create a new conversation with a new UUID thread_id
-            new_thread_id = uuid.uuid4()
-            return new_thread_id
+        with timed("db", "get_or_create_thread_id"):
+            # atomic get-or-create: concurrent first messages all resolve to the row that won the insert
+            dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+            db.execute(
+                dialect.insert(SenderThread)
+                .values(sender=phone_number, thread_id=uuid.uuid4())
+                .on_conflict_do_nothing(index_elements=["sender"])
+            )
+            thread_id = db.execute(
+                select(SenderThread.thread_id).where(SenderThread.sender == phone_number)
+            ).scalar_one()
+            db.commit()
     except SQLAlchemyError as e:
+        db.rollback()
         logger.error(f"An error occurred while retrieving the conversation: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
+    thread_cache.set(phone_number, thread_id)
+    return thread_id
+
+def resolve_thread_id(phone_number: str) -> uuid.UUID:
+    # for callers outside a job, which have no session of their own
+    with SessionLocal() as db:
+        return get_or_create_thread_id(db, phone_number)
 
 def build_config(phone_number: str, thread_id: uuid.UUID) -> dict:
     try:
@@ -85,7 +190,8 @@ def build_config(phone_number: str, thread_id: uuid.UUID) -> dict:
             "configurable": {
                 "user_id": config.phone_number,
                 "thread_id": str(config.thread_id),  # Convert UUID back to string
-            }
+            },
+            "callbacks": [metrics_callback, usage_callback],
         }
     except ValueError as e:
         # Handle validation errors
@@ -93,7 +199,7 @@ def build_config(phone_number: str, thread_id: uuid.UUID) -> dict:
 
 def get_agent_message(query:str, phone_number:str, thread_id:uuid.UUID) -> str:
     config = build_config(phone_number, thread_id)
-    state = agent_graph.invoke({"messages": query}, config) # query in bare string
+    state = get_agent_graph().invoke({"messages": query}, config) # query in bare string
     try:
         agent_message = state["messages"][-1].content
         return agent_message
@@ -105,74 +211,273 @@ def get_multi_agent_message(query:str , phone_number:str, thread_id:uuid.UUID) -
     Receive the message from the user and invoke our graph to get a response
     """
     config = build_config(phone_number, thread_id)
-    state = multi_agent_graph.invoke({"messages": [query]}, config) 
+    graph = get_multi_agent_graph()
+    # recorded turns always run the graph, a cassette turn without its LLM calls cannot be replayed
+    use_cache = RESPONSE_CACHE_ENABLED and current_turn() is None and response_cache.is_faq(query)
+    # the checkpoint is only read for questions that could be answered from the cache
+    values = graph.get_state(config).values if use_cache else {}
+    cacheable = use_cache and response_cache.is_cacheable(query, values)
+    if cacheable:
+        prompt_version = prompt_registry.fingerprint()
+        cached = response_cache.lookup(query, prompt_version)
+        if cached is not None:
+            logger.info(f"Answered {phone_number} from the response cache")
+            record_cached_turn(graph, config, query, cached)
+            admission.record_turn(phone_number, "NewJob", cached)
+            return cached
+    else:
+        response_cache.skipped += 1
+    state = graph.invoke({"messages": [query]}, config)
     agent_message = state["messages"][-1].content
+    admission.record_turn(phone_number, state["messages"][-1].name, agent_message)
+    if cacheable and response_cache.is_stateless(values):
+        response_cache.store(query, agent_message, prompt_version)
     return agent_message # return the response from the agent
 
-def save_conversation(db: Session, query:str, phone_number:str, thread_id:uuid.UUID, response:str) -> None:
-    new_conversation = Conversation(
-        sender=phone_number, 
-        message=query, 
-        response=response,
-        thread_id=thread_id)
-    try:
-        db.add(new_conversation)
-        db.commit()
-        logger.info(f"Conversation #{new_conversation.id} stored in database")
-    except SQLAlchemyError as e:
-        db.rollback()
-        logger.error(f"An error occurred while saving the conversation: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+def save_conversation(query:str, phone_number:str, thread_id:uuid.UUID, response:str, channel: str = None, usage: dict = None) -> None:
+    # write-behind: the row is stored in the next batch, off the reply path
+    usage = usage or {}
+    conversation_writer.add({
+        "created_at": datetime.now(timezone.utc),
+        "channel": channel,
+        "sender": phone_number,
+        "message": query,
+        "response": response,
+        "thread_id": thread_id,
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "cost_usd": usage.get("cost_usd"),
+    })
 
-def get_response(db: Session, query: str, phone_number: str) -> str:
+def get_response(db: Session, query: str, phone_number: str, channel: str = None) -> str:
     thread_id = get_or_create_thread_id(db, phone_number)
-    response = get_multi_agent_message( # to invoke legacy use: get_agent_message
-        query=query,
-        phone_number=phone_number,
-        thread_id=thread_id)
+    budget = usage_tracker.budget(str(thread_id))
+    if budget == HANDOFF:
+        # the thread used up its token budget, a person takes it from here
+        logger.warning(f"Thread {thread_id} of {phone_number} is over its token budget, handing off")
+        response = USAGE_HANDOFF_MESSAGE
+    else:
+        with downgraded(budget == DOWNGRADE):
+            response = get_multi_agent_message( # to invoke legacy use: get_agent_message
+                query=query,
+                phone_number=phone_number,
+                thread_id=thread_id)
     save_conversation(
-        db=db,
         query=query,
         phone_number=phone_number,
         thread_id=thread_id,
-        response=response)
+        response=response,
+        channel=channel,
+        usage=usage_tracker.end_turn(str(thread_id)))
     return response
 
+def graph_state(db: Session, phone_number: str) -> dict:
+    thread_id = get_or_create_thread_id(db, phone_number)
+    return get_multi_agent_graph().get_state(build_config(phone_number, thread_id)).values or {}
+
+def summarize_after_reply(db: Session, phone_number: str) -> None:
+    # the reply is out, fold old turns into the running summary
+    try:
+        thread_id = get_or_create_thread_id(db, phone_number)
+        summarize_thread(get_multi_agent_graph(), build_config(phone_number, thread_id))
+        # the summary call is not part of any turn, its usage is stored on its own
+        usage_tracker.end_turn(str(thread_id))
+    except Exception as e:
+        logger.error(f"Error summarizing history for {phone_number}: {e}")
+
+def process_message(query: str, phone_number: str, message_type: str) -> None:
+    """
+    Background job: run the agents for one inbound message and send the reply
+    """
+    db = SessionLocal()
+    start = time.perf_counter()
+    try:
+        # recorded senders get the whole job written to their cassette, see src/cassette.py
+        with cassettes.turn(phone_number, message_type, query, snapshot=lambda: graph_state(db, phone_number)):
+            try:
+                langchain_response = get_response(db, query, phone_number, message_type)
+                outbound.send(message_type, phone_number, langchain_response)
+                message_latency.observe(time.perf_counter() - start, message_type)
+            except Exception as e:
+                logger.error(f"Error processing {message_type} message from {phone_number}: {e}")
+                raise
+    finally:
+        db.close()
+
+def summarize_in_background(phone_number: str) -> None:
+    """
+    Low priority job queued by the mailbox after a reply, so the summary call
+    never holds up the sender's next message.
+    """
+    db = SessionLocal()
+    try:
+        # recorded only when it called the LLM, replays run it as a turn of its own
+        with cassettes.turn(phone_number, SUMMARY_CHANNEL, "", snapshot=lambda: graph_state(db, phone_number), keep_empty=False):
+            summarize_after_reply(db, phone_number)
+    finally:
+        db.close()
+
+def finish_messages(message_sids: list[str], ok: bool) -> None:
+    # the Postgres store does blocking I/O, keep it off the event loop
+    asyncio.get_running_loop().run_in_executor(None, idempotency.finish, message_sids, ok)
+
+mailbox = SenderMailbox(
+    agent_pool,
+    process_message,
+    on_complete=finish_messages,
+    background=summarize_in_background,
+    background_priority=PRIORITY_BACKGROUND,
+)
+# load is the number of senders with a graph run queued or running
+admission = AdmissionController(load=agent_pool.load)
+
+register_stats("agent_pool", agent_pool.stats)
+register_stats("mailbox", mailbox.stats)
+register_stats("checkpointer", checkpointer_stats)
+register_stats("thread_cache", thread_cache.stats)
+register_stats("availability_cache", availability_cache.stats)
+register_stats("webhooks", webhooks.stats)
+register_stats("outbound", outbound.stats)
+register_stats("conversation_writer", conversation_writer.stats)
+register_stats("idempotency", idempotency.stats)
+register_stats("admission", admission.stats)
+register_stats("router", router.stats)
+register_stats("response_cache", response_cache.stats)
+register_stats("llm", llm_stats)
+register_stats("usage", usage_tracker.stats)
+register_stats("usage_writer", usage_writer.stats)
+register_stats("cassettes", cassettes.stats)
+
 @app.post("/message")
-async def reply(request: Request, Body: str = Form(), db: Session = Depends(get_db)):
+async def reply(request: Request, Body: str = Form()):
     form_data = await request.form()
-    from_number = form_data['From']
+    from_number = form_data.get('From')
+    if not from_number:
+        raise HTTPException(status_code=400, detail="Missing From field")
     
     # Determine if the message is from WhatsApp or SMS
     if from_number.startswith("whatsapp:"):
-        whatsapp_number = from_number.split("whatsapp:")[-1]
+        phone_number = from_number.split("whatsapp:")[-1]
         message_type = "whatsapp"
     else:
-        sms_number = from_number
+        phone_number = from_number
         message_type = "sms"
     
     logger.info(f"Received message from {message_type} number {from_number}")
-    
-    try:
-        if message_type == "whatsapp":
-            langchain_response = get_response(db, Body, whatsapp_number)
-            send_whatsapp(whatsapp_number, langchain_response)
-        else:
-            langchain_response = get_response(db, Body, sms_number)
-            send_sms(sms_number, langchain_response)
-        
-        return {"status": "success"}
-    except Exception as e:
-        if message_type == "whatsapp":
-            logger.error(f"Error processing whatsapp message from {whatsapp_number}: {e}")
-        else:
-            logger.error(f"Error processing sms message from {sms_number}: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+
+    # Twilio redelivers on timeouts and errors, a MessageSid we already took is only acknowledged
+    message_sid = form_data.get("MessageSid")
+    state = await run_in_threadpool(idempotency.claim, message_sid)
+    if state is not None:
+        logger.info(f"Duplicate delivery of {message_sid} from {phone_number} ({state}), skipping")
+        return {"status": "duplicate", "state": state}
+
+    decision = admission.admit(phone_number, joining=phone_number in mailbox)
+    if decision != ADMITTED:
+        # overloaded or over the sender's rate: a canned reply instead of the agents
+        logger.info(f"Not running agents for {phone_number}: {decision}")
+        notified = admission.should_notify(phone_number)
+        if notified:
+            outbound.send(message_type, phone_number, ADMISSION_BUSY_MESSAGE)
+        thread_id = await run_in_threadpool(resolve_thread_id, phone_number)
+        save_conversation(Body, phone_number, thread_id, ADMISSION_BUSY_MESSAGE if notified else None, message_type)
+        if message_sid:
+            # the agents never saw it, release the claim so a redelivery is processed
+            await run_in_threadpool(idempotency.finish, [message_sid], False)
+        return {"status": decision}
+
+    # ack Twilio right away, the agents run on the worker pool
+    if agent_pool.full():
+        logger.error(f"Rejected {message_type} message from {phone_number}: agent queue is full")
+        if message_sid:
+            await run_in_threadpool(idempotency.finish, [message_sid], False)
+        raise HTTPException(status_code=503, detail="Service busy")
+    mailbox.put(phone_number, message_type, Body, message_id=message_sid, priority=admission.priority(phone_number))
+    return {"status": "queued"}
 
 
 @app.get("/health")
 async def health_check():
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "agent_pool": agent_pool.stats(),
+        "mailbox": mailbox.stats(),
+        "checkpointers": checkpointer_stats(),
+        "thread_cache": thread_cache.stats(),
+        "availability_cache": availability_cache.stats(),
+        "webhooks": webhooks.stats(),
+        "outbound": outbound.stats(),
+        "conversation_writer": conversation_writer.stats(),
+        "idempotency": idempotency.stats(),
+        "admission": admission.stats(),
+        "router": router.stats(),
+        "response_cache": response_cache.stats(),
+        "usage": usage_tracker.stats(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/history/{thread_id}")
+async def history(thread_id: str):
+    stats = history_stats.get(thread_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No history stats for this thread")
+    return {"thread_id": thread_id, **stats}
+
+def require_export_token(authorization: Optional[str] = Header(None)) -> None:
+    if not EXPORT_API_TOKEN:
+        raise HTTPException(status_code=403, detail="Conversation API is disabled")
+    if authorization != f"Bearer {EXPORT_API_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+def conversation_filter(
+    sender: Optional[str] = None,
+    channel: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> ConversationFilter:
+    return ConversationFilter(sender=sender, channel=channel, since=since, until=until)
+
+def conversation_page(db: Session, filters: ConversationFilter, limit: int, cursor: Optional[str]) -> dict:
+    try:
+        return list_conversations(db, filters, limit=limit, cursor=cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/conversations", dependencies=[Depends(require_export_token)])
+def conversations(
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    filters: ConversationFilter = Depends(conversation_filter),
+    db: Session = Depends(get_db),
+):
+    return conversation_page(db, filters, limit, cursor)
+
+# declared before /conversations/{thread_id} so "export" is not taken for a thread id
+@app.get("/conversations/export", dependencies=[Depends(require_export_token)])
+def export_conversations(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    thread_id: Optional[uuid.UUID] = None,
+    filters: ConversationFilter = Depends(conversation_filter),
+):
+    filters.thread_id = thread_id
+    if format == "csv":
+        return StreamingResponse(export_csv(engine, filters), media_type="text/csv",
+                                 headers={"Content-Disposition": "attachment; filename=conversations.csv"})
+    return StreamingResponse(export_ndjson(engine, filters), media_type="application/x-ndjson")
+
+@app.get("/conversations/{thread_id}", dependencies=[Depends(require_export_token)])
+def thread_conversations(
+    thread_id: uuid.UUID,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    filters: ConversationFilter = Depends(conversation_filter),
+    db: Session = Depends(get_db),
+):
+    filters.thread_id = thread_id
+    return conversation_page(db, filters, limit, cursor)
 
 if __name__ == "__main__":
     import uvicorn
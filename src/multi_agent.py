@@ -1,17 +1,30 @@
 import functools
 import operator
+import threading
 from datetime import datetime
-from langchain import hub
-from langchain.agents import AgentExecutor, create_openai_tools_agent
-from langchain_openai import ChatOpenAI
+from decouple import config
+from langchain_core.language_models import BaseChatModel
 from langchain_core.output_parsers.openai_functions import JsonOutputFunctionsParser
-from langchain_core.messages import ToolMessage, HumanMessage, BaseMessage
-from langchain_core.runnables import RunnableLambda
-from langgraph.checkpoint.sqlite import SqliteSaver
+from langchain_core.messages import AIMessage, ToolMessage, HumanMessage, BaseMessage
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
 from langgraph.prebuilt import ToolNode
 from langgraph.graph import END, StateGraph, START
 from typing import Annotated, Sequence, TypedDict
-from src.tools.scheduling import check_calendar, book_appointment, create_brief
+from src.checkpoint import get_checkpointer
+from src.history import compact_tool_results, report_tool_tokens, trim_state
+from src.llm import get_chat_model
+from src.prompts import prompt_registry
+from src.routing import router, SUPERVISOR
+from src.tools.scheduling import check_calendar, get_book_appointment_tool, create_brief
+from utils.utils import logger
+
+# independent tool calls of one worker step run concurrently, up to this many at a time
+WORKER_TOOL_CONCURRENCY = config("WORKER_TOOL_CONCURRENCY", default=4, cast=int)
+WORKER_MAX_TOOL_ROUNDS = config("WORKER_MAX_TOOL_ROUNDS", default=8, cast=int)
+WORKER_GAVE_UP_REPLY = config(
+    "WORKER_GAVE_UP_REPLY",
+    default="Sorry, I could not finish that just now. Could you tell me again what you need?",
+)
 
 
 def handle_tool_error(state) -> dict:
@@ -28,30 +41,63 @@ def handle_tool_error(state) -> dict:
     }
 
 
-def create_tool_node_with_fallback(tools:list) -> dict:
-    return ToolNode(tools).with_fallbacks(
-        [RunnableLambda(handle_tool_error)], exception_key="error"
-    )
+def create_agent(llm: BaseChatModel, tools: list, system_prompt: str) -> Runnable:
+    prompt = prompt_registry.get(system_prompt)
+    return prompt | llm.bind_tools(tools)
+
+
+def _pending_tool_calls(scratchpad: list) -> bool:
+    return bool(scratchpad) and isinstance(scratchpad[-1], AIMessage) and bool(scratchpad[-1].tool_calls)
 
 
-# pack the tools
-scheduling_tools = [check_calendar, book_appointment, create_brief]
+def agent_node(state, config: RunnableConfig, agent, name):
+    """
+    One step of a worker's tool loop. Tool calls and their results go to the
+    turn's scratchpad, the final answer goes to the conversation.
+    """
+    scratchpad = state.get("scratchpad") or []
+    rounds = sum(1 for m in scratchpad if isinstance(m, AIMessage))
+    if rounds >= WORKER_MAX_TOOL_ROUNDS:
+        logger.warning(f"{name} stopped after {rounds} tool rounds")
+        return {"messages": [HumanMessage(content=WORKER_GAVE_UP_REPLY, name=name)], "scratchpad": []}
+    # the date is injected per request instead of being frozen into the prompt
+    result = agent.invoke({
+        **trim_state(state, config),
+        "agent_scratchpad": compact_tool_results(scratchpad),
+        "time": datetime.now().strftime("%Y-%m-%d"),
+    })
+    if result.tool_calls:
+        return {"scratchpad": scratchpad + [result]}
+    return {"messages": [HumanMessage(content=result.content, name=name)], "scratchpad": []}
 
 
-# define helper that facilitates the creation of the agent
-def create_agent(llm:ChatOpenAI, tools: list, system_prompt:str) -> AgentExecutor:
-    prompt = hub.pull(system_prompt)
-    if system_prompt == "sweep_scheduling":
-        prompt = hub.pull(system_prompt).partial(time=datetime.now().strftime("%Y-%m-%d"))
+def tool_node(state, config: RunnableConfig, tools: ToolNode):
+    """Run the tool calls of the last worker step concurrently, at most WORKER_TOOL_CONCURRENCY at a time."""
+    scratchpad = state.get("scratchpad") or []
+    try:
+        results = tools.invoke(scratchpad, {**config, "max_concurrency": WORKER_TOOL_CONCURRENCY})
+    except Exception as e:
+        results = handle_tool_error({"error": e, "messages": scratchpad})["messages"]
+    report_tool_tokens(results)
+    return {"scratchpad": scratchpad + results}
 
-    agent = create_openai_tools_agent(tools=tools, llm=llm, prompt=prompt)
-    executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
-    return executor
 
+def route_worker(state) -> str:
+    return "tools" if _pending_tool_calls(state.get("scratchpad") or []) else END
 
-def agent_node(state, agent, name):
-    result = agent.invoke(state)
-    return {"messages": [HumanMessage(content=result["output"], name=name)]}
+
+def start_turn(state) -> dict:
+    # a turn that died half way through its tool loop must not leak into the next one
+    return {**router(state), "scratchpad": []}
+
+
+def add_worker(workflow: StateGraph, name: str, agent: Runnable, tools: list) -> None:
+    """Add a worker as a native subflow: its LLM node and a tool node that loops back to it."""
+    tools_name = f"{name}_tools"
+    workflow.add_node(name, functools.partial(agent_node, agent=agent, name=name))
+    workflow.add_node(tools_name, functools.partial(tool_node, tools=ToolNode(tools)))
+    workflow.add_conditional_edges(name, route_worker, {"tools": tools_name, END: END})
+    workflow.add_edge(tools_name, name)
 
 
 members = ["NewJob", "Scheduler"]
@@ -75,16 +121,6 @@ function_def = {
     },
 }
 
-prompt = hub.pull("sweep_agent_routing").partial(options=str(options))
-
-llm = ChatOpenAI(model="gpt-4o-mini")
-
-supervisor_chain = (
-    prompt
-    | llm.bind_functions(functions=[function_def], function_call="route")
-    | JsonOutputFunctionsParser()
-)
-
 # The agent state is the input to each node in the graph
 class AgentState(TypedDict):
     # The annotation tells the graph that new messages will always
@@ -92,36 +128,76 @@ class AgentState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], operator.add]
     # The 'next' field indicates where to route to next
     next: str
+    # running summary of the turns that fell out of the history window
+    summary: str
+    summarized: int
+    # tool calls and results of the worker answering the current turn
+    scratchpad: list[BaseMessage]
+
+def build_multi_agent_graph():
+    prompt = prompt_registry.get("sweep_agent_routing").partial(options=str(options))
+
+    llm = get_chat_model("gpt-4o-mini")
+
+    supervisor_chain = (
+        prompt
+        | llm.bind_functions(functions=[function_def], function_call="route")
+        | JsonOutputFunctionsParser()
+    )
+
+    # pack the tools
+    scheduling_tools = [check_calendar, get_book_appointment_tool(), create_brief]
+
+    # 4. define your agents
+
+    # AGENT 1: the scheduling agent
+    sllm = get_chat_model("gpt-4o")
+    scheduling_agent = create_agent(sllm, scheduling_tools, "sweep_scheduling")
+
+    # AGENT 2: the NewJob agent
+    Nllm = get_chat_model("gpt-4o")
+    NewJob_agent = create_agent(Nllm, [check_calendar], "sweep_briefing")
+
+    # 6. define graph workflow
+    workflow = StateGraph(AgentState)
+    # workers loop over their own tool node and end the turn once they answer
+    add_worker(workflow, "Scheduler", scheduling_agent, scheduling_tools)
+    add_worker(workflow, "NewJob", NewJob_agent, [check_calendar])
+    workflow.add_node("supervisor", RunnableLambda(trim_state) | supervisor_chain)
+    # sticky and keyword routes skip the supervisor LLM call, the rest fall through to it
+    workflow.add_node("router", start_turn)
+
+    # The supervisor populates the "next" field in the graph state
+    # which routes to a node or finishes
+    conditional_map = {k: k for k in members}
+    workflow.add_conditional_edges("supervisor", lambda x: x["next"], conditional_map)
+    workflow.add_conditional_edges("router", lambda x: x["next"], {**conditional_map, SUPERVISOR: "supervisor"})
+    # Finally, add entrypoint
+    workflow.add_edge(START, "router")
+
+    # this is a complete memory for the entire graph.
+    memory = get_checkpointer("multi_agent")
+
+    return workflow.compile(checkpointer=memory)
+
+
+_multi_agent_graph = None
+_lock = threading.Lock()
+
+
+def get_multi_agent_graph():
+    """Build the graph on first use, prompts come from the local prompt cache"""
+    global _multi_agent_graph
+    with _lock:
+        if _multi_agent_graph is None:
+            _multi_agent_graph = build_multi_agent_graph()
+        return _multi_agent_graph
+
+
+def reset_multi_agent_graph(prompt_name: str = None) -> None:
+    global _multi_agent_graph
+    with _lock:
+        _multi_agent_graph = None
+
 
-# 4. define your agents
-
-# AGENT 1: the scheduling agent
-sllm = ChatOpenAI(model="gpt-4o")
-scheduling_agent = create_agent(sllm, scheduling_tools, "sweep_scheduling")
-scheduling_node = functools.partial(agent_node, agent=scheduling_agent, name="Scheduler")
-
-# AGENT 2: the NewJob agent
-Nllm = ChatOpenAI(model="gpt-4o")
-NewJob_agent = create_agent(Nllm, [check_calendar], "sweep_briefing")
-NewJob_node = functools.partial(agent_node, agent=NewJob_agent, name="NewJob")
-
-# 6. define graph workflow
-workflow = StateGraph(AgentState)
-workflow.add_node("Scheduler", scheduling_node)
-workflow.add_node("NewJob", NewJob_node)
-workflow.add_node("supervisor", supervisor_chain)
-
-for member in members:
-    # We want our workers to ALWAYS "report back" to the supervisor when done
-    workflow.add_edge(member, END)
-# The supervisor populates the "next" field in the graph state
-# which routes to a node or finishes
-conditional_map = {k: k for k in members}
-workflow.add_conditional_edges("supervisor", lambda x: x["next"], conditional_map)
-# Finally, add entrypoint
-workflow.add_edge(START, "supervisor")
-
-# this is a complete memory for the entire graph.
-memory = SqliteSaver.from_conn_string(":memory:")
-
-multi_agent_graph = workflow.compile(checkpointer=memory)
+prompt_registry.on_change(reset_multi_agent_graph)
@@ -0,0 +1,224 @@
+import asyncio
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+import httpx
+from decouple import config
+from src.cassette import current_turn
+from src.telemetry import timed, trace_id_var
+from utils.ratelimit import TokenBucket
+from utils.utils import logger
+
+TWILIO_ACCOUNT_SID = config("TWILIO_ACCOUNT_SID")
+TWILIO_AUTH_TOKEN = config("TWILIO_AUTH_TOKEN")
+TWILIO_NUMBER = config("TWILIO_NUMBER")
+TWILIO_API_BASE = config("TWILIO_API_BASE", default="https://api.twilio.com")
+
+OUTBOUND_WORKERS = config("OUTBOUND_WORKERS", default=8, cast=int)
+OUTBOUND_QUEUE_SIZE = config("OUTBOUND_QUEUE_SIZE", default=5000, cast=int)
+OUTBOUND_MAX_RETRIES = config("OUTBOUND_MAX_RETRIES", default=4, cast=int)
+OUTBOUND_TIMEOUT = config("OUTBOUND_TIMEOUT", default=10.0, cast=float)
+# messages per second, account wide and per Twilio sender number
+OUTBOUND_ACCOUNT_RATE = config("OUTBOUND_ACCOUNT_RATE", default=50.0, cast=float)
+OUTBOUND_SENDER_RATE = config("OUTBOUND_SENDER_RATE", default=10.0, cast=float)
+# Twilio rejects bodies over 1600 characters on both channels
+MESSAGE_CHUNK_SIZE = config("MESSAGE_CHUNK_SIZE", default=1600, cast=int)
+
+# the Messages POST is not idempotent: only failures where Twilio surely did not take the
+# message are retried, a 5xx or a read timeout may already have been delivered
+RETRYABLE_STATUSES = {429, 503}
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+def split_message(text: str, limit: int = MESSAGE_CHUNK_SIZE) -> list[str]:
+    """Split a reply into ordered chunks, preferring paragraph, then sentence, then word boundaries."""
+    text = text.strip()
+    chunks = []
+    while len(text) > limit:
+        window = text[:limit]
+        cut = window.rfind("\n\n")
+        if cut < limit // 2:
+            cut = max(window.rfind(". "), window.rfind("! "), window.rfind("? "), window.rfind("\n")) + 1
+        if cut < limit // 2:
+            cut = window.rfind(" ")
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut].strip())
+        text = text[cut:].strip()
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+@dataclass
+class OutboundMessage:
+    channel: str
+    to: str
+    chunks: list[str]
+    enqueued_at: float = field(default_factory=time.monotonic)
+    trace_id: str = field(default_factory=trace_id_var.get)
+
+    @property
+    def from_(self) -> str:
+        return f"whatsapp:{TWILIO_NUMBER}" if self.channel == "whatsapp" else TWILIO_NUMBER
+
+    @property
+    def to_address(self) -> str:
+        return f"whatsapp:{self.to}" if self.channel == "whatsapp" else self.to
+
+
+class OutboundDispatcher:
+    """
+    Async send queue to the Twilio Messages API.
+
+    Replies are split into chunks and queued. A small set of workers sends them
+    over one pooled HTTP client, honours account-wide and per-sender-number rate
+    limits, retries retryable failures with backoff, and keeps the chunks of
+    every recipient in order.
+    """
+
+    def __init__(self, workers: int = OUTBOUND_WORKERS, queue_size: int = OUTBOUND_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.account_bucket = TokenBucket(OUTBOUND_ACCOUNT_RATE)
+        self.sender_buckets: dict[str, TokenBucket] = {}
+        # recipient -> [lock, messages holding or waiting on it]
+        self._recipient_locks: dict[str, list] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._tasks: list[asyncio.Task] = []
+        self.latencies = deque(maxlen=1000)
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._client = httpx.AsyncClient(
+            base_url=TWILIO_API_BASE,
+            auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN),
+            timeout=OUTBOUND_TIMEOUT,
+            limits=httpx.Limits(max_connections=self.workers, max_keepalive_connections=self.workers),
+        )
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def send(self, channel: str, to: str, text: str) -> None:
+        """Queue a reply, safe to call from the event loop or from worker threads."""
+        if self._loop is None:
+            raise RuntimeError("Outbound dispatcher is not started, call start() on the app's event loop first")
+        message = OutboundMessage(channel=channel, to=to, chunks=split_message(text))
+        turn = current_turn()
+        if turn is not None:
+            turn.outbound.extend(message.chunks)
+        if not message.chunks:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._enqueue(message)
+        else:
+            self._loop.call_soon_threadsafe(self._enqueue, message)
+
+    def _enqueue(self, message: OutboundMessage) -> None:
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.failed += 1
+            logger.error(f"Outbound queue full, dropped reply to {message.to}")
+
+    async def _worker(self) -> None:
+        while True:
+            message = await self._queue.get()
+            trace_id_var.set(message.trace_id)
+            # the entry lives as long as a message holds or waits on it, a waiter woken by
+            # release() has not re-acquired the lock yet, so locked() alone cannot tell
+            entry = self._recipient_locks.setdefault(message.to, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    for chunk in message.chunks:
+                        if not await self._send_chunk(message, chunk):
+                            break
+                    else:
+                        self.latencies.append(time.monotonic() - message.enqueued_at)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error sending message to {message.to}: {e}")
+            finally:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._recipient_locks.pop(message.to, None)
+                self._queue.task_done()
+
+    async def _send_chunk(self, message: OutboundMessage, body: str) -> bool:
+        bucket = self.sender_buckets.setdefault(message.from_, TokenBucket(OUTBOUND_SENDER_RATE))
+        for attempt in range(OUTBOUND_MAX_RETRIES + 1):
+            await self.account_bucket.acquire()
+            await bucket.acquire()
+            retry_after = None
+            try:
+                with timed("outbound", message.channel):
+                    response = await self._client.post(
+                        f"/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json",
+                        data={"From": message.from_, "To": message.to_address, "Body": body},
+                    )
+                if response.status_code < 300:
+                    self.sent += 1
+                    logger.info(f"Message sent to {message.to}: {body}")
+                    return True
+                if response.status_code not in RETRYABLE_STATUSES:
+                    self.failed += 1
+                    logger.error(f"Error sending message to {message.to}: {response.status_code} {response.text}")
+                    return False
+                error = f"{response.status_code}"
+                retry_after = response.headers.get("Retry-After")
+            except RETRYABLE_ERRORS as e:
+                error = repr(e)
+            except httpx.HTTPError as e:
+                self.failed += 1
+                logger.error(f"Error sending message to {message.to}, not retried as it may have been delivered: {e!r}")
+                return False
+            if attempt < OUTBOUND_MAX_RETRIES:
+                self.retries += 1
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else random.uniform(0, min(8.0, 0.5 * 2 ** attempt))
+                logger.info(f"Retrying message to {message.to} in {delay:.2f}s: {error}")
+                await asyncio.sleep(delay)
+        self.failed += 1
+        logger.error(f"Giving up on message to {message.to} after {OUTBOUND_MAX_RETRIES} retries: {error}")
+        return False
+
+    async def drain(self, timeout: float = 30.0) -> None:
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Outbound drain timed out with {self._queue.qsize()} replies left")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._client.aclose()
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+
+        def pct(p: float) -> float:
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3) if latencies else 0.0
+
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "delivery_latency_p50": pct(0.5),
+            "delivery_latency_p95": pct(0.95),
+        }
+
+
+outbound = OutboundDispatcher()
@@ -0,0 +1,140 @@
+"""Version-pinned LangChain Hub prompts served from a local on-disk cache"""
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+from decouple import config
+from langchain import hub
+from langchain_core.load import dumpd, load
+from langchain_core.prompts import BasePromptTemplate
+from utils.utils import logger
+
+PROMPT_CACHE_DIR = config("PROMPT_CACHE_DIR", default=".prompt_cache")
+PROMPT_REFRESH_SECONDS = config("PROMPT_REFRESH_SECONDS", default=3600.0, cast=float)
+
+# hub references used by the app, pin a version with "<name>:<commit hash>"
+PROMPT_PINS = {
+    "customer_support_chatbot": config("PROMPT_CUSTOMER_SUPPORT_CHATBOT", default="customer_support_chatbot"),
+    "sweep_agent_routing": config("PROMPT_SWEEP_AGENT_ROUTING", default="sweep_agent_routing"),
+    "sweep_scheduling": config("PROMPT_SWEEP_SCHEDULING", default="sweep_scheduling"),
+    "sweep_briefing": config("PROMPT_SWEEP_BRIEFING", default="sweep_briefing"),
+    "book_appointment_tool": config("PROMPT_BOOK_APPOINTMENT_TOOL", default="book_appointment_tool"),
+}
+
+
+class PromptRegistry:
+    """
+    Loads prompts from the on-disk cache first and only falls back to the hub
+    when a prompt (or its pinned version) has never been fetched, so startup
+    works offline once the cache is warm. A background thread refreshes the
+    cache and notifies listeners when a prompt actually changed.
+    """
+
+    def __init__(self, pins: dict[str, str] = PROMPT_PINS, cache_dir: str = PROMPT_CACHE_DIR):
+        self.pins = pins
+        self.cache_dir = Path(cache_dir)
+        self._prompts: dict[str, BasePromptTemplate] = {}
+        self._versions: dict[str, str] = {}
+        self._listeners: list[Callable[[str], None]] = []
+        self._lock = threading.Lock()
+        self._refresher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _path(self, name: str) -> Path:
+        return self.cache_dir / f"{name}.json"
+
+    def _read_disk(self, name: str) -> Optional[dict]:
+        path = self._path(name)
+        if not path.exists():
+            return None
+        try:
+            entry = json.loads(path.read_text())
+        except (OSError, ValueError) as e:
+            logger.error(f"Ignoring unreadable prompt cache {path}: {e}")
+            return None
+        # a changed pin invalidates the cached copy
+        return entry if entry.get("ref") == self.pins[name] else None
+
+    def _pull(self, name: str) -> dict:
+        return self._write(name, hub.pull(self.pins[name]))
+
+    def _write(self, name: str, prompt: BasePromptTemplate) -> dict:
+        ref = self.pins[name]
+        serialized = dumpd(prompt)
+        entry = {
+            "ref": ref,
+            "fetched_at": time.time(),
+            "version": hashlib.sha256(json.dumps(serialized, sort_keys=True).encode()).hexdigest()[:12],
+            "prompt": serialized,
+        }
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self._path(name).with_suffix(".tmp")
+        tmp.write_text(json.dumps(entry))
+        tmp.replace(self._path(name))
+        return entry
+
+    def _install(self, name: str, entry: dict) -> None:
+        self._prompts[name] = load(entry["prompt"])
+        self._versions[name] = entry["version"]
+
+    def get(self, name: str) -> BasePromptTemplate:
+        with self._lock:
+            if name not in self._prompts:
+                entry = self._read_disk(name)
+                if entry is None:
+                    logger.info(f"Prompt {self.pins[name]} not cached, pulling from the hub")
+                    entry = self._pull(name)
+                self._install(name, entry)
+            return self._prompts[name]
+
+    def seed(self, name: str, prompt: BasePromptTemplate) -> None:
+        """Put a prompt in the on-disk cache as if it had been pulled, for offline runs."""
+        with self._lock:
+            self._install(name, self._write(name, prompt))
+
+    def version(self, name: str) -> str:
+        self.get(name)
+        return self._versions[name]
+
+    def fingerprint(self) -> str:
+        """Combined version of every prompt loaded so far."""
+        return hashlib.sha256(
+            json.dumps(sorted(self._versions.items())).encode()
+        ).hexdigest()[:12]
+
+    def on_change(self, callback: Callable[[str], None]) -> None:
+        self._listeners.append(callback)
+
+    def refresh(self) -> None:
+        for name in list(self._prompts):
+            try:
+                entry = self._pull(name)
+            except Exception as e:
+                logger.error(f"Could not refresh prompt {name}, keeping cached copy: {e}")
+                continue
+            with self._lock:
+                changed = entry["version"] != self._versions.get(name)
+                self._install(name, entry)
+            if changed:
+                logger.info(f"Prompt {name} changed, now at version {entry['version']}")
+                for callback in self._listeners:
+                    callback(name)
+
+    def start_refresh(self, interval: float = PROMPT_REFRESH_SECONDS) -> None:
+        if self._refresher is not None or interval <= 0:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                self.refresh()
+
+        self._refresher = threading.Thread(target=run, name="prompt-refresh", daemon=True)
+        self._refresher.start()
+
+    def stop_refresh(self) -> None:
+        self._stop.set()
+
+
+prompt_registry = PromptRegistry()
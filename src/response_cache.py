@@ -0,0 +1,168 @@
+"""Semantic cache of agent answers to FAQ-style questions"""
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+from decouple import config
+from langchain_core.messages import AIMessage, HumanMessage
+from src.prompts import prompt_registry
+from src.routing import keyword_route, sticky_route, KEYWORDS
+from utils.utils import logger
+
+RESPONSE_CACHE_ENABLED = config("RESPONSE_CACHE_ENABLED", default=True, cast=bool)
+RESPONSE_CACHE_SIZE = config("RESPONSE_CACHE_SIZE", default=2000, cast=int)
+RESPONSE_CACHE_TTL = config("RESPONSE_CACHE_TTL", default=6 * 3600.0, cast=float)
+RESPONSE_CACHE_THRESHOLD = config("RESPONSE_CACHE_THRESHOLD", default=0.9, cast=float)
+
+EMBEDDING_DIM = 1024
+
+# questions whose answer does not depend on the customer or the calendar
+FAQ_TOPICS = re.compile(
+    r"\b(price|pricing|cost|how much|rates?|discounts?|promo\w*|coupon|insur\w*|licen[cs]\w*|bonded|"
+    r"certif\w*|complian\w*|guarantee\w*|warranty|refund|cancel\w* policy|areas?|cover|services?|"
+    r"do you (do|offer|provide)|what (is|are)|supplies|eco|pets?)\b",
+    re.I,
+)
+
+
+def normalize(text: str) -> str:
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _bucket(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=4).digest(), "little") % EMBEDDING_DIM
+
+
+def embed(text: str) -> np.ndarray:
+    """
+    Local hashing embedding: word unigrams, bigrams and character trigrams
+    hashed into a fixed-size vector. No model download, no network.
+    """
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    words = normalize(text).split()
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f" {word} "
+        features += [padded[i:i + 3] for i in range(len(padded) - 2)]
+    for feature in features:
+        vector[_bucket(feature)] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+@dataclass
+class _Entry:
+    vector: np.ndarray
+    response: str
+    expires_at: float
+    prompt_version: str
+
+
+class ResponseCache:
+    """
+    Size-bounded LRU of FAQ answers with per-entry TTL. A question hits on an
+    exact normalized match or when its embedding is close enough to a cached
+    one. Entries are tied to the prompt version that produced them.
+    """
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL, threshold: float = RESPONSE_CACHE_THRESHOLD):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    @staticmethod
+    def is_faq(query: str) -> bool:
+        """The checks on the question alone, cheap enough to run before the thread state is read."""
+        if KEYWORDS["Scheduler"].search(query):
+            return False
+        route = keyword_route({"messages": [HumanMessage(content=query)]})
+        return route is not None and route.worker == "NewJob" and bool(FAQ_TOPICS.search(query))
+
+    def is_cacheable(self, query: str, state: dict) -> bool:
+        """Only stateless FAQ questions, never anything that belongs to a booking flow."""
+        if not self.is_faq(query):
+            return False
+        # the sticky stage looks at the reply that preceded the latest user turn, so the
+        # state from before the turn is checked with the new question appended
+        messages = list((state or {}).get("messages") or []) + [HumanMessage(content=query)]
+        return sticky_route({"messages": messages}) is None
+
+    @staticmethod
+    def is_stateless(state: dict) -> bool:
+        """
+        True when the thread has no context the answer could draw on. Only such
+        answers are stored, a reply written for one customer's conversation
+        (their name, address, earlier turns) is never served to another.
+        """
+        state = state or {}
+        return not state.get("messages") and not state.get("summary")
+
+    def lookup(self, query: str, prompt_version: str) -> Optional[str]:
+        key = normalize(query)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._entries:
+                vector = embed(query)
+                keys = list(self._entries)
+                scores = np.stack([self._entries[k].vector for k in keys]) @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    key, entry = keys[best], self._entries[keys[best]]
+            if entry is not None and (entry.expires_at < now or entry.prompt_version != prompt_version):
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.response
+
+    def store(self, query: str, response: str, prompt_version: str, ttl: float = None) -> None:
+        key = normalize(query)
+        entry = _Entry(embed(query), response, time.monotonic() + (ttl or self.ttl), prompt_version)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self, *_) -> None:
+        with self._lock:
+            self._entries.clear()
+        logger.info("Response cache cleared")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+response_cache = ResponseCache()
+# entries carry the prompt version, clearing on change just frees them early
+prompt_registry.on_change(response_cache.clear)
+
+
+def record_cached_turn(graph, config: dict, query: str, response: str) -> None:
+    """Append the cached exchange to the thread so later turns still see it."""
+    graph.update_state(
+        config,
+        {"messages": [HumanMessage(content=query), AIMessage(content=response, name="NewJob")], "next": "NewJob"},
+        as_node="NewJob",
+    )
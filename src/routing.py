@@ -0,0 +1,127 @@
+"""Fast-path routing in front of the LLM supervisor"""
+import re
+import threading
+from dataclasses import dataclass
+from typing import Callable, Optional
+from decouple import config
+from langchain_core.messages import BaseMessage, HumanMessage, convert_to_messages
+from utils.utils import logger
+
+ROUTER_MIN_CONFIDENCE = config("ROUTER_MIN_CONFIDENCE", default=0.75, cast=float)
+SUPERVISOR = "supervisor"
+
+
+@dataclass
+class Route:
+    worker: str
+    confidence: float
+    source: str
+
+
+# a stage looks at the graph state and either proposes a route or passes
+RoutingStage = Callable[[dict], Optional[Route]]
+
+
+def _last_user_text(messages: list[BaseMessage]) -> str:
+    for m in reversed(messages):
+        if isinstance(m, HumanMessage) and not m.name:
+            return m.content if isinstance(m.content, str) else str(m.content)
+    return ""
+
+
+def _last_worker_message(messages: list[BaseMessage]) -> Optional[BaseMessage]:
+    # the latest user turn is at the end, the reply that preceded it sits just before it
+    for m in reversed(messages[:-1]):
+        if m.name:
+            return m
+        if isinstance(m, HumanMessage):
+            return None
+    return None
+
+
+BOOKED = re.compile(r"\b(successfully booked|booking (is )?confirmed|appointment (is )?confirmed)\b", re.I)
+
+
+def sticky_route(state: dict) -> Optional[Route]:
+    """Keep talking to the worker that asked the user a question last turn."""
+    messages = convert_to_messages(state.get("messages") or [])
+    previous = _last_worker_message(messages)
+    if previous is None or previous.name not in ("Scheduler", "NewJob"):
+        return None
+    content = previous.content if isinstance(previous.content, str) else str(previous.content)
+    if BOOKED.search(content):
+        # the flow is finished, the next message can be about anything
+        return None
+    if content.rstrip().endswith("?"):
+        return Route(previous.name, 0.9, "sticky")
+    return Route(previous.name, 0.6, "sticky")
+
+
+KEYWORDS = {
+    "Scheduler": re.compile(
+        r"\b(book(ing)?|schedul\w*|reschedul\w*|appointment|availab\w*|slot|calendar|tomorrow|today|"
+        r"next week|monday|tuesday|wednesday|thursday|friday|saturday|sunday|morning|afternoon|evening|"
+        r"\d{1,2}(:\d{2})?\s?(am|pm)|\d{4}-\d{2}-\d{2}|@)",
+        re.I,
+    ),
+    "NewJob": re.compile(
+        r"\b(price|pricing|cost|quote|estimate|how much|discount|service|clean\w*|paint\w*|repair\w*|"
+        r"plumb\w*|lawn|yard|garden\w*|moving|handyman|job|project|square feet|sq ?ft|rooms?)\b",
+        re.I,
+    ),
+}
+
+
+def keyword_route(state: dict) -> Optional[Route]:
+    text = _last_user_text(convert_to_messages(state.get("messages") or []))
+    if not text:
+        return None
+    scores = {worker: len(pattern.findall(text)) for worker, pattern in KEYWORDS.items()}
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    (best, best_score), (_, runner_up) = ranked[0], ranked[1]
+    if best_score == 0:
+        return None
+    confidence = 0.5 + 0.5 * (best_score - runner_up) / best_score
+    return Route(best, min(0.95, confidence), "keywords")
+
+
+class Router:
+    """
+    Runs the routing stages in order and returns the first route that is
+    confident enough. Anything else goes to the LLM supervisor.
+    """
+
+    def __init__(self, stages: list[RoutingStage], min_confidence: float = ROUTER_MIN_CONFIDENCE):
+        self.stages = stages
+        self.min_confidence = min_confidence
+        self.counts: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def route(self, state: dict) -> Route:
+        for stage in self.stages:
+            try:
+                route = stage(state)
+            except Exception as e:
+                logger.error(f"Routing stage {stage.__name__} failed: {e}")
+                continue
+            if route is not None and route.confidence >= self.min_confidence:
+                self._count(route.source)
+                return route
+        self._count(SUPERVISOR)
+        return Route(SUPERVISOR, 0.0, SUPERVISOR)
+
+    def _count(self, source: str) -> None:
+        with self._lock:
+            self.counts[source] = self.counts.get(source, 0) + 1
+
+    def __call__(self, state: dict) -> dict:
+        route = self.route(state)
+        return {"next": route.worker}
+
+    def stats(self) -> dict:
+        total = sum(self.counts.values())
+        fast = total - self.counts.get(SUPERVISOR, 0)
+        return {**self.counts, "total": total, "hit_rate": round(fast / total, 3) if total else 0.0}
+
+
+router = Router([sticky_route, keyword_route])
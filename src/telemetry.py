@@ -0,0 +1,226 @@
+"""Latency histograms, counters and trace IDs, exposed in the Prometheus text format"""
+import contextvars
+import logging
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+from uuid import UUID
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+trace_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("trace_id", default="-")
+
+
+def new_trace_id(trace_id: Optional[str] = None) -> str:
+    trace_id = trace_id or uuid.uuid4().hex[:16]
+    trace_id_var.set(trace_id)
+    return trace_id
+
+
+class TraceIdFilter(logging.Filter):
+    """Stamps every log record with the trace ID of the request being handled."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = trace_id_var.get()
+        return True
+
+
+def install_log_trace_ids() -> None:
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(TraceIdFilter())
+        handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:[%(trace_id)s] %(message)s"))
+
+
+def _escape(value) -> str:
+    # the text exposition format escapes backslash, double quote and line feed in label values
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labelnames = name, help, labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in self._values.items():
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help, labels, buckets
+        # per label set: bucket counts, sum, count
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        with self._lock:
+            entry = self._values.setdefault(labels, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self) -> dict[tuple, tuple[int, float, list[int]]]:
+        """label values -> (count, sum, cumulative bucket counts)"""
+        with self._lock:
+            return {labels: (count, total, list(counts)) for labels, (counts, total, count) in self._values.items()}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in self._values.items():
+                names = self.labelnames + ("le",)
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+stage_latency = Histogram("sweep_stage_seconds", "Latency of a pipeline stage", ("stage", "name"))
+stage_errors = Counter("sweep_stage_errors_total", "Failed pipeline stages", ("stage", "name"))
+llm_tokens = Counter("sweep_llm_tokens_total", "LLM tokens used", ("node", "model", "kind"))
+message_latency = Histogram("sweep_message_seconds", "Time to produce and queue the reply to an inbound message", ("channel",))
+tool_result_tokens = Histogram("sweep_tool_result_tokens", "Prompt tokens of a tool result", ("tool",), buckets=TOKEN_BUCKETS)
+
+_metrics = [stage_latency, stage_errors, llm_tokens, message_latency, tool_result_tokens]
+_collectors: dict[str, Callable[[], dict]] = {}
+
+
+def register_metric(metric) -> None:
+    """Render a metric defined outside this module on /metrics."""
+    _metrics.append(metric)
+
+
+@contextmanager
+def timed(stage: str, name: str):
+    """Time a block as `stage`/`name`, failures are counted and re-raised."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(stage, name)
+        raise
+    finally:
+        stage_latency.observe(time.perf_counter() - start, stage, name)
+
+
+def register_stats(prefix: str, stats: Callable[[], dict]) -> None:
+    """Expose the numeric values of a component's stats() as gauges."""
+    _collectors[prefix] = stats
+
+
+def _flatten(prefix: str, values) -> list[tuple[str, float]]:
+    if isinstance(values, list):
+        # lists of per-instance stats, keyed by their namespace when they have one
+        values = {v.get("namespace", i) if isinstance(v, dict) else i: v for i, v in enumerate(values)}
+    flat = []
+    for key, value in values.items():
+        name = re.sub(r"[^a-zA-Z0-9_]", "_", f"{prefix}_{key}")
+        if isinstance(value, (dict, list)):
+            flat += _flatten(name, value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat.append((name, value))
+    return flat
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    for prefix, stats in _collectors.items():
+        try:
+            values = stats()
+        except Exception as e:
+            logging.getLogger(__name__).error(f"Could not collect {prefix} stats: {e}")
+            continue
+        for name, value in _flatten(f"sweep_{prefix}", values):
+            lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Times graph nodes and tool calls and counts tokens, from the LangChain callbacks."""
+
+    def __init__(self):
+        self._started: dict[UUID, tuple[str, str, float]] = {}
+        self._llm_nodes: dict[UUID, tuple[str, str]] = {}
+
+    def _start(self, run_id: UUID, stage: str, name: str) -> None:
+        self._started[run_id] = (stage, name, time.perf_counter())
+
+    def _end(self, run_id: UUID, error: bool = False) -> None:
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        stage, name, start = started
+        stage_latency.observe(time.perf_counter() - start, stage, name)
+        if error:
+            stage_errors.inc(stage, name)
+
+    def on_chain_start(self, serialized: dict, inputs: Any, *, run_id: UUID, metadata: Optional[dict] = None, **kwargs) -> None:
+        node = (metadata or {}).get("langgraph_node")
+        # only the node runnable itself, not the chains nested inside it
+        if node is not None and kwargs.get("name") == node and not node.startswith("__"):
+            self._start(run_id, "node", node)
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs) -> None:
+        self._end(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs) -> None:
+        self._end(run_id, error=True)
+
+    def on_tool_start(self, serialized: dict, input_str: str, *, run_id: UUID, **kwargs) -> None:
+        self._start(run_id, "tool", kwargs.get("name") or serialized.get("name", "tool"))
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs) -> None:
+        self._end(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs) -> None:
+        self._end(run_id, error=True)
+
+    def on_chat_model_start(self, serialized: dict, messages: list, *, run_id: UUID, metadata: Optional[dict] = None, **kwargs) -> None:
+        metadata = metadata or {}
+        node = metadata.get("langgraph_node", "-")
+        model = metadata.get("ls_model_name", "-")
+        self._llm_nodes[run_id] = (node, model)
+        self._start(run_id, "llm", node)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs) -> None:
+        self._end(run_id)
+        node, model = self._llm_nodes.pop(run_id, ("-", "-"))
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if usage.get(kind):
+                llm_tokens.inc(node, model, kind.split("_")[0], amount=usage[kind])
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs) -> None:
+        self._end(run_id, error=True)
+        self._llm_nodes.pop(run_id, None)
+
+
+metrics_callback = MetricsCallbackHandler()
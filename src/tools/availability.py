@@ -0,0 +1,187 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import date, timedelta
+from typing import Awaitable, Callable, Dict, List, Tuple
+from decouple import config
+from utils.utils import logger
+
+AVAILABILITY_TTL_SECONDS = config("AVAILABILITY_TTL_SECONDS", default=120.0, cast=float)
+# longest range one lookup covers, the dates come from the LLM and are not trusted
+AVAILABILITY_MAX_RANGE_DAYS = config("AVAILABILITY_MAX_RANGE_DAYS", default=60, cast=int)
+AVAILABILITY_MAX_DAYS = config("AVAILABILITY_MAX_DAYS", default=2000, cast=int)
+
+# fetcher(start, end) -> ({"yyyy-mm-dd": [slot, ...]}, description)
+Fetcher = Callable[[date, date], Tuple[Dict[str, List[dict]], str]]
+AsyncFetcher = Callable[[date, date], Awaitable[Tuple[Dict[str, List[dict]], str]]]
+
+
+class AvailabilityError(Exception):
+    """Raised when the calendar webhook does not return availability."""
+
+
+def _days(start: date, end: date) -> List[date]:
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def _spans(days: List[date]) -> List[Tuple[date, date]]:
+    """Collapse sorted days into contiguous (start, end) spans."""
+    spans = []
+    for day in days:
+        if spans and day - spans[-1][1] == timedelta(days=1):
+            spans[-1] = (spans[-1][0], day)
+        else:
+            spans.append((day, day))
+    return spans
+
+
+class AvailabilityCache:
+    """
+    Shared per-day cache of calendar slots.
+
+    A range lookup is served from cached days and only the missing contiguous
+    spans are fetched. Days being fetched are registered as in-flight, so
+    concurrent overlapping lookups wait for the same request instead of issuing
+    their own. Invalidating a day also discards any fetch of it that is still
+    in flight, so a booking can never be followed by stale slots.
+
+    Ranges are capped at `max_range` days (see `clip`), and at most `maxsize`
+    days are kept.
+    Every day gets the same TTL, so insertion order is expiry order and expired
+    days are dropped from the front on every write.
+    """
+
+    def __init__(self, ttl: float = AVAILABILITY_TTL_SECONDS, max_range: int = AVAILABILITY_MAX_RANGE_DAYS, maxsize: int = AVAILABILITY_MAX_DAYS):
+        self.ttl = ttl
+        self.max_range = max_range
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._days: "OrderedDict[date, Tuple[float, List[dict]]]" = OrderedDict()
+        self._inflight: Dict[date, Future] = {}
+        # bumped by invalidations of days in flight, an entry lives only as long as the fetch
+        self._generation: Dict[date, int] = {}
+        self.description = ""
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+
+    def _cached(self, day: date):
+        item = self._days.get(day)
+        if item is None or item[0] < time.monotonic():
+            return None
+        return item[1]
+
+    def clip(self, start: date, end: date) -> date:
+        """Last day a lookup from `start` to `end` actually covers."""
+        return min(end, start + timedelta(days=self.max_range - 1))
+
+    def _claim(self, start: date, end: date):
+        """Split a range into cached days, days in flight elsewhere and spans this caller must fetch."""
+        result: Dict[str, List[dict]] = {}
+        waiting: Dict[date, Future] = {}
+        owned: List[Tuple[date, date, Future, Dict[date, int]]] = []
+        end = self.clip(start, end)
+        with self._lock:
+            missing = []
+            for day in _days(start, end):
+                slots = self._cached(day)
+                if slots is not None:
+                    self.hits += 1
+                    result[day.isoformat()] = slots
+                elif day in self._inflight:
+                    self.hits += 1
+                    waiting[day] = self._inflight[day]
+                else:
+                    self.misses += 1
+                    missing.append(day)
+            for span_start, span_end in _spans(missing):
+                future = Future()
+                generations = {}
+                for day in _days(span_start, span_end):
+                    self._inflight[day] = future
+                    generations[day] = self._generation.get(day, 0)
+                owned.append((span_start, span_end, future, generations))
+            self.requests += len(owned)
+        return result, waiting, owned
+
+    def _settle(self, future: Future, generations: Dict[date, int], fetched=None, error: BaseException = None) -> None:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(fetched[0])
+        with self._lock:
+            now = time.monotonic()
+            for day, generation in generations.items():
+                self._inflight.pop(day, None)
+                if error is None and self._generation.pop(day, 0) == generation:
+                    self._days[day] = (now + self.ttl, fetched[0].get(day.isoformat(), []))
+                    self._days.move_to_end(day)
+                else:
+                    self._generation.pop(day, None)
+            while self._days and (len(self._days) > self.maxsize or next(iter(self._days.values()))[0] < now):
+                self._days.popitem(last=False)
+            if error is None:
+                self.description = fetched[1] or self.description
+
+    def _collect(self, result: Dict[str, List[dict]], settled: Dict[date, Dict[str, List[dict]]]) -> Dict[str, List[dict]]:
+        for day, slots in settled.items():
+            result[day.isoformat()] = slots.get(day.isoformat(), [])
+        return {day: result[day] for day in sorted(result)}
+
+    def get_range(self, start: date, end: date, fetcher: Fetcher) -> Dict[str, List[dict]]:
+        result, waiting, owned = self._claim(start, end)
+        for span_start, span_end, future, generations in owned:
+            try:
+                self._settle(future, generations, fetched=fetcher(span_start, span_end))
+            except Exception as e:
+                self._settle(future, generations, error=e)
+        # every owned span is settled above before any error is raised, so waiters never hang
+        settled = {}
+        for _, _, future, generations in owned:
+            settled.update({day: future.result() for day in generations})
+        settled.update({day: future.result() for day, future in waiting.items()})
+        return self._collect(result, settled)
+
+    async def aget_range(self, start: date, end: date, fetcher: AsyncFetcher) -> Dict[str, List[dict]]:
+        result, waiting, owned = self._claim(start, end)
+        try:
+            fetched = await asyncio.gather(*(fetcher(s, e) for s, e, _, _ in owned), return_exceptions=True)
+        except asyncio.CancelledError:
+            # release the days this caller owned, or every later lookup of them waits forever
+            for _, _, future, generations in owned:
+                self._settle(future, generations, error=AvailabilityError("availability lookup was cancelled"))
+            raise
+        for (_, _, future, generations), item in zip(owned, fetched):
+            if isinstance(item, asyncio.CancelledError):
+                self._settle(future, generations, error=AvailabilityError("availability lookup was cancelled"))
+            elif isinstance(item, BaseException):
+                self._settle(future, generations, error=item)
+            else:
+                self._settle(future, generations, fetched=item)
+        settled = {}
+        for _, _, future, generations in owned:
+            settled.update({day: future.result() for day in generations})
+        for day, future in waiting.items():
+            settled[day] = await asyncio.wrap_future(future)
+        return self._collect(result, settled)
+
+    def invalidate(self, day: date) -> None:
+        with self._lock:
+            self._days.pop(day, None)
+            if day in self._inflight:
+                self._generation[day] = self._generation.get(day, 0) + 1
+        logger.info(f"Invalidated cached availability for {day.isoformat()}")
+
+    def stats(self) -> dict:
+        return {
+            "days": len(self._days),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "requests": self.requests,
+        }
+
+
+availability_cache = AvailabilityCache()
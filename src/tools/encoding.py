@@ -0,0 +1,84 @@
+"""Compact encodings of tool results, so calendar lookups cost fewer prompt tokens"""
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from decouple import config
+
+# "compact" collapses contiguous slots into per-day ranges, "full" lists every timestamp
+TOOL_RESULT_ENCODING = config("TOOL_RESULT_ENCODING", default="compact")
+# only the nearest slots are shown, the model can look up a later range if the customer wants one
+TOOL_RESULT_MAX_SLOTS = config("TOOL_RESULT_MAX_SLOTS", default=24, cast=int)
+
+
+def _parse(timestamp: str) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def _sort_key(timestamp: str) -> tuple:
+    parsed = _parse(timestamp)
+    # unparseable timestamps go last, in text order
+    return (parsed is None, parsed.timestamp() if parsed else 0.0, timestamp)
+
+
+def nearest_times(times: List[str], limit: int = TOOL_RESULT_MAX_SLOTS) -> Tuple[List[str], int]:
+    """The earliest `limit` timestamps in order, and how many were left out."""
+    ordered = sorted(set(times), key=_sort_key)
+    if limit <= 0:
+        return ordered, 0
+    return ordered[:limit], max(0, len(ordered) - limit)
+
+
+def _step_minutes(parsed: List[datetime]) -> Optional[int]:
+    gaps = [int((b - a).total_seconds() // 60) for a, b in zip(parsed, parsed[1:]) if a.date() == b.date()]
+    gaps = [g for g in gaps if g > 0]
+    return min(gaps) if gaps else None
+
+
+def collapse_times(times: List[str]) -> Optional[Tuple[Dict[str, List[str]], Optional[int]]]:
+    """
+    Group sorted timestamps by day and collapse runs one slot step apart into
+    "HH:MM-HH:MM" ranges. Returns None when a timestamp cannot be parsed.
+    """
+    parsed = [_parse(t) for t in times]
+    if not parsed or any(p is None for p in parsed):
+        return None
+    step = _step_minutes(parsed)
+    days: Dict[str, List[str]] = {}
+    run_start = run_end = None
+    for p in parsed + [None]:
+        if run_end is not None and p is not None and p.date() == run_end.date() and step \
+                and (p - run_end).total_seconds() == step * 60:
+            run_end = p
+            continue
+        if run_start is not None:
+            label = run_start.strftime("%H:%M")
+            if run_end != run_start:
+                label += f"-{run_end.strftime('%H:%M')}"
+            days.setdefault(run_start.date().isoformat(), []).append(label)
+        run_start = run_end = p
+    return days, step
+
+
+def encode_available_times(times: List[str], description: str, encoding: str = TOOL_RESULT_ENCODING) -> Dict:
+    shown, more = nearest_times(times)
+    collapsed = collapse_times(shown) if encoding == "compact" else None
+    if collapsed is None:
+        result = {
+            "description": description,
+            "instruction": "to proceed with a booking, copy one of the below valid timestamps",
+            "available_times": shown,
+        }
+    else:
+        days, step = collapsed
+        instruction = (
+            f"to proceed with a booking, pick a day and a time from the ranges below and write it "
+            f"exactly like this timestamp: {shown[0]}"
+        )
+        if step:
+            instruction += f". a range HH:MM-HH:MM has a slot every {step} minutes from start to end"
+        result = {"description": description, "instruction": instruction, "available_times": days}
+    if more:
+        result["more_available"] = f"{more} later slots not shown, check a later range to see them"
+    return result
@@ -0,0 +1,235 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+import httpx
+from decouple import config
+from src.cassette import CASSETTE_REALTIME, CassetteTurn, current_turn
+from src.telemetry import timed
+from utils.utils import logger
+
+WEBHOOK_MAX_CONNECTIONS = config("WEBHOOK_MAX_CONNECTIONS", default=50, cast=int)
+WEBHOOK_BREAKER_THRESHOLD = config("WEBHOOK_BREAKER_THRESHOLD", default=5, cast=int)
+WEBHOOK_BREAKER_RESET_SECONDS = config("WEBHOOK_BREAKER_RESET_SECONDS", default=30.0, cast=float)
+
+RETRYABLE_STATUSES = {429, 502, 503, 504}
+
+
+class WebhookError(Exception):
+    """Raised when a webhook cannot be reached after retries."""
+
+
+class CircuitOpenError(WebhookError):
+    """Raised without calling the webhook while its circuit breaker is open."""
+
+
+@dataclass
+class Endpoint:
+    name: str
+    url_env: str
+    timeout: float
+    retries: int
+    # non-idempotent endpoints are only retried when the request never left the client
+    idempotent: bool = True
+
+    @property
+    def url(self) -> str:
+        return os.getenv(self.url_env)
+
+
+ENDPOINTS = {
+    "calendar": Endpoint(
+        "calendar", "CC_WEBHOOK_URL",
+        timeout=config("CC_WEBHOOK_TIMEOUT", default=8.0, cast=float),
+        retries=config("CC_WEBHOOK_RETRIES", default=2, cast=int),
+    ),
+    "booking": Endpoint(
+        "booking", "PCP_WEBHOOK_URL",
+        timeout=config("PCP_WEBHOOK_TIMEOUT", default=15.0, cast=float),
+        retries=config("PCP_WEBHOOK_RETRIES", default=1, cast=int),
+        idempotent=False,
+    ),
+}
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures and lets one probe through after `reset_timeout`."""
+
+    def __init__(self, threshold: int = WEBHOOK_BREAKER_THRESHOLD, reset_timeout: float = WEBHOOK_BREAKER_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "half_open":
+                # let a single probe through, keep the rest out until it reports back
+                self.opened_at = time.monotonic()
+                return True
+            return state == "closed"
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+def _backoff(attempt: int, base: float = 0.25, cap: float = 4.0) -> float:
+    # exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class WebhookTransport:
+    """
+    Shared HTTP transport for the scheduling webhooks.
+
+    One keep-alive pooled client per flavour (sync and async) is reused by every
+    tool call, with per-endpoint timeouts, bounded retries with jitter and a
+    circuit breaker per endpoint.
+    """
+
+    def __init__(self, endpoints: dict[str, Endpoint] = ENDPOINTS):
+        self.endpoints = endpoints
+        self.breakers = {name: CircuitBreaker() for name in endpoints}
+        self._limits = httpx.Limits(max_connections=WEBHOOK_MAX_CONNECTIONS, max_keepalive_connections=WEBHOOK_MAX_CONNECTIONS)
+        self._client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.Client:
+        if self._client is None:
+            self._client = httpx.Client(limits=self._limits)
+        return self._client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(limits=self._limits)
+        return self._async_client
+
+    def _should_retry(self, endpoint: Endpoint, attempt: int, error: Optional[Exception], response: Optional[httpx.Response]) -> bool:
+        if attempt >= endpoint.retries:
+            return False
+        if error is not None:
+            return endpoint.idempotent or isinstance(error, httpx.ConnectError)
+        return endpoint.idempotent and response.status_code in RETRYABLE_STATUSES
+
+    def _check_breaker(self, endpoint: Endpoint) -> CircuitBreaker:
+        if not endpoint.url:
+            raise WebhookError(f"{endpoint.url_env} is not set")
+        breaker = self.breakers[endpoint.name]
+        if not breaker.allow():
+            raise CircuitOpenError(f"{endpoint.name} webhook circuit is open")
+        return breaker
+
+    def _record(self, breaker: CircuitBreaker, error: Optional[Exception], response: Optional[httpx.Response]) -> None:
+        if error is not None or response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+    def _replayed(self, entry: dict, endpoint: Endpoint) -> httpx.Response:
+        if entry.get("error"):
+            raise WebhookError(entry["error"])
+        return httpx.Response(entry["status"], text=entry["body"], request=httpx.Request("POST", endpoint.url or "http://cassette"))
+
+    def _record_exchange(
+        self, turn: Optional[CassetteTurn], endpoint: Endpoint, json: dict, start: float,
+        error: Optional[Exception], response: Optional[httpx.Response],
+    ) -> None:
+        if turn is None:
+            return
+        entry = {"endpoint": endpoint.name, "payload": json, "latency": time.perf_counter() - start}
+        if error is not None:
+            entry["error"] = f"{endpoint.name} webhook failed: {error!r}"
+        else:
+            entry.update(status=response.status_code, body=response.text)
+        turn.add_webhook(entry)
+
+    def post(self, name: str, json: dict) -> httpx.Response:
+        endpoint = self.endpoints[name]
+        turn = current_turn()
+        if turn is not None and turn.recorded is not None:
+            entry = turn.replay_webhook(endpoint.name, json)
+            time.sleep(entry["latency"] if CASSETTE_REALTIME else 0)
+            return self._replayed(entry, endpoint)
+        breaker = self._check_breaker(endpoint)
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            error, response = None, None
+            try:
+                with timed("webhook", endpoint.name):
+                    response = self.client.post(endpoint.url, json=json, timeout=endpoint.timeout)
+            except httpx.HTTPError as e:
+                error = e
+            self._record(breaker, error, response)
+            if not self._should_retry(endpoint, attempt, error, response):
+                break
+            logger.info(f"Retrying {endpoint.name} webhook (attempt {attempt + 1}): {error or response.status_code}")
+            time.sleep(_backoff(attempt))
+            attempt += 1
+        self._record_exchange(turn, endpoint, json, start, error, response)
+        if error is not None:
+            raise WebhookError(f"{endpoint.name} webhook failed: {error!r}") from error
+        return response
+
+    async def apost(self, name: str, json: dict) -> httpx.Response:
+        endpoint = self.endpoints[name]
+        turn = current_turn()
+        if turn is not None and turn.recorded is not None:
+            entry = turn.replay_webhook(endpoint.name, json)
+            await asyncio.sleep(entry["latency"] if CASSETTE_REALTIME else 0)
+            return self._replayed(entry, endpoint)
+        breaker = self._check_breaker(endpoint)
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            error, response = None, None
+            try:
+                with timed("webhook", endpoint.name):
+                    response = await self.async_client.post(endpoint.url, json=json, timeout=endpoint.timeout)
+            except httpx.HTTPError as e:
+                error = e
+            self._record(breaker, error, response)
+            if not self._should_retry(endpoint, attempt, error, response):
+                break
+            logger.info(f"Retrying {endpoint.name} webhook (attempt {attempt + 1}): {error or response.status_code}")
+            await asyncio.sleep(_backoff(attempt))
+            attempt += 1
+        self._record_exchange(turn, endpoint, json, start, error, response)
+        if error is not None:
+            raise WebhookError(f"{endpoint.name} webhook failed: {error!r}") from error
+        return response
+
+    def stats(self) -> dict:
+        return {name: {"state": b.state, "failures": b.failures} for name, b in self.breakers.items()}
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            self._client.close()
+        if self._async_client is not None:
+            await self._async_client.aclose()
+
+
+webhooks = WebhookTransport()
@@ -1,12 +1,14 @@
-import os
-import requests
+from datetime import date, timedelta
 
-from langchain import hub
 from langchain_core.pydantic_v1 import BaseModel, Field, EmailStr
-from langchain_core.tools import tool, BaseTool
+from langchain_core.tools import tool, BaseTool, StructuredTool
 from langchain.callbacks.manager import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
 from typing import Type, Optional, Dict
 from utils.agent_helpers import _prompt_text_loader
+from src.tools.availability import availability_cache, AvailabilityError
+from src.tools.encoding import encode_available_times
+from src.tools.http import webhooks, WebhookError
+from src.prompts import prompt_registry
 
 class ProjectBrief(BaseModel):
     job_headline: str = Field(..., description="a comprehensive explainatory headline title for the job")
@@ -29,67 +31,151 @@ class AppointmentBooking(BaseModel):
     address: str = Field(..., description="the place where the service will pe provided")
 
 
-@tool("check_calendar", args_schema=CheckCalendar)
-def check_calendar(start_date: str, end_date: str) -> Dict:
+def _parse_availability(response) -> tuple:
+    if response.status_code != 200:
+        raise AvailabilityError(f"{response.status_code} bad request")
+    try:
+        response_data = response.json()
+        slots = response_data.get("data", {}).get("slots", {}) or {}
+        # key every day as yyyy-mm-dd so it lines up with the cache
+        by_day = {}
+        for day, day_slots in slots.items():
+            if not all(isinstance(slot, dict) and "time" in slot for slot in day_slots):
+                raise ValueError(f"slots for {day} have no time")
+            by_day.setdefault(day[:10], []).extend(day_slots)
+        return by_day, response_data.get("description", "")
+    except (ValueError, TypeError, AttributeError) as e:
+        raise AvailabilityError(f"malformed calendar response: {e}") from e
+
+
+def _fetch_availability(start_date: date, end_date: date) -> tuple:
+    try:
+        response = webhooks.post("calendar", {"start_date": start_date.isoformat(), "end_date": end_date.isoformat()})
+    except WebhookError as e:
+        raise AvailabilityError(str(e)) from e
+    return _parse_availability(response)
+
+
+async def _afetch_availability(start_date: date, end_date: date) -> tuple:
+    try:
+        response = await webhooks.apost("calendar", {"start_date": start_date.isoformat(), "end_date": end_date.isoformat()})
+    except WebhookError as e:
+        raise AvailabilityError(str(e)) from e
+    return _parse_availability(response)
+
+
+def _parse_range(start_date: str, end_date: str) -> tuple:
+    start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    return (start, end) if start <= end else (end, start)
+
+
+def _availability_result(slots: dict, start: date, end: date) -> Dict:
+    # Extracting and flattening the time values
+    flat_times = [slot["time"] for day_slots in slots.values() for slot in day_slots]
+    result = encode_available_times(flat_times, availability_cache.description) if flat_times else {"error": "No availability found"}
+    checked_end = availability_cache.clip(start, end)
+    if checked_end < end:
+        # the cache only covers max_range days, tell the agent so it does not read the rest as booked
+        result["range_clipped"] = (
+            f"only {start.isoformat()} to {checked_end.isoformat()} was checked, "
+            f"check again from {(checked_end + timedelta(days=1)).isoformat()} for later dates"
+        )
+    return result
+
+
+def _check_calendar(start_date: str, end_date: str) -> Dict:
     """
     Check the availability of a date provided by the user in the calendar. 
     The date might not come to you in the yyyy-mm-dd format. in that case,
     convert it to the right format before calling this tool.  
     """
-    webhook_url = os.getenv("CC_WEBHOOK_URL")
-    response = requests.post(webhook_url, json={"start_date": start_date, "end_date": end_date})
-    
-    if response.status_code == 200:
-        response_data = response.json()
-        slots = response_data.get("data", {}).get("slots", {})
-        
-        if not slots:
-            return {"error": "No availability found"}
-
-        # Extracting and flattening the time values
-        flat_times = [slot["time"] for day_slots in slots.values() for slot in day_slots]
-        
-        return {
-            "description": response_data.get("description", ""),
-            "instruction": "to proceed with a booking, copy one of the below valid timestamps",
-            "available_times": flat_times
-        }
-    else:
-        return {"error": f"{response.status_code} bad request"}
+    try:
+        start, end = _parse_range(start_date, end_date)
+    except ValueError:
+        return {"error": "dates must be in yyyy-mm-dd format"}
+    # repeat lookups of the same days are served from the shared availability cache
+    try:
+        slots = availability_cache.get_range(start, end, _fetch_availability)
+    except AvailabilityError as e:
+        return {"error": str(e)}
+    return _availability_result(slots, start, end)
+
+
+async def _acheck_calendar(start_date: str, end_date: str) -> Dict:
+    try:
+        start, end = _parse_range(start_date, end_date)
+    except ValueError:
+        return {"error": "dates must be in yyyy-mm-dd format"}
+    try:
+        slots = await availability_cache.aget_range(start, end, _afetch_availability)
+    except AvailabilityError as e:
+        return {"error": str(e)}
+    return _availability_result(slots, start, end)
+
+
+check_calendar = StructuredTool.from_function(
+    func=_check_calendar,
+    coroutine=_acheck_calendar,
+    name="check_calendar",
+    args_schema=CheckCalendar,
+)
+
+
+def _invalidate_booked_day(timestamp: str) -> None:
+    try:
+        availability_cache.invalidate(date.fromisoformat(timestamp[:10]))
+    except ValueError:
+        pass
 
-book_appointment_prompt = hub.pull("book_appointment_tool")
-book_appointment_prompt
-book_appointment_tool_description = _prompt_text_loader(book_appointment_prompt)      
 class BookAppointmentTool(BaseTool):
     name = "book_appointment"
-    description = book_appointment_tool_description
+    # the real description lives in the book_appointment_tool hub prompt, see get_book_appointment_tool
+    description = "Book an appointment."
     args_schema: Type[BaseModel] = AppointmentBooking
 
     def _run(
         self, name: str, email: str, date: str, address:str,run_manager: Optional[CallbackManagerForToolRun] = None
     ) -> str:
         """Book an appointment."""
-        webhook_url = os.getenv("PCP_WEBHOOK_URL")
         payload = {
             "name": name,
             "email": email,
             "date": date,
             "address": address,
         }
-        response = requests.post(webhook_url, json=payload)
-        if response.status_code == 200:
-            return "Appointment successfully booked."
-        else:
-            return f"Failed to book appointment. Status code: {response.status_code}"
+        try:
+            response = webhooks.post("booking", payload)
+        except WebhookError as e:
+            return f"Failed to book appointment. {e}"
+        return self._result(response, date)
 
     async def _arun(
-        self, name: str, email: str, date: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None
+        self, name: str, email: str, date: str, address: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None
     ) -> str:
         """Asynchronously book an appointment."""
-        # Implement async version if needed
-        raise NotImplementedError("Async version not implemented")
+        payload = {
+            "name": name,
+            "email": email,
+            "date": date,
+            "address": address,
+        }
+        try:
+            response = await webhooks.apost("booking", payload)
+        except WebhookError as e:
+            return f"Failed to book appointment. {e}"
+        return self._result(response, date)
+
+    def _result(self, response, date: str) -> str:
+        if response.status_code == 200:
+            # the slot is gone, never offer it again from the cache
+            _invalidate_booked_day(date)
+            return "Appointment successfully booked."
+        else:
+            return f"Failed to book appointment. Status code: {response.status_code}"
       
-book_appointment = BookAppointmentTool()
+def get_book_appointment_tool() -> BookAppointmentTool:
+    description = _prompt_text_loader(prompt_registry.get("book_appointment_tool"))
+    return BookAppointmentTool(description=description)
 
 
 # @tool("cancel_booking", args_schema=CancelBooking)
@@ -0,0 +1,197 @@
+"""Per-thread LLM token and cost accounting, with budgets that downgrade the model or hand off to a human"""
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Optional
+from uuid import UUID
+from decouple import config
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from sqlalchemy import func, select
+from sqlalchemy.exc import SQLAlchemyError
+from src.db.models.llm_usage import LLMUsage
+from src.db.session import SessionLocal
+from src.db.writer import usage_writer
+from src.telemetry import Counter, register_metric
+from utils.agent_helpers import _thread_id_from_config
+from utils.cache import TTLCache
+from utils.utils import logger
+
+# USD per million prompt/completion tokens, matched on the longest model name prefix
+USAGE_PRICES = config("USAGE_PRICES", default="gpt-4o-mini:0.15/0.6,gpt-4o:2.5/10,gpt-4-turbo:10/30")
+# tokens per thread after which its turns run on the fallback models, and after which
+# the agents stop answering it and a person takes over, 0 turns a budget off
+USAGE_DOWNGRADE_TOKENS = config("USAGE_DOWNGRADE_TOKENS", default=150000, cast=int)
+USAGE_HANDOFF_TOKENS = config("USAGE_HANDOFF_TOKENS", default=300000, cast=int)
+USAGE_HANDOFF_MESSAGE = config(
+    "USAGE_HANDOFF_MESSAGE",
+    default="Thanks for your patience! A member of our team will pick up this conversation and get back to you shortly.",
+)
+USAGE_CACHE_SIZE = config("USAGE_CACHE_SIZE", default=50000, cast=int)
+USAGE_CACHE_TTL = config("USAGE_CACHE_TTL", default=24 * 3600.0, cast=float)
+
+WITHIN_BUDGET = "ok"
+DOWNGRADE = "downgrade"
+HANDOFF = "handoff"
+
+llm_cost = Counter("sweep_llm_cost_usd_total", "Estimated LLM spend", ("node", "model"))
+register_metric(llm_cost)
+
+
+def _parse_prices(value: str) -> dict[str, tuple[float, float]]:
+    prices = {}
+    for entry in filter(None, (e.strip() for e in value.split(","))):
+        model, _, rates = entry.partition(":")
+        prompt, _, completion = rates.partition("/")
+        prices[model.strip()] = (float(prompt), float(completion or prompt))
+    return prices
+
+
+PRICES = _parse_prices(USAGE_PRICES)
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, prices: dict = PRICES) -> float:
+    matches = [name for name in prices if model.startswith(name)]
+    if not matches:
+        return 0.0
+    prompt_rate, completion_rate = prices[max(matches, key=len)]
+    return (prompt_tokens * prompt_rate + completion_tokens * completion_rate) / 1_000_000
+
+
+class UsageTracker:
+    """
+    Collects the usage of every LLM call of a turn per (node, model). `end_turn`
+    hands the breakdown to the usage writer and returns the turn totals for the
+    conversation row. Running token totals per thread are kept in memory,
+    loaded from llm_usage on first use, and checked against the budgets.
+    """
+
+    def __init__(
+        self,
+        downgrade_at: int = USAGE_DOWNGRADE_TOKENS,
+        handoff_at: int = USAGE_HANDOFF_TOKENS,
+        writer=usage_writer,
+        session_factory=SessionLocal,
+    ):
+        self.downgrade_at = downgrade_at
+        self.handoff_at = handoff_at
+        self.writer = writer
+        self.session_factory = session_factory
+        self._totals = TTLCache(maxsize=USAGE_CACHE_SIZE, ttl=USAGE_CACHE_TTL)
+        # thread_id -> sender and {(node, model): [calls, prompt, completion, cost]}
+        self._turns: dict[str, tuple[Optional[str], dict[tuple[str, str], list]]] = {}
+        self._lock = threading.Lock()
+        self.downgraded = 0
+        self.handed_off = 0
+
+    def _load_total(self, thread_id: str) -> int:
+        total = self._totals.get(thread_id)
+        if total is not None:
+            return total
+        try:
+            with self.session_factory() as db:
+                total = db.execute(
+                    select(func.coalesce(func.sum(LLMUsage.prompt_tokens + LLMUsage.completion_tokens), 0))
+                    .where(LLMUsage.thread_id == uuid.UUID(thread_id))
+                ).scalar_one()
+        except (SQLAlchemyError, ValueError) as e:
+            logger.error(f"Could not load LLM usage of thread {thread_id}: {e}")
+            total = 0
+        with self._lock:
+            # calls recorded while the total was loading were not in the database yet
+            if self._totals.get(thread_id) is None:
+                self._totals.set(thread_id, int(total))
+            return self._totals.get(thread_id)
+
+    def record(self, thread_id: str, sender: Optional[str], node: str, model: str, prompt_tokens: int, completion_tokens: int) -> None:
+        self._load_total(thread_id)
+        cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        llm_cost.inc(node, model, amount=cost)
+        with self._lock:
+            _, entries = self._turns.setdefault(thread_id, (sender, {}))
+            entry = entries.setdefault((node, model), [0, 0, 0, 0.0])
+            entry[0] += 1
+            entry[1] += prompt_tokens
+            entry[2] += completion_tokens
+            entry[3] += cost
+            self._totals.set(thread_id, (self._totals.get(thread_id) or 0) + prompt_tokens + completion_tokens)
+
+    def end_turn(self, thread_id: str) -> dict:
+        """Queue the turn's per-node rows and return its totals, empty when no LLM was called."""
+        with self._lock:
+            sender, entries = self._turns.pop(thread_id, (None, {}))
+        if not entries:
+            return {}
+        now = datetime.now(timezone.utc)
+        for (node, model), (calls, prompt, completion, cost) in entries.items():
+            self.writer.add({
+                "created_at": now,
+                "thread_id": uuid.UUID(thread_id),
+                "sender": sender,
+                "node": node,
+                "model": model,
+                "calls": calls,
+                "prompt_tokens": prompt,
+                "completion_tokens": completion,
+                "cost_usd": cost,
+            })
+        return {
+            "prompt_tokens": sum(e[1] for e in entries.values()),
+            "completion_tokens": sum(e[2] for e in entries.values()),
+            "cost_usd": sum(e[3] for e in entries.values()),
+        }
+
+    def total(self, thread_id: str) -> int:
+        return self._load_total(thread_id)
+
+    def budget(self, thread_id: str) -> str:
+        total = self._load_total(thread_id)
+        if self.handoff_at and total >= self.handoff_at:
+            self.handed_off += 1
+            return HANDOFF
+        if self.downgrade_at and total >= self.downgrade_at:
+            self.downgraded += 1
+            return DOWNGRADE
+        return WITHIN_BUDGET
+
+    def stats(self) -> dict:
+        return {
+            "threads": len(self._totals),
+            "open_turns": len(self._turns),
+            "downgraded": self.downgraded,
+            "handed_off": self.handed_off,
+        }
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """Feeds the token usage of every chat model call in a graph run to the tracker."""
+
+    def __init__(self, tracker: UsageTracker):
+        self.tracker = tracker
+        self._runs: dict[UUID, tuple[str, Optional[str], str, str]] = {}
+
+    def on_chat_model_start(self, serialized: dict, messages: list, *, run_id: UUID, metadata: Optional[dict] = None, **kwargs) -> None:
+        metadata = metadata or {}
+        thread_id = _thread_id_from_config({"configurable": {"thread_id": metadata.get("thread_id")}, "metadata": metadata})
+        if not thread_id:
+            return
+        node = metadata.get("langgraph_node") or metadata.get("usage_node", "-")
+        self._runs[run_id] = (thread_id, metadata.get("user_id"), node, metadata.get("ls_model_name", "-"))
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        thread_id, sender, node, model = run
+        output = response.llm_output or {}
+        usage = output.get("token_usage") or {}
+        # the model that actually answered, which differs from the requested one after a fallback
+        model = output.get("model_name") or model
+        self.tracker.record(thread_id, sender, node, model, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._runs.pop(run_id, None)
+
+
+usage_tracker = UsageTracker()
+usage_callback = UsageCallbackHandler(usage_tracker)
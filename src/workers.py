@@ -0,0 +1,121 @@
+import asyncio
+import contextvars
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+from decouple import config
+from utils.utils import logger
+
+AGENT_WORKERS = config("AGENT_WORKERS", default=32, cast=int)
+AGENT_QUEUE_SIZE = config("AGENT_QUEUE_SIZE", default=1000, cast=int)
+AGENT_DRAIN_TIMEOUT = config("AGENT_DRAIN_TIMEOUT", default=30.0, cast=float)
+
+
+class QueueFullError(Exception):
+    """Raised when the agent queue cannot accept more work."""
+
+
+class AgentWorkerPool:
+    """
+    Bounded in-process worker pool for the agent pipeline.
+
+    Jobs are plain synchronous callables (graph invocations, DB writes, ...).
+    They are queued on an asyncio priority queue (lower runs first, FIFO within
+    a priority) and executed on a dedicated thread pool, so the event loop is
+    never blocked by LLM or webhook round-trips.
+    """
+
+    def __init__(self, concurrency: int = AGENT_WORKERS, queue_size: int = AGENT_QUEUE_SIZE):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._seq = itertools.count()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._workers: list[asyncio.Task] = []
+        self._accepting = False
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+
+    async def start(self) -> None:
+        self._queue = asyncio.PriorityQueue(maxsize=self.queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="agent")
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.concurrency)]
+        self._accepting = True
+        logger.info(f"Agent worker pool started with {self.concurrency} workers")
+
+    def submit(self, fn: Callable[..., Any], *args, priority: int = 0, **kwargs) -> asyncio.Future:
+        """Enqueue a job without waiting for it. Returns a future with the job result."""
+        if not self._accepting:
+            self.rejected += 1
+            raise QueueFullError("Agent worker pool is not accepting work")
+        future = asyncio.get_running_loop().create_future()
+        # run the job in the submitter's context so its trace ID follows it to the thread
+        context = contextvars.copy_context()
+        try:
+            self._queue.put_nowait((priority, next(self._seq), (context, fn, args, kwargs, future)))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError(f"Agent queue is full ({self.queue_size} jobs)")
+        return future
+
+    async def _worker(self, worker_id: int) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, (context, fn, args, kwargs, future) = await self._queue.get()
+            self.in_flight += 1
+            start = time.perf_counter()
+            try:
+                result = await loop.run_in_executor(self._executor, lambda: context.run(fn, *args, **kwargs))
+                self.processed += 1
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Agent worker {worker_id} failed: {e}")
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.busy_seconds += time.perf_counter() - start
+                self.in_flight -= 1
+                self._queue.task_done()
+
+    async def drain(self, timeout: float = AGENT_DRAIN_TIMEOUT) -> None:
+        """Stop accepting work, wait for queued jobs to finish, then stop the workers."""
+        self._accepting = False
+        if self._queue is None:
+            return
+        logger.info(f"Draining agent queue ({self._queue.qsize()} queued, {self.in_flight} in flight)")
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Agent queue drain timed out with {self._queue.qsize()} jobs left")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def full(self) -> bool:
+        return not self._accepting or self._queue.full()
+
+    def load(self) -> int:
+        """Jobs running or waiting for a worker."""
+        return self.in_flight + (self._queue.qsize() if self._queue else 0)
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_size": self.queue_size,
+            "in_flight": self.in_flight,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "busy_seconds": round(self.busy_seconds, 3),
+        }
+
+
+agent_pool = AgentWorkerPool()
@@ -0,0 +1,25 @@
+"""
+Settings are read by decouple at import time, so the environment is filled in
+before any app module is imported. Nothing here talks to Twilio, OpenAI or the
+webhooks, the values only have to exist.
+"""
+import os
+import tempfile
+from pathlib import Path
+
+workdir = Path(tempfile.mkdtemp(prefix="sweep-tests-"))
+
+for key, value in {
+    "TWILIO_ACCOUNT_SID": "ACtest",
+    "TWILIO_AUTH_TOKEN": "test",
+    "TWILIO_NUMBER": "+15550000000",
+    "CC_WEBHOOK_URL": "http://webhooks.invalid/calendar",
+    "PCP_WEBHOOK_URL": "http://webhooks.invalid/booking",
+    "OPENAI_API_KEY": "sk-test",
+    "DATABASE_URL": f"sqlite:///{workdir / 'test.db'}",
+    "CHECKPOINTER": "memory",
+    "CHECKPOINT_SPILL_PATH": str(workdir / "spill.sqlite"),
+    "PROMPT_CACHE_DIR": str(workdir / "prompts"),
+    "PROMPT_REFRESH_SECONDS": "0",
+}.items():
+    os.environ.setdefault(key, value)
@@ -0,0 +1,122 @@
+import asyncio
+import threading
+import time
+from datetime import date, timedelta
+from src.tools.availability import AvailabilityCache, AvailabilityError, _spans
+
+START = date(2030, 3, 1)
+
+
+class Calendar:
+    """Fetcher that answers one slot per day and remembers every span it was asked for."""
+
+    def __init__(self):
+        self.calls: list[tuple[date, date]] = []
+
+    def __call__(self, start: date, end: date):
+        self.calls.append((start, end))
+        days = (end - start).days + 1
+        return {(start + timedelta(days=i)).isoformat(): [{"time": f"{start + timedelta(days=i)}T10:00:00"}] for i in range(days)}, "30 min"
+
+
+def test_spans_collapse_contiguous_days():
+    days = [START, START + timedelta(days=1), START + timedelta(days=3)]
+    assert _spans(days) == [(START, START + timedelta(days=1)), (START + timedelta(days=3), START + timedelta(days=3))]
+
+
+def test_only_missing_spans_are_fetched():
+    cache, calendar = AvailabilityCache(), Calendar()
+    cache.get_range(START + timedelta(days=2), START + timedelta(days=3), calendar)
+    slots = cache.get_range(START, START + timedelta(days=5), calendar)
+    assert len(slots) == 6
+    assert calendar.calls[1:] == [(START, START + timedelta(days=1)), (START + timedelta(days=4), START + timedelta(days=5))]
+    assert cache.description == "30 min"
+
+
+def test_invalidation_refetches_the_day():
+    cache, calendar = AvailabilityCache(), Calendar()
+    cache.get_range(START, START + timedelta(days=2), calendar)
+    cache.invalidate(START + timedelta(days=1))
+    cache.get_range(START, START + timedelta(days=2), calendar)
+    assert calendar.calls[-1] == (START + timedelta(days=1), START + timedelta(days=1))
+    assert cache._generation == {}
+
+
+def test_invalidation_discards_a_fetch_in_flight():
+    cache = AvailabilityCache()
+    fetching, release = threading.Event(), threading.Event()
+
+    def slow(start, end):
+        fetching.set()
+        release.wait(5)
+        return Calendar()(start, end)
+
+    worker = threading.Thread(target=cache.get_range, args=(START, START, slow))
+    worker.start()
+    fetching.wait(5)
+    cache.invalidate(START)
+    release.set()
+    worker.join(5)
+    # the stale answer went back to its caller but was not cached
+    assert cache._cached(START) is None
+    assert cache._generation == {} and cache._inflight == {}
+
+
+def test_failed_fetch_is_not_cached_and_raises():
+    cache = AvailabilityCache()
+
+    def broken(start, end):
+        raise AvailabilityError("500 bad request")
+
+    try:
+        cache.get_range(START, START, broken)
+    except AvailabilityError:
+        pass
+    else:
+        raise AssertionError("expected AvailabilityError")
+    assert cache._inflight == {} and cache._days == {}
+
+
+def test_range_is_capped():
+    cache, calendar = AvailabilityCache(max_range=10), Calendar()
+    slots = cache.get_range(START, START + timedelta(days=3650), calendar)
+    assert len(slots) == 10
+    assert calendar.calls == [(START, START + timedelta(days=9))]
+
+
+def test_expired_and_excess_days_are_evicted_on_write():
+    cache, calendar = AvailabilityCache(ttl=0.01, maxsize=5), Calendar()
+    cache.get_range(START, START + timedelta(days=3), calendar)
+    time.sleep(0.02)
+    cache.get_range(START + timedelta(days=10), START + timedelta(days=10), calendar)
+    assert list(cache._days) == [START + timedelta(days=10)]
+    cache.ttl = 60
+    cache.get_range(START + timedelta(days=20), START + timedelta(days=29), calendar)
+    assert len(cache._days) == 5
+
+
+def test_clip_reports_the_last_day_covered():
+    cache = AvailabilityCache(max_range=10)
+    assert cache.clip(START, START + timedelta(days=3)) == START + timedelta(days=3)
+    assert cache.clip(START, START + timedelta(days=3650)) == START + timedelta(days=9)
+
+
+def test_cancelled_async_lookup_releases_its_days():
+    cache = AvailabilityCache()
+
+    async def hang(start, end):
+        await asyncio.sleep(60)
+
+    async def run():
+        task = asyncio.ensure_future(cache.aget_range(START, START + timedelta(days=2), hang))
+        await asyncio.sleep(0)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        else:
+            raise AssertionError("expected CancelledError")
+
+    asyncio.run(run())
+    assert cache._inflight == {} and cache._days == {}
@@ -0,0 +1,52 @@
+from langgraph.checkpoint.base import empty_checkpoint
+from src.checkpoint.bounded import BoundedMemorySaver
+
+
+def saver_with_spilled_threads(tmp_path, threads: int = 5, per_thread: int = 3) -> BoundedMemorySaver:
+    # no idle grace and a tiny budget: every thread goes back to disk right after its write
+    saver = BoundedMemorySaver(str(tmp_path / "spill.sqlite"), max_bytes=1, min_idle=0.0)
+    for t in range(threads):
+        config = {"configurable": {"thread_id": f"thread-{t}"}}
+        for step in range(per_thread):
+            checkpoint = empty_checkpoint()
+            checkpoint["channel_values"] = {"messages": [f"message {step} " * 50]}
+            config = saver.put(config, checkpoint, {"source": "loop", "step": step})
+    return saver
+
+
+def test_puts_stay_within_budget(tmp_path):
+    saver = saver_with_spilled_threads(tmp_path)
+    stats = saver.stats()
+    assert saver.resident_bytes <= saver.max_bytes
+    assert stats["spilled_threads"] == 5
+
+
+def test_unscoped_list_does_not_rehydrate(tmp_path):
+    saver = saver_with_spilled_threads(tmp_path)
+    resident, rehydrations = saver.resident_bytes, saver.rehydrations
+    items = list(saver.list(None))
+    assert len(items) == 15
+    assert {item.config["configurable"]["thread_id"] for item in items} == {f"thread-{t}" for t in range(5)}
+    assert [item.config["configurable"]["thread_ts"] for item in items] == sorted(
+        (item.config["configurable"]["thread_ts"] for item in items), reverse=True
+    )
+    assert saver.rehydrations == rehydrations
+    assert saver.resident_bytes == resident
+
+
+def test_unscoped_list_applies_limit_and_filter(tmp_path):
+    saver = saver_with_spilled_threads(tmp_path)
+    rehydrations = saver.rehydrations
+    assert len(list(saver.list(None, limit=4))) == 4
+    latest = list(saver.list(None, filter={"step": 2}))
+    assert len(latest) == 5 and all(item.metadata["step"] == 2 for item in latest)
+    assert saver.rehydrations == rehydrations
+
+
+def test_get_tuple_rehydrates_and_enforces_the_budget(tmp_path):
+    saver = saver_with_spilled_threads(tmp_path)
+    rehydrations = saver.rehydrations
+    item = saver.get_tuple({"configurable": {"thread_id": "thread-0"}})
+    assert item.metadata["step"] == 2
+    assert saver.rehydrations == rehydrations + 1
+    assert saver.resident_bytes <= saver.max_bytes
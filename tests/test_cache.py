@@ -0,0 +1,47 @@
+import asyncio
+import time
+from utils.cache import TTLCache
+from utils.ratelimit import TokenBucket
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=10, ttl=0.01)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert "a" not in cache
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_ttl_cache_add_keeps_live_values():
+    cache = TTLCache(maxsize=10, ttl=60)
+    assert cache.add("k", "first") is None
+    assert cache.add("k", "second") == "first"
+    cache.set("k", "gone", ttl=-1)
+    assert cache.add("k", "third") is None
+    assert cache.get("k") == "third"
+
+
+def test_token_bucket_bursts_then_limits():
+    bucket = TokenBucket(rate=1.0, capacity=3)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+    assert 0 < bucket.wait_time() <= 1.0
+
+
+def test_token_bucket_acquire_waits_for_refill():
+    bucket = TokenBucket(rate=100.0, capacity=1)
+    assert bucket.try_acquire()
+    start = time.monotonic()
+    asyncio.run(bucket.acquire())
+    assert time.monotonic() - start >= 0.005
@@ -0,0 +1,48 @@
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from src.history import compact_tool_results
+from src.tools.encoding import collapse_times, encode_available_times, nearest_times
+
+TIMES = [
+    "2030-03-02T09:00:00Z",
+    "2030-03-01T10:00:00Z",
+    "2030-03-01T10:30:00Z",
+    "2030-03-01T11:00:00Z",
+    "2030-03-01T14:00:00Z",
+    "2030-03-02T09:30:00Z",
+]
+
+
+def test_nearest_times_sorts_dedupes_and_counts_the_rest():
+    shown, more = nearest_times(TIMES + [TIMES[0]], limit=2)
+    assert shown == ["2030-03-01T10:00:00Z", "2030-03-01T10:30:00Z"]
+    assert more == 4
+
+
+def test_contiguous_slots_collapse_into_ranges():
+    days, step = collapse_times(sorted(TIMES))
+    assert step == 30
+    assert days == {"2030-03-01": ["10:00-11:00", "14:00"], "2030-03-02": ["09:00-09:30"]}
+
+
+def test_compact_encoding_keeps_an_exact_timestamp_to_copy():
+    result = encode_available_times(TIMES, "30 min cleaning", encoding="compact")
+    assert result["available_times"]["2030-03-01"] == ["10:00-11:00", "14:00"]
+    assert "2030-03-01T10:00:00Z" in result["instruction"]
+    assert "every 30 minutes" in result["instruction"]
+    assert "more_available" not in result
+
+
+def test_unparseable_timestamps_fall_back_to_the_full_list():
+    result = encode_available_times(TIMES + ["next tuesday"], "", encoding="compact")
+    assert result["available_times"][-1] == "next tuesday"
+    assert len(result["available_times"]) == 7
+
+
+def test_tool_results_before_a_booking_are_compacted():
+    calendar = ToolMessage(content='{"available_times": ["2030-03-01T10:00:00Z"]}', name="check_calendar", tool_call_id="1")
+    booking = ToolMessage(content="Appointment successfully booked", name="book_appointment", tool_call_id="2")
+    messages = [HumanMessage(content="book 10am"), AIMessage(content=""), calendar, AIMessage(content=""), booking]
+    compacted = compact_tool_results(messages)
+    assert "omitted" in compacted[2].content and compacted[2].tool_call_id == "1"
+    assert compacted[4] is booking
+    assert compact_tool_results(messages[:3]) == messages[:3]
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+from src.mailbox import SenderMailbox
+from src.workers import AgentWorkerPool
+
+
+async def until(predicate, timeout: float = 2.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.005)
+
+
+class Recorder:
+    """Handler and background job that log their calls, and block while a sender's gate is closed."""
+
+    def __init__(self):
+        self.jobs: list[tuple[str, str]] = []
+        self.background: list[str] = []
+        self.completed: list[tuple[list[str], bool]] = []
+        self.gates: dict[str, threading.Event] = {}
+        self.running: set[str] = set()
+
+    def _wait(self, key: str) -> None:
+        self.running.add(key)
+        gate = self.gates.get(key)
+        if gate is not None:
+            gate.wait(2)
+        self.running.discard(key)
+
+    def handler(self, query: str, sender: str, message_type: str) -> None:
+        self.jobs.append((sender, query))
+        self._wait(sender)
+
+    def summarize(self, sender: str) -> None:
+        self.background.append(sender)
+        self._wait(f"background:{sender}")
+
+    def on_complete(self, ids: list[str], ok: bool) -> None:
+        self.completed.append((ids, ok))
+
+
+async def mailbox_with(recorder: Recorder, workers: int = 2, debounce: float = 0.02, **kwargs) -> SenderMailbox:
+    pool = AgentWorkerPool(concurrency=workers, queue_size=100)
+    await pool.start()
+    return SenderMailbox(pool, recorder.handler, debounce=debounce, max_wait=1.0, on_complete=recorder.on_complete, **kwargs)
+
+
+def test_burst_is_merged_into_one_job():
+    async def run():
+        recorder = Recorder()
+        mailbox = await mailbox_with(recorder)
+        for i, body in enumerate(["hi", "I need a cleaning", "for tomorrow"]):
+            mailbox.put("+1555", "whatsapp", body, message_id=f"SM{i}")
+        assert "+1555" in mailbox
+        await until(lambda: recorder.completed)
+        await mailbox.pool.drain(1.0)
+        return recorder, mailbox
+
+    recorder, mailbox = asyncio.run(run())
+    assert recorder.jobs == [("+1555", "hi\nI need a cleaning\nfor tomorrow")]
+    assert recorder.completed == [(["SM0", "SM1", "SM2"], True)]
+    assert "+1555" not in mailbox
+
+
+def test_messages_during_a_job_are_held_and_flushed_together():
+    async def run():
+        recorder = Recorder()
+        recorder.gates["+1555"] = threading.Event()
+        mailbox = await mailbox_with(recorder)
+        mailbox.put("+1555", "sms", "first")
+        await until(lambda: "+1555" in recorder.running)
+        mailbox.put("+1555", "sms", "second")
+        mailbox.put("+1555", "sms", "third")
+        await asyncio.sleep(0.05)
+        # one job per sender at a time
+        assert len(recorder.jobs) == 1
+        recorder.gates["+1555"].set()
+        await until(lambda: len(recorder.jobs) == 2 and "+1555" not in mailbox)
+        await mailbox.pool.drain(1.0)
+        return recorder
+
+    recorder = asyncio.run(run())
+    assert recorder.jobs == [("+1555", "first"), ("+1555", "second\nthird")]
+
+
+def test_queued_background_job_is_skipped_by_the_next_message():
+    async def run():
+        recorder = Recorder()
+        recorder.gates.update({"A": threading.Event(), "B": threading.Event()})
+        mailbox = await mailbox_with(recorder, workers=1, background=recorder.summarize, background_priority=2)
+        mailbox.put("A", "sms", "hello")
+        await until(lambda: "A" in recorder.running)
+        mailbox.put("B", "sms", "hello")
+        await asyncio.sleep(0.05)
+        # A finishes while B is queued: A's summary queues behind B
+        recorder.gates["A"].set()
+        await until(lambda: "B" in recorder.running)
+        mailbox.put("A", "sms", "one more thing")
+        await asyncio.sleep(0.05)
+        assert mailbox.background_skipped == 1
+        recorder.gates["B"].set()
+        await until(lambda: len(recorder.jobs) == 3 and len(recorder.background) == 2)
+        await mailbox.pool.drain(1.0)
+        return recorder, mailbox
+
+    recorder, mailbox = asyncio.run(run())
+    assert recorder.jobs == [("A", "hello"), ("B", "hello"), ("A", "one more thing")]
+    assert sorted(recorder.background) == ["A", "B"]
+
+
+def test_running_background_job_holds_the_next_turn():
+    async def run():
+        recorder = Recorder()
+        recorder.gates["background:A"] = threading.Event()
+        mailbox = await mailbox_with(recorder, background=recorder.summarize, background_priority=2)
+        mailbox.put("A", "sms", "hello")
+        await until(lambda: "background:A" in recorder.running)
+        mailbox.put("A", "sms", "are you there?")
+        await asyncio.sleep(0.05)
+        # the summary and the turn never write the thread at once
+        assert recorder.jobs == [("A", "hello")]
+        recorder.gates["background:A"].set()
+        await until(lambda: len(recorder.jobs) == 2)
+        await mailbox.pool.drain(1.0)
+        return recorder
+
+    recorder = asyncio.run(run())
+    assert recorder.jobs == [("A", "hello"), ("A", "are you there?")]
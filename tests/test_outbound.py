@@ -0,0 +1,103 @@
+import asyncio
+import random
+import httpx
+import pytest
+from src import outbound as outbound_module
+from src.outbound import OutboundDispatcher, OutboundMessage, split_message
+from utils.ratelimit import TokenBucket
+
+
+class FakeResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.text = ""
+        self.headers = {}
+
+
+class FakeTwilio:
+    """Stands in for the pooled client, answers every POST after a random delay."""
+
+    def __init__(self, statuses=None, errors=None):
+        self.bodies: list[tuple[str, str]] = []
+        self.statuses = list(statuses or [])
+        self.errors = list(errors or [])
+
+    async def post(self, url, data):
+        await asyncio.sleep(random.uniform(0, 0.005))
+        if self.errors:
+            raise self.errors.pop(0)
+        self.bodies.append((data["To"], data["Body"]))
+        return FakeResponse(self.statuses.pop(0) if self.statuses else 201)
+
+    async def aclose(self):
+        pass
+
+
+async def started(dispatcher: OutboundDispatcher, client: FakeTwilio) -> OutboundDispatcher:
+    await dispatcher.start()
+    await dispatcher._client.aclose()
+    dispatcher._client = client
+    dispatcher.account_bucket = TokenBucket(1e6)
+    dispatcher.sender_buckets[OutboundMessage("sms", "-", []).from_] = TokenBucket(1e6)
+    return dispatcher
+
+
+def test_split_message_keeps_order_and_limit():
+    text = " ".join(f"Sentence number {i}." for i in range(200))
+    chunks = split_message(text, limit=100)
+    assert all(len(c) <= 100 for c in chunks)
+    assert " ".join(chunks) == text
+
+
+def test_send_before_start_fails_clearly():
+    with pytest.raises(RuntimeError, match="not started"):
+        OutboundDispatcher().send("sms", "+15551234567", "hello")
+
+
+def test_chunks_of_a_recipient_stay_in_order():
+    async def run():
+        client = FakeTwilio()
+        dispatcher = await started(OutboundDispatcher(workers=8), client)
+        expected = {}
+        for i in range(30):
+            to = f"+1555000000{i % 3}"
+            # long enough to go out in several chunks
+            text = f"reply {i} " + "word " * 500
+            dispatcher.send("sms", to, text)
+            expected.setdefault(to, []).extend(split_message(text))
+        await dispatcher.drain(timeout=1.0)
+        return client, dispatcher, expected
+
+    client, dispatcher, expected = asyncio.run(run())
+    for to, bodies in expected.items():
+        assert [body for recipient, body in client.bodies if recipient == to] == bodies
+    assert dispatcher._recipient_locks == {}
+
+
+def test_server_errors_are_not_retried():
+    async def run():
+        client = FakeTwilio(statuses=[500])
+        dispatcher = await started(OutboundDispatcher(workers=1), client)
+        dispatcher.send("sms", "+15551234567", "hello")
+        await dispatcher.drain(timeout=1.0)
+        return client, dispatcher
+
+    client, dispatcher = asyncio.run(run())
+    assert len(client.bodies) == 1
+    assert (dispatcher.sent, dispatcher.failed, dispatcher.retries) == (0, 1, 0)
+
+
+def test_read_timeouts_are_not_retried_but_connect_errors_are(monkeypatch):
+    monkeypatch.setattr(outbound_module.random, "uniform", lambda a, b: 0.0)
+
+    async def run(error):
+        client = FakeTwilio(errors=[error])
+        dispatcher = await started(OutboundDispatcher(workers=1), client)
+        dispatcher.send("sms", "+15551234567", "hello")
+        await dispatcher.drain(timeout=1.0)
+        return client, dispatcher
+
+    client, dispatcher = asyncio.run(run(httpx.ReadTimeout("slow")))
+    assert (len(client.bodies), dispatcher.failed, dispatcher.retries) == (0, 1, 0)
+    client, dispatcher = asyncio.run(run(httpx.ConnectError("refused")))
+    assert (len(client.bodies), dispatcher.sent, dispatcher.retries) == (1, 1, 1)
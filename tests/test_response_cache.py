@@ -0,0 +1,51 @@
+from langchain_core.messages import AIMessage, HumanMessage
+from src.response_cache import ResponseCache
+
+FAQ = "How much does a deep cleaning cost?"
+
+
+def test_faq_on_a_new_thread_is_cacheable():
+    cache = ResponseCache()
+    assert cache.is_cacheable(FAQ, {})
+    assert cache.is_stateless({})
+
+
+def test_mid_booking_thread_is_not_cached():
+    cache = ResponseCache()
+    state = {"messages": [
+        HumanMessage(content="I'd like to book a cleaning"),
+        AIMessage(content="Sure! Which day works best for you?", name="Scheduler"),
+    ]}
+    assert not cache.is_cacheable(FAQ, state)
+    assert not cache.is_stateless(state)
+
+
+def test_finished_booking_releases_the_thread():
+    cache = ResponseCache()
+    state = {"messages": [
+        HumanMessage(content="Book me for 10am please"),
+        AIMessage(content="Your appointment is confirmed for tomorrow at 10am.", name="Scheduler"),
+    ]}
+    assert cache.is_cacheable(FAQ, state)
+    # the answer may still be looked up, but one written with this thread's context is never stored
+    assert not cache.is_stateless(state)
+
+
+def test_summarized_thread_is_not_stateless():
+    assert not ResponseCache.is_stateless({"messages": [], "summary": "Customer Ana at 1 Main St"})
+
+
+def test_scheduling_questions_are_not_cacheable():
+    assert not ResponseCache().is_cacheable("Do you have availability tomorrow morning?", {})
+
+
+def test_lookup_hits_on_similar_question_and_respects_prompt_version():
+    cache = ResponseCache(threshold=0.8)
+    cache.store(FAQ, "A deep cleaning starts at $150.", "v1")
+    assert cache.lookup("how much does a deep cleaning cost", "v1") == "A deep cleaning starts at $150."
+    assert cache.lookup(FAQ, "v2") is None
+
+
+def test_faq_check_needs_no_state():
+    assert ResponseCache.is_faq(FAQ)
+    assert not ResponseCache.is_faq("Do you have availability tomorrow morning?")
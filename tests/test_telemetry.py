@@ -0,0 +1,18 @@
+from src.telemetry import Counter, Histogram
+
+
+def test_label_values_are_escaped():
+    counter = Counter("test_events_total", "Test events", ("model", "error"))
+    counter.inc('gpt"4o', "a\\b\nc")
+    assert 'test_events_total{model="gpt\\"4o",error="a\\\\b\\nc"} 1.0' in counter.render()
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_latency_seconds", "Test latency", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, "db")
+    lines = histogram.render()
+    assert 'test_latency_seconds_bucket{stage="db",le="0.1"} 1' in lines
+    assert 'test_latency_seconds_bucket{stage="db",le="1.0"} 2' in lines
+    assert 'test_latency_seconds_bucket{stage="db",le="+Inf"} 3' in lines
+    assert 'test_latency_seconds_count{stage="db"} 3' in lines
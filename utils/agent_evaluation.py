@@ -1,102 +1,254 @@
-import uuid
-import dotenv
-import os
+"""
+Offline evaluation of the support assistant against local dataset snapshots.
+
+Each dataset is a JSONL file of {"input": ..., "output": ...} examples. Every
+example is answered by the assistant prompt and graded against its reference
+answer, concurrently. Predictions and grades are cached on disk, keyed by
+prompt version, model and input, so a rerun only pays for what changed.
 
+    python -m utils.agent_evaluation snapshot          # export the LangSmith datasets once
+    python -m utils.agent_evaluation run --workers 16  # grade every snapshot
+"""
+import argparse
+import hashlib
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from datetime import datetime
-from langchain_anthropic  import ChatAnthropic
-from langchain_openai import ChatOpenAI
-from langchain import hub
-from langsmith import Client
-from langsmith.evaluation import evaluate
-from langchain_core.prompts import ChatPromptTemplate 
+from pathlib import Path
+from typing import Optional
+import dotenv
+from decouple import config
 
 dotenv.load_dotenv()
-os.environ['LANGCHAIN_PROJECT'] = "Sweep chatbot"
-os.environ['LANGCHAIN_TRACING_V2'] = "true"
-os.environ['LANGCHAIN_ENDPOINT'] = "https://api.smith.langchain.com"
-LANGCHAIN_API_KEY = os.getenv("LANGCHAIN_API_KEY")
-ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+
+EVAL_DATASET_DIR = config("EVAL_DATASET_DIR", default="evals/datasets")
+EVAL_CACHE_DIR = config("EVAL_CACHE_DIR", default=".eval_cache")
+EVAL_PROMPT_CACHE_DIR = config("EVAL_PROMPT_CACHE_DIR", default=".prompt_cache/evals")
+EVAL_MODEL = config("EVAL_MODEL", default="gpt-4o")
+EVAL_GRADER_MODEL = config("EVAL_GRADER_MODEL", default="gpt-4-turbo")
+EVAL_USER_ID = "21458856"
+
+EVAL_PROMPTS = {
+    "assistant": config("EVAL_ASSISTANT_PROMPT", default="testing_customer_support_chatbot"),
+    "grader": config("EVAL_GRADER_PROMPT", default="h20/rag-answer-vs-reference"),
+}
+
+DATASETS = [
+    "Sweep Unit Tests - Service Details",
+    "Sweep Unit Tests - Compliance",
+    "Sweep Unit Tests - Cost Estimates",
+    "Sweep Unit Tests - Discounts",
+    "Sweep Unit Tests - Feedback + Complaints",
+    "Sweep Unit Tests - Service Availability",
+    "Sweep Unit Tests - general scenerios",
+    "sweep_appointment_email",
+    "Sweep_evals_calendar_check",
+]
+
+
+def dataset_path(name: str, directory: str = EVAL_DATASET_DIR) -> Path:
+    return Path(directory) / f"{name}.jsonl"
+
+
+def load_dataset(name: str, directory: str = EVAL_DATASET_DIR) -> list[dict]:
+    with dataset_path(name, directory).open() as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def snapshot_datasets(names: list[str], directory: str = EVAL_DATASET_DIR) -> None:
+    """Export LangSmith datasets to JSONL, the only step that needs LangSmith access."""
+    from langsmith import Client
+
+    client = Client()
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    for name in names:
+        examples = client.list_examples(dataset_name=name)
+        path = dataset_path(name, directory)
+        with path.open("w") as f:
+            for example in examples:
+                f.write(json.dumps({"id": str(example.id), "input": example.inputs["input"], "output": example.outputs["output"]}) + "\n")
+        print(f"wrote {path}")
+
+
+class DiskCache:
+    """JSON records on disk, one file per key, written atomically so concurrent runs never see half a record."""
+
+    def __init__(self, directory: str = EVAL_CACHE_DIR):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        path = self.directory / f"{key}.json"
+        try:
+            return json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key: str, record: dict) -> None:
+        path = self.directory / f"{key}.json"
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(record))
+        tmp.replace(path)
 
 
+def _usage(message) -> dict:
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        return {"prompt": usage.get("input_tokens", 0), "completion": usage.get("output_tokens", 0)}
+    usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+    return {"prompt": usage.get("prompt_tokens", 0), "completion": usage.get("completion_tokens", 0)}
 
-client = Client()
 
-llm = ChatOpenAI(model="gpt-4o", temperature=1)
-assistant_prompt = hub.pull("testing_customer_support_chatbot").partial(time=datetime.now(), user_id="21458856")
-assistant = assistant_prompt | llm
-thread_id = str(uuid.uuid4())
+@dataclass
+class CaseResult:
+    dataset: str
+    score: Optional[float]
+    latency: float
+    tokens: dict
+    cached: bool
+    error: Optional[str] = None
 
-config = {
-    "configurable": {
-        "thread_id": thread_id,
+
+@dataclass
+class Evaluator:
+    """One assistant chain and one grader chain shared by every worker."""
+
+    model: str = EVAL_MODEL
+    grader_model: str = EVAL_GRADER_MODEL
+    cache: DiskCache = field(default_factory=DiskCache)
+
+    def __post_init__(self):
+        from src.llm import get_chat_model
+        from src.prompts import PromptRegistry
+
+        self.prompts = PromptRegistry(pins=EVAL_PROMPTS, cache_dir=EVAL_PROMPT_CACHE_DIR)
+        self.assistant = self.prompts.get("assistant").partial(time=datetime.now(), user_id=EVAL_USER_ID) | get_chat_model(self.model, temperature=1)
+        self.grader = self.prompts.get("grader") | get_chat_model(self.grader_model, temperature=0)
+        self.assistant_version = self.prompts.version("assistant")
+        self.grader_version = self.prompts.version("grader")
+
+    def predict(self, question: str, repeat: int) -> tuple[dict, bool]:
+        key = self.cache.key("predict", self.assistant_version, self.model, question, repeat)
+        record = self.cache.get(key)
+        if record is not None:
+            return record, True
+        start = time.perf_counter()
+        message = self.assistant.invoke({"message": ("user", question)})
+        record = {"response": message.content, "latency": time.perf_counter() - start, "tokens": _usage(message)}
+        self.cache.set(key, record)
+        return record, False
+
+    def grade(self, question: str, reference: str, prediction: str) -> tuple[dict, bool]:
+        key = self.cache.key("grade", self.grader_version, self.grader_model, question, reference, prediction)
+        record = self.cache.get(key)
+        if record is not None:
+            return record, True
+        result = self.grader.invoke({
+            "input": question,
+            "output": reference,
+            "student_answer": prediction,
+            "time": datetime.now().strftime("%m/%d/%Y"),
+        })
+        record = {"score": result["Score"]}
+        self.cache.set(key, record)
+        return record, False
+
+    def run_case(self, dataset: str, example: dict, repeat: int) -> CaseResult:
+        try:
+            prediction, predicted_cached = self.predict(example["input"], repeat)
+            grade, graded_cached = self.grade(example["input"], example["output"], prediction["response"])
+        except Exception as e:
+            return CaseResult(dataset, None, 0.0, {"prompt": 0, "completion": 0}, False, error=repr(e))
+        return CaseResult(dataset, grade["score"], prediction["latency"], prediction["tokens"], predicted_cached and graded_cached)
+
+
+def percentile(samples: list[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def summarize(results: list[CaseResult]) -> dict:
+    report = {}
+    for dataset in dict.fromkeys(r.dataset for r in results):
+        rows = [r for r in results if r.dataset == dataset]
+        scores = [float(r.score) for r in rows if r.score is not None]
+        latencies = [r.latency for r in rows if r.error is None]
+        report[dataset] = {
+            "cases": len(rows),
+            "errors": sum(1 for r in rows if r.error),
+            "cached": sum(1 for r in rows if r.cached),
+            "score": round(statistics.fmean(scores), 3) if scores else None,
+            "latency_p50": round(percentile(latencies, 0.5), 3),
+            "latency_p95": round(percentile(latencies, 0.95), 3),
+            "prompt_tokens": sum(r.tokens["prompt"] for r in rows),
+            "completion_tokens": sum(r.tokens["completion"] for r in rows),
+        }
+    return report
+
+
+def run(args: argparse.Namespace) -> dict:
+    evaluator = Evaluator(model=args.model, grader_model=args.grader_model, cache=DiskCache(args.cache_dir))
+    cases = [
+        (name, example, repeat)
+        for name in args.datasets
+        for example in load_dataset(name, args.dataset_dir)
+        for repeat in range(args.repeats)
+    ]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(lambda case: evaluator.run_case(*case), cases))
+    return {
+        "elapsed": round(time.perf_counter() - start, 3),
+        "prompts": {"assistant": evaluator.assistant_version, "grader": evaluator.grader_version},
+        "datasets": summarize(results),
+        "errors": [r.error for r in results if r.error][:10],
     }
-}
-def predict_llm_answer(example: dict) -> dict:
-  """
-  predict the llm response for answer evaluation
-  """
-  msg = {"message": ("user", example["input"])}
-  message = assistant.invoke(msg, config)
-  return {"response": message.content}
-
-#grade prompt s
-
-grade_prompt_answer_accuracy = hub.pull("h20/rag-answer-vs-reference")
-def answer_evaluator(run, example) -> dict:
-  """
-  parsing evaluator for the check_calendar tool
-  """
-  input_question = example.inputs["input"]
-  reference = example.outputs["output"]
-  prediction = run.outputs["response"]
-  
-  grader_llm = ChatOpenAI(model="gpt-4-turbo", temperature=0)
-  
-  answer_grader = grade_prompt_answer_accuracy | grader_llm
-  
-  score = answer_grader.invoke({"input":input_question,
-                                "output": reference,
-                                "student_answer": prediction,
-                                "time": datetime.now().strftime("%m/%d/%Y")})
-  
-  score = score["Score"]
-  
-  return {"key": "answer_v_reference_score", "score": score}
-    
-datasets = [
-  "Sweep Unit Tests - Service Details",
-  "Sweep Unit Tests - Compliance",
-  "Sweep Unit Tests - Cost Estimates",
-  "Sweep Unit Tests - Discounts",
-  "Sweep Unit Tests - Feedback + Complaints",
-  "Sweep Unit Tests - Service Availability",
-  "Sweep Unit Tests - general scenerios",
-  "sweep_appointment_email",
-  "Sweep_evals_calendar_check"
-]
 
-for dataset in datasets:
-  for i in range(1,4):
-    evaluate(
-      predict_llm_answer,
-      data=dataset,
-      evaluators=[answer_evaluator],
-      experiment_prefix=f"{dataset}_test {i}",
-    )
-
-
-
-  
-       
-        
-          
-            
-              
-               
-                 
-                   
-                    
-                      
-                       
-                        
-                           
+
+def print_report(report: dict) -> None:
+    print(f"elapsed: {report['elapsed']}s  prompts: {report['prompts']}")
+    print(f"{'dataset':<45}{'cases':>7}{'cached':>8}{'errors':>8}{'score':>8}{'p50 s':>8}{'p95 s':>8}{'prompt tok':>12}{'compl tok':>11}")
+    for name, row in report["datasets"].items():
+        score = "-" if row["score"] is None else row["score"]
+        print(
+            f"{name:<45}{row['cases']:>7}{row['cached']:>8}{row['errors']:>8}{score:>8}"
+            f"{row['latency_p50']:>8}{row['latency_p95']:>8}{row['prompt_tokens']:>12}{row['completion_tokens']:>11}"
+        )
+    for error in report["errors"]:
+        print(f"failed: {error}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["run", "snapshot"])
+    parser.add_argument("--datasets", nargs="+", default=DATASETS)
+    parser.add_argument("--dataset-dir", default=EVAL_DATASET_DIR)
+    parser.add_argument("--cache-dir", default=EVAL_CACHE_DIR)
+    parser.add_argument("--workers", type=int, default=8, help="cases predicted and graded at once")
+    parser.add_argument("--repeats", type=int, default=1, help="independent predictions per example")
+    parser.add_argument("--model", default=EVAL_MODEL)
+    parser.add_argument("--grader-model", default=EVAL_GRADER_MODEL)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "snapshot":
+        snapshot_datasets(args.datasets, args.dataset_dir)
+    else:
+        report = run(args)
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print_report(report)
@@ -18,3 +18,13 @@ def _print_event(event: dict, _printed: set, max_length=1500):
 
 def _prompt_text_loader(promptName: ChatPromptTemplate) -> str:
     return promptName.messages[0].prompt.template
+
+def _thread_id_from_config(config: dict) -> str | None:
+    """Conversation thread id as seen from inside a graph node.
+    langgraph hands each node a config whose thread_id is suffixed with the node name."""
+    config = config or {}
+    thread_id = (config.get("configurable") or {}).get("thread_id")
+    node = (config.get("metadata") or {}).get("langgraph_node")
+    if thread_id and node and thread_id.endswith(f"-{node}"):
+        return thread_id[: -len(node) - 1]
+    return thread_id